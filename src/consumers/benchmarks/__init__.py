@@ -0,0 +1,6 @@
+import os
+
+# Der Consumer validiert seine Konfiguration beim Import; die Benchmarks brauchen weder MinIO noch eine DLQ
+os.environ.setdefault('MINIO_SECRET_KEY', 'benchmark')
+os.environ.setdefault('DEAD_LETTER_TOPIC', '')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
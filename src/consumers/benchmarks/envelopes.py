@@ -0,0 +1,132 @@
+import json
+import random
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable
+
+from cdc_consumer.parquet_profile import TABLE_PRIMARY_KEYS
+
+from .fakes import FakeMessage
+
+# Topic-Präfix und Partitionen wie im Debezium-Connector (src/prefect/config/debezium-pg-connector.json)
+TOPIC_PREFIX = 'cdc.oltp_dabi.public'
+TOPIC_PARTITIONS = {'order_products': 4}
+
+WORDS = ['organic', 'fresh', 'frozen', 'greek', 'yogurt', 'bar', 'chocolate', 'coconut', 'sparkling',
+         'water', 'bread', 'whole', 'milk', 'free', 'range', 'eggs', 'baby', 'spinach', 'snack', 'mix']
+
+
+@dataclass(frozen=True)
+class ColumnSpec:
+    """Spalte einer OLTP-Tabelle mit Kafka-Connect-Typ und Generator für synthetische Werte."""
+    name: str
+    connect_type: str
+    generate: Callable[[random.Random, int], object]
+    semantic_type: str | None = None
+    optional: bool = True
+
+
+def _words(rng: random.Random, count: int) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(count)).title()
+
+
+def _order_date(rng: random.Random, key: int) -> int:
+    # Timestamp ohne Zeitzone wird von Debezium als Mikrosekunden seit Epoch (MicroTimestamp) geliefert
+    return 1_704_067_200_000_000 + key * 60_000_000 + rng.randrange(60_000_000)
+
+
+# Spalten der sechs Tabellen aus src/prefect/oltp_schema.py (Primärschlüssel zuerst)
+TABLE_COLUMNS: dict[str, list[ColumnSpec]] = {
+    'users': [
+        ColumnSpec('user_id', 'int64', lambda rng, key: key, optional=False),
+    ],
+    'departments': [
+        ColumnSpec('department_id', 'int32', lambda rng, key: key, optional=False),
+        ColumnSpec('department', 'string', lambda rng, key: _words(rng, 2)),
+    ],
+    'aisles': [
+        ColumnSpec('aisle_id', 'int32', lambda rng, key: key, optional=False),
+        ColumnSpec('aisle', 'string', lambda rng, key: _words(rng, 3)),
+    ],
+    'products': [
+        ColumnSpec('product_id', 'int64', lambda rng, key: key, optional=False),
+        ColumnSpec('product_name', 'string', lambda rng, key: _words(rng, rng.randint(2, 6))),
+        ColumnSpec('aisle_id', 'int32', lambda rng, key: rng.randint(1, 134)),
+        ColumnSpec('department_id', 'int32', lambda rng, key: rng.randint(1, 21)),
+    ],
+    'orders': [
+        ColumnSpec('order_id', 'int64', lambda rng, key: key, optional=False),
+        ColumnSpec('user_id', 'int64', lambda rng, key: rng.randint(1, 206_209), optional=False),
+        ColumnSpec('order_date', 'int64', _order_date, semantic_type='io.debezium.time.MicroTimestamp', optional=False),
+        ColumnSpec('tip_given', 'boolean', lambda rng, key: rng.choice([True, False, None])),
+    ],
+    'order_products': [
+        # Zusammengesetzter Schlüssel: ca. 10 Positionen pro Bestellung
+        ColumnSpec('order_id', 'int64', lambda rng, key: key // 10 + 1, optional=False),
+        ColumnSpec('product_id', 'int64', lambda rng, key: key % 10 * 5_000 + key // 10 % 5_000 + 1, optional=False),
+        ColumnSpec('add_to_cart_order', 'int32', lambda rng, key: key % 10 + 1),
+    ],
+}
+
+
+def _connect_schema(table_name: str) -> dict:
+    """Wert-Schema des JsonConverters (schemas.enable) nach der unwrap-Transformation."""
+    fields = [
+        {'type': column.connect_type, 'optional': column.optional, 'field': column.name,
+         **({'name': column.semantic_type, 'version': 1} if column.semantic_type else {})}
+        for column in TABLE_COLUMNS[table_name]
+    ]
+    fields += [
+        {'type': 'string', 'optional': True, 'field': '__op'},
+        {'type': 'int64', 'optional': True, 'field': '__ts_ms'},
+        {'type': 'string', 'optional': True, 'field': '__deleted'},
+    ]
+    return {'type': 'struct', 'fields': fields, 'optional': False, 'name': f"{TOPIC_PREFIX}.{table_name}.Value"}
+
+
+def generate_messages(
+    table_name: str,
+    event_count: int,
+    seed: int = 42,
+    update_ratio: float = 0.2,
+    delete_ratio: float = 0.02,
+    days: int = 1,
+) -> list[FakeMessage]:
+    """
+    Erzeugt event_count Kafka-Nachrichten im Format des Debezium-Connectors (JsonConverter mit Schema,
+    ExtractNewRecordState mit delete.handling.mode=rewrite und add.fields=op,ts_ms).
+    Ein Anteil update_ratio bzw. delete_ratio der Events ändert bzw. löscht bereits erzeugte Schlüssel;
+    die Event-Zeitpunkte verteilen sich gleichmäßig über days Tage.
+    """
+    rng = random.Random(seed)
+    topic_name = f"{TOPIC_PREFIX}.{table_name}"
+    partition_count = TOPIC_PARTITIONS.get(table_name, 1)
+    columns = TABLE_COLUMNS[table_name]
+    schema = _connect_schema(table_name)
+
+    start_ms = int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp() * 1000)
+    step_ms = days * 86_400_000 / max(event_count, 1)
+    next_offsets = [0] * partition_count
+    created_keys = 0
+    messages = []
+    for event_index in range(event_count):
+        roll = rng.random()
+        if created_keys and roll < delete_ratio:
+            op, key = 'd', rng.randrange(created_keys) + 1
+        elif created_keys and roll < delete_ratio + update_ratio:
+            op, key = 'u', rng.randrange(created_keys) + 1
+        else:
+            created_keys += 1
+            op, key = 'c', created_keys
+
+        row = {column.name: column.generate(rng, key) for column in columns}
+        payload = {**row, '__op': op, '__ts_ms': start_ms + int(event_index * step_ms), '__deleted': 'true' if op == 'd' else 'false'}
+        key_payload = {name: row[name] for name in TABLE_PRIMARY_KEYS[table_name]}
+        partition = hash(tuple(key_payload.values())) % partition_count
+        messages.append(FakeMessage(
+            topic_name, partition, next_offsets[partition],
+            key=json.dumps({'payload': key_payload}).encode('utf-8'),
+            value=json.dumps({'schema': schema, 'payload': payload}).encode('utf-8'),
+        ))
+        next_offsets[partition] += 1
+    return messages
@@ -0,0 +1,71 @@
+class FakeMessage:
+    """Kafka-Nachricht mit der Schnittstelle von confluent_kafka.Message, soweit sie der Consumer nutzt."""
+
+    __slots__ = ('_topic', '_partition', '_offset', '_key', '_value')
+
+    def __init__(self, topic: str, partition: int, offset: int, key: bytes | None, value: bytes | None):
+        self._topic = topic
+        self._partition = partition
+        self._offset = offset
+        self._key = key
+        self._value = value
+
+    def topic(self) -> str:
+        return self._topic
+
+    def partition(self) -> int:
+        return self._partition
+
+    def offset(self) -> int:
+        return self._offset
+
+    def key(self) -> bytes | None:
+        return self._key
+
+    def value(self) -> bytes | None:
+        return self._value
+
+    def error(self):
+        return None
+
+
+class InMemoryConsumer:
+    """Liefert vorbereitete Nachrichten über poll() bzw. consume(), ohne Broker und ohne Wartezeit."""
+
+    def __init__(self, messages: list[FakeMessage]):
+        self._messages = messages
+        self._position = 0
+
+    def poll(self, timeout: float | None = None) -> FakeMessage | None:
+        if self._position >= len(self._messages):
+            return None
+        msg = self._messages[self._position]
+        self._position += 1
+        return msg
+
+    def consume(self, num_messages: int = 1, timeout: float | None = None) -> list[FakeMessage]:
+        batch = self._messages[self._position:self._position + num_messages]
+        self._position += len(batch)
+        return batch
+
+
+class InMemoryMinio:
+    """Nimmt Uploads wie Minio.put_object entgegen und merkt sich nur Objektnamen und Größen."""
+
+    def __init__(self):
+        self.object_sizes: dict[str, int] = {}
+
+    def put_object(self, bucket_name: str, object_name: str, data, length: int,
+                   content_type: str = 'application/octet-stream', part_size: int = 0, num_parallel_uploads: int = 3):
+        if length >= 0:
+            size = len(data.read(length))
+        else:
+            # Multipart Upload mit unbekannter Länge: Teile lesen, bis der Stream EOF meldet
+            size = 0
+            while chunk := data.read(part_size or 5 * 1024 * 1024):
+                size += len(chunk)
+        self.object_sizes[object_name] = size
+
+    @property
+    def bytes_written(self) -> int:
+        return sum(self.object_sizes.values())
@@ -0,0 +1,209 @@
+"""
+Micro-Benchmarks für den Hot Path des CDC Consumers (Dekodierung, Transformation, Parquet-Kodierung).
+Kafka und MinIO werden durch In-Memory-Stellvertreter ersetzt. Aufruf aus src/consumers:
+
+    uv run python -m benchmarks.run --events 100000 --output results.json [--baseline baseline.json]
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from io import BytesIO
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from cdc_consumer import config
+from cdc_consumer.batch_writer import write_partition_file
+from cdc_consumer.buffers import ColumnarTopicBuffer, RecordTopicBuffer
+from cdc_consumer.kafka_handler import consume_batch, consume_message
+from cdc_consumer.message_processor import (
+    transform_payloads_to_dataframe, prepare_dataframe_for_parquet_storage,
+    transform_column_buffer_to_table, prepare_table_for_parquet_storage,
+)
+from cdc_consumer.parquet_profile import prepare_parquet_write
+
+from .envelopes import TABLE_COLUMNS, generate_messages
+from .fakes import InMemoryConsumer, InMemoryMinio
+
+# Konfiguration, die die Ergebnisse beeinflusst; wird mit abgelegt, damit Vergleiche nachvollziehbar bleiben
+RELEVANT_SETTINGS = [
+    'MESSAGE_BUFFER_FORMAT', 'VECTORIZED_JSON_DECODE', 'KAFKA_BATCH_SIZE', 'PARTITION_BY_HOUR',
+    'PARQUET_COMPRESSION', 'PARQUET_COMPRESSION_LEVEL', 'PARQUET_ROW_GROUP_SIZE', 'PARQUET_DICTIONARY_MAX_RATIO',
+    'PARQUET_WRITE_PAGE_INDEX', 'PARQUET_SORT_BY_KEY', 'PARQUET_BLOOM_FILTERS', 'PARQUET_PROFILE_OVERRIDES',
+    'COMPACTION_TABLES', 'COMPACTION_KEEP_HISTORY', 'MINIO_STREAMING_UPLOAD_MIN_BYTES',
+]
+
+
+def _frame_bytes(frame: pd.DataFrame | pa.Table) -> int:
+    if isinstance(frame, pd.DataFrame):
+        return int(frame.memory_usage(index=False, deep=True).sum())
+    return frame.nbytes
+
+
+def _encode_partitions(partitions: list, table_name: str) -> int:
+    """Kodiert jede Datei wie write_dataframe_to_minio in einen In-Memory Buffer und gibt die Parquet-Bytes zurück."""
+    encoded_bytes = 0
+    for frame, _ in partitions:
+        table, write_options, row_group_size = prepare_parquet_write(frame, table_name)
+        out_buffer = BytesIO()
+        pq.write_table(table, out_buffer, row_group_size=row_group_size, **write_options)
+        encoded_bytes += out_buffer.tell()
+    return encoded_bytes
+
+
+def _write_partitions(partitions: list, table_name: str, topic_name: str) -> InMemoryMinio:
+    """Schreibt die Dateien über write_partition_file (inkl. Kompaktierung und Multipart) in den In-Memory-Speicher."""
+    minio_client = InMemoryMinio()
+    for frame, partition_info in partitions:
+        if not write_partition_file(minio_client, frame, table_name, partition_info, topic_name):
+            raise RuntimeError(f"Datei für Tabelle '{table_name}' ({partition_info}) konnte nicht geschrieben werden.")
+    return minio_client
+
+
+def _measure(results: dict, stage: str, event_count: int, repeat: int, run, output_bytes):
+    """Führt run() repeat-mal aus und speichert die schnellste Ausführung. Gibt das Ergebnis von run() zurück."""
+    best_seconds = float('inf')
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        output = run()
+        best_seconds = min(best_seconds, time.perf_counter() - start_time)
+    size = output_bytes(output)
+    results[stage] = {
+        'events': event_count,
+        'seconds': round(best_seconds, 6),
+        'events_per_second': round(event_count / best_seconds, 1) if best_seconds else None,
+        'bytes_per_event': round(size / event_count, 2) if event_count else None,
+    }
+    return output
+
+
+def benchmark_table(table_name: str, messages: list, repeat: int) -> dict[str, dict]:
+    """
+    Misst beide Pfade des Consumers für ein Topic:
+    poll() pro Nachricht mit Listen-Puffer und Pandas (decode_single, transform, prepare, parquet_encode, write)
+    sowie consume() mit spaltenorientiertem Puffer und Arrow (decode_batch, *_columnar).
+    bytes_per_event: Kafka-Nachricht (decode), Arbeitsspeicher (transform, prepare) bzw. Parquet (encode, write).
+    """
+    topic_name = messages[0].topic()
+    input_bytes = sum(len(msg.value()) for msg in messages)
+    event_count = len(messages)
+    results = {}
+
+    def decode_single():
+        message_buffer = defaultdict(RecordTopicBuffer)
+        consumer = InMemoryConsumer(messages)
+        for _ in range(event_count):
+            consume_message(consumer, message_buffer)
+        return message_buffer[topic_name]
+
+    def decode_batch():
+        message_buffer = defaultdict(ColumnarTopicBuffer)
+        consumer = InMemoryConsumer(messages)
+        while consume_batch(consumer, message_buffer):
+            pass
+        return message_buffer[topic_name]
+
+    record_buffer = _measure(results, 'decode_single', event_count, repeat, decode_single, lambda _: input_bytes)
+    dataframe = _measure(results, 'transform', event_count, repeat,
+                         lambda: transform_payloads_to_dataframe(record_buffer, topic_name), _frame_bytes)
+    partitions = _measure(results, 'prepare', event_count, repeat,
+                          lambda: prepare_dataframe_for_parquet_storage(dataframe),
+                          lambda output: sum(_frame_bytes(frame) for frame, _ in output))
+    _measure(results, 'parquet_encode', event_count, repeat, lambda: _encode_partitions(partitions, table_name), lambda output: output)
+    _measure(results, 'write', event_count, repeat,
+             lambda: _write_partitions(partitions, table_name, topic_name), lambda output: output.bytes_written)
+
+    column_buffer = _measure(results, 'decode_batch', event_count, repeat, decode_batch, lambda _: input_bytes)
+    table = _measure(results, 'transform_columnar', event_count, repeat,
+                     lambda: transform_column_buffer_to_table(column_buffer, topic_name), _frame_bytes)
+    table_partitions = _measure(results, 'prepare_columnar', event_count, repeat,
+                                lambda: prepare_table_for_parquet_storage(table),
+                                lambda output: sum(_frame_bytes(frame) for frame, _ in output))
+    _measure(results, 'parquet_encode_columnar', event_count, repeat,
+             lambda: _encode_partitions(table_partitions, table_name), lambda output: output)
+    _measure(results, 'write_columnar', event_count, repeat,
+             lambda: _write_partitions(table_partitions, table_name, topic_name), lambda output: output.bytes_written)
+    return results
+
+
+def compare_results(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Vergleicht events_per_second mit einer früheren Ergebnisdatei. Gibt die Regressionen (Einbruch > tolerance) zurück."""
+    if current['settings'] != baseline.get('settings'):
+        print("Hinweis: Einstellungen weichen von der Baseline ab, die Werte sind nur bedingt vergleichbar.")
+    regressions = []
+    for table_name, stages in current['results'].items():
+        for stage, result in stages.items():
+            baseline_result = baseline.get('results', {}).get(table_name, {}).get(stage)
+            if not baseline_result or not baseline_result.get('events_per_second') or not result['events_per_second']:
+                continue
+            change = result['events_per_second'] / baseline_result['events_per_second'] - 1
+            marker = ''
+            if change < -tolerance:
+                marker = '  REGRESSION'
+                regressions.append(f"{table_name}/{stage}")
+            print(f"{table_name:<15} {stage:<24} {baseline_result['events_per_second']:>12,.0f} -> {result['events_per_second']:>12,.0f} events/s ({change:+.1%}){marker}")
+    return regressions
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Micro-Benchmarks für Dekodierung, Transformation und Parquet-Kodierung des CDC Consumers.")
+    parser.add_argument('--tables', nargs='+', default=list(TABLE_COLUMNS), choices=list(TABLE_COLUMNS), help="Zu messende Tabellen (Standard: alle sechs).")
+    parser.add_argument('--events', type=int, default=100_000, help="Anzahl synthetischer Events pro Tabelle.")
+    parser.add_argument('--repeat', type=int, default=3, help="Wiederholungen pro Stufe; gewertet wird die schnellste.")
+    parser.add_argument('--update-ratio', type=float, default=0.2, help="Anteil Updates bereits erzeugter Schlüssel.")
+    parser.add_argument('--delete-ratio', type=float, default=0.02, help="Anteil Deletes bereits erzeugter Schlüssel.")
+    parser.add_argument('--days', type=int, default=1, help="Zeitraum der Events in Tagen (bestimmt die Anzahl Event-Time-Partitionen).")
+    parser.add_argument('--seed', type=int, default=42, help="Seed für die synthetischen Daten.")
+    parser.add_argument('--output', default='benchmark_results.json', help="Zieldatei für die Ergebnisse (JSON).")
+    parser.add_argument('--baseline', help="Frühere Ergebnisdatei zum Vergleich; Exit Code 1 bei Regressionen.")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="Erlaubter Einbruch der events/s gegenüber der Baseline.")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    report = {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'pandas': pd.__version__,
+            'pyarrow': pa.__version__,
+        },
+        'settings': {
+            'events': args.events, 'repeat': args.repeat, 'update_ratio': args.update_ratio,
+            'delete_ratio': args.delete_ratio, 'days': args.days, 'seed': args.seed,
+            **{name: getattr(config, name) for name in RELEVANT_SETTINGS},
+        },
+        'results': {},
+    }
+
+    for table_name in args.tables:
+        messages = generate_messages(
+            table_name, args.events, seed=args.seed,
+            update_ratio=args.update_ratio, delete_ratio=args.delete_ratio, days=args.days,
+        )
+        report['results'][table_name] = benchmark_table(table_name, messages, args.repeat)
+        for stage, result in report['results'][table_name].items():
+            print(f"{table_name:<15} {stage:<24} {result['events_per_second']:>12,.0f} events/s {result['bytes_per_event']:>10.1f} bytes/event")
+
+    with open(args.output, 'w', encoding='utf-8') as output_file:
+        json.dump(report, output_file, indent=2, default=str)
+    print(f"Ergebnisse gespeichert: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            regressions = compare_results(report, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} Regression(en) gegenüber {args.baseline}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,2 @@
+# config zuerst laden: validate_critical_config() importiert parquet_profile, das seinerseits config braucht
+from . import config
@@ -0,0 +1,51 @@
+from confluent_kafka import Consumer, KafkaException
+
+from .config import get_logger
+
+logger = get_logger(__name__)
+
+
+class BackpressureController:
+    """
+    Pausiert alle zugewiesenen Kafka-Partitionen, sobald die gepufferte Datenmenge die
+    High-Water-Mark überschreitet, und setzt den Konsum unterhalb der Low-Water-Mark fort.
+    Während der Pause wird weiter gepollt (Heartbeats, Rebalances), es kommen aber keine
+    neuen Nachrichten hinzu, sodass der Speicherverbrauch bei anhaltender Überlast flach bleibt.
+    """
+
+    def __init__(self, high_water_bytes: int, low_water_bytes: int):
+        self.high_water_bytes = high_water_bytes
+        self.low_water_bytes = min(low_water_bytes, high_water_bytes)
+        self.paused = False
+        self._paused_partitions: set[tuple[str, int]] = set()
+
+    def update(self, consumer: Consumer, buffered_bytes: int) -> None:
+        """Prüft die Water-Marks und pausiert bzw. setzt die Partitionen fort."""
+        try:
+            if not self.paused and buffered_bytes >= self.high_water_bytes:
+                logger.warning(f"Puffer-High-Water-Mark erreicht ({buffered_bytes} >= {self.high_water_bytes} Bytes). Pausiere Konsum.")
+                self.paused = True
+                self._pause_new_partitions(consumer)
+            elif self.paused and buffered_bytes <= self.low_water_bytes:
+                logger.info(f"Puffer unter Low-Water-Mark ({buffered_bytes} <= {self.low_water_bytes} Bytes). Setze Konsum fort.")
+                self.resume(consumer)
+            elif self.paused:
+                # Nach einem Rebalance neu zugewiesene Partitionen ebenfalls pausieren
+                self._pause_new_partitions(consumer)
+        except KafkaException as e:
+            logger.error(f"Fehler beim Pausieren/Fortsetzen der Kafka-Partitionen: {e}", exc_info=True)
+
+    def resume(self, consumer: Consumer) -> None:
+        assignment = consumer.assignment()
+        if assignment:
+            consumer.resume(assignment)
+        self.paused = False
+        self._paused_partitions = set()
+
+    def _pause_new_partitions(self, consumer: Consumer) -> None:
+        assignment = consumer.assignment()
+        new_partitions = [tp for tp in assignment if (tp.topic, tp.partition) not in self._paused_partitions]
+        if new_partitions:
+            consumer.pause(new_partitions)
+            self._paused_partitions.update((tp.topic, tp.partition) for tp in new_partitions)
+            logger.info(f"{len(new_partitions)} Partitionen pausiert.")
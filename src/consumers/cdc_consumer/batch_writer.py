@@ -0,0 +1,252 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from dataclasses import dataclass
+
+import pyarrow as pa
+
+from .buffers import ColumnarTopicBuffer, create_retry_buffer
+from . import config
+from .config import get_logger
+from .message_processor import (
+    transform_payloads_to_dataframe, prepare_dataframe_for_parquet_storage,
+    transform_column_buffer_to_table, prepare_table_for_parquet_storage,
+    min_offsets_by_partition,
+)
+from .compaction import is_compaction_enabled, compact_latest_per_key
+from .metrics import FLUSH_DURATION, FLUSH_MESSAGES, TRANSFORM_DURATION, FILES_SPILLED
+from .manifest import build_manifest_entry, write_manifest
+from .minio_handler import build_object_file_name, build_object_prefix, is_storage_error, write_dataframe_to_minio
+from .schema_cache import conform_to_topic_schema
+from .spill import get_spill_store
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class TopicWriteResult:
+    """
+    Ergebnis des Schreibens eines Topic-Puffers.
+    commit_offsets enthält pro Partition den nächsten zu lesenden Offset, bis zu dem alle
+    Nachrichten dauerhaft in MinIO liegen. failed_buffer enthält die Zeilen der nicht
+    geschriebenen Dateien für den nächsten Versuch (None, wenn alles geschrieben wurde).
+    files_written zählt die hochgeladenen Dateien (für den Prefect-Trigger des Zyklus).
+    """
+    topic_name: str
+    topic_buffer: object
+    commit_offsets: dict[int, int]
+    failed_buffer: object | None = None
+    files_written: int = 0
+
+    @property
+    def success(self) -> bool:
+        return self.failed_buffer is None
+
+
+def _committable_offsets(topic_buffer, failed_frames: list) -> dict[int, int]:
+    """
+    Pro Partition ist bis zum niedrigsten Offset der fehlgeschlagenen Dateien alles geschrieben;
+    Partitionen ohne fehlgeschlagene Zeilen können vollständig committet werden.
+    """
+    next_offsets = topic_buffer.next_offsets()
+    for frame in failed_frames:
+        failed_offsets = min_offsets_by_partition(frame)
+        if failed_offsets is None:
+            # Herkunft der Zeilen unbekannt: sicherheitshalber nichts committen
+            return {}
+        for partition, offset in failed_offsets.items():
+            next_offsets[partition] = min(next_offsets.get(partition, offset), offset)
+    return next_offsets
+
+
+def write_partition_file(
+    minio_client, frame, table_name: str, partition_info: dict, topic_name: str,
+    base_prefix: str = 'cdc_events', history_prefix: str | None = None, manifest_entries: list | None = None,
+    write_errors: list | None = None,
+) -> bool:
+    """
+    Schreibt die Datei einer Event-Time- und Kafka-Partition. Bei aktiver Kompaktierung wird
+    zuerst (optional) die vollständige Historie und dann nur das letzte Event pro Schlüssel
+    geschrieben, beide unter dem Dateinamen des vollständigen Offset-Bereichs.
+    history_prefix ist standardmäßig COMPACTION_HISTORY_PREFIX. Ist manifest_entries gesetzt,
+    wird die unter base_prefix geschriebene Datei dort als ManifestEntry angehängt, write_errors
+    sammelt die Fehler fehlgeschlagener Uploads.
+    """
+    file_name = build_object_file_name(frame, table_name, topic_name)
+    if is_compaction_enabled(table_name):
+        if config.COMPACTION_KEEP_HISTORY and not write_dataframe_to_minio(
+            minio_client, frame, table_name, partition_info, topic_name,
+            base_prefix=history_prefix or config.COMPACTION_HISTORY_PREFIX, file_name=file_name, write_errors=write_errors,
+        ):
+            return False
+        compacted_frame = compact_latest_per_key(frame, table_name)
+        if len(compacted_frame) < len(frame):
+            logger.info(f"Kompaktierung für Tabelle '{table_name}': {len(frame)} -> {len(compacted_frame)} Zeilen.")
+        frame = compacted_frame
+
+    if not write_dataframe_to_minio(minio_client, frame, table_name, partition_info, topic_name, base_prefix=base_prefix, file_name=file_name, write_errors=write_errors):
+        return False
+    if manifest_entries is not None and len(frame) > 0:
+        object_key = f"{build_object_prefix(table_name, partition_info, base_prefix)}/{file_name}"
+        manifest_entries.append(build_manifest_entry(object_key, frame, table_name))
+    return True
+
+
+def write_topic_buffer(
+    minio_client, topic_name: str, topic_buffer,
+    base_prefix: str = 'cdc_events', history_prefix: str | None = None,
+) -> TopicWriteResult:
+    """
+    Transformiert den Puffer eines Topics und schreibt ihn als Parquet nach MinIO
+    (unter base_prefix, der Replay-Modus schreibt in ein eigenes Präfix).
+    Schlägt nur ein Teil der Dateien fehl, werden die Offsets der geschriebenen Dateien trotzdem
+    freigegeben und nur die fehlgeschlagenen Zeilen für den nächsten Versuch zurückgegeben.
+    """
+    start_time = time.perf_counter()
+    try:
+        return _write_topic_buffer(minio_client, topic_name, topic_buffer, base_prefix, history_prefix)
+    finally:
+        FLUSH_DURATION.labels(topic=topic_name).observe(time.perf_counter() - start_time)
+
+
+def _write_topic_buffer(minio_client, topic_name: str, topic_buffer, base_prefix: str, history_prefix: str | None) -> TopicWriteResult:
+    table_name = topic_name.split('.')[-1] # Einfache Extraktion, ggf. anpassen
+    logger.info(f"Verarbeite Batch für Topic '{topic_name}' (Tabelle: '{table_name}') mit {len(topic_buffer)} Nachrichten.")
+
+    # 1. Nachrichten transformieren (Arrow-Tabelle bei spaltenorientiertem Puffer, sonst DataFrame)
+    transform_start = time.perf_counter()
+    if isinstance(topic_buffer, ColumnarTopicBuffer):
+        processed_df = transform_column_buffer_to_table(topic_buffer, topic_name)
+    else:
+        processed_df = transform_payloads_to_dataframe(topic_buffer, topic_name)
+    if processed_df is None or len(processed_df) == 0:
+        logger.info(f"Keine validen Daten für Topic '{topic_name}' nach Transformation. Nachrichten werden aus Puffer entfernt.")
+        return TopicWriteResult(topic_name, topic_buffer, topic_buffer.next_offsets())
+    if config.TOPIC_SCHEMA_CACHE:
+        # Stabiles Schema pro Topic statt erneuter Typableitung (DataFrames werden dabei zu Arrow-Tabellen)
+        processed_df = conform_to_topic_schema(topic_name, processed_df)
+    TRANSFORM_DURATION.labels(topic=topic_name).observe(time.perf_counter() - transform_start)
+
+    # 2. Für Parquet vorbereiten (Spalten entfernen, nach Event-Time-Partition aufteilen)
+    if isinstance(processed_df, pa.Table):
+        partitions = prepare_table_for_parquet_storage(processed_df)
+    else:
+        partitions = prepare_dataframe_for_parquet_storage(processed_df)
+    if not partitions: # Zusätzliche Prüfung
+        logger.warning(f"DataFrame für Topic '{topic_name}' wurde nach Vorbereitung für Parquet leer. Überspringe Schreibvorgang.")
+        return TopicWriteResult(topic_name, topic_buffer, topic_buffer.next_offsets())
+
+    # 3. Nach MinIO schreiben (eine Datei pro Event-Time- und Kafka-Partition, ggf. kompaktiert)
+    # Fehlgeschlagene Dateien werden unkompaktiert wiederholt, damit Offsets und Historie vollständig bleiben
+    manifest_entries = []
+    written_partitions = []
+    failed_partitions = []
+    # Nur Dateien, die an MinIO bzw. der Verbindung gescheitert sind, werden lokal abgelegt; Fehler in den
+    # Daten selbst würden sich beim Abarbeiten des Segments wiederholen und bleiben im Puffer
+    spillable_partitions = []
+    for df_for_parquet, partition_info in partitions:
+        write_errors = []
+        if write_partition_file(minio_client, df_for_parquet, table_name, partition_info, topic_name, base_prefix, history_prefix, manifest_entries, write_errors):
+            written_partitions.append((df_for_parquet, partition_info))
+        elif write_errors and all(is_storage_error(error) for error in write_errors):
+            spillable_partitions.append((df_for_parquet, partition_info))
+        else:
+            failed_partitions.append((df_for_parquet, partition_info))
+    # Ein Manifest pro Schreibrunde, damit der DWH Flow nicht den ganzen Bucket listen muss. Ohne Manifest
+    # würde der Flow die Dateien nur beim nächsten Abgleich finden: die Runde gilt dann als fehlgeschlagen
+    if written_partitions and not write_manifest(minio_client, manifest_entries, base_prefix):
+        logger.error(f"Manifest für Topic '{topic_name}' fehlgeschlagen. {len(written_partitions)} Datei(en) werden erneut geschrieben.")
+        spillable_partitions += written_partitions
+        written_partitions = []
+    files_written = len(written_partitions)
+
+    # 4. An MinIO gescheiterte Dateien lokal ablegen (SPILL_DIR); lokal abgelegte Zeilen gelten als dauerhaft geschrieben
+    spill_store = get_spill_store()
+    if spillable_partitions and spill_store:
+        spilled_count = len(spillable_partitions)
+        spillable_partitions = [
+            (df_for_parquet, partition_info) for df_for_parquet, partition_info in spillable_partitions
+            if not spill_store.spill(df_for_parquet, table_name, partition_info, topic_name, base_prefix, history_prefix)
+        ]
+        FILES_SPILLED.labels(table=table_name).inc(spilled_count - len(spillable_partitions))
+    failed_partitions += spillable_partitions
+
+    failed_frames = [df_for_parquet for df_for_parquet, _ in failed_partitions]
+    FLUSH_MESSAGES.labels(topic=topic_name).inc(len(processed_df) - sum(len(frame) for frame in failed_frames))
+    if failed_frames:
+        logger.error(f"FEHLER beim Schreiben des Batches für Topic '{topic_name}' nach MinIO ({len(failed_frames)} von {len(partitions)} Dateien fehlgeschlagen).")
+        return TopicWriteResult(
+            topic_name, topic_buffer,
+            commit_offsets=_committable_offsets(topic_buffer, failed_frames),
+            failed_buffer=create_retry_buffer(topic_buffer, failed_frames),
+            files_written=files_written,
+        )
+
+    # Der Prefect Flow wird vom Aufrufer einmal pro Schreibzyklus angefordert
+    if files_written < len(partitions):
+        logger.warning(f"Batch für Topic '{topic_name}': {files_written} Datei(en) nach MinIO geschrieben, {len(partitions) - files_written} lokal abgelegt.")
+    else:
+        logger.info(f"Batch für Topic '{topic_name}' erfolgreich in {len(partitions)} Datei(en) nach MinIO geschrieben.")
+    return TopicWriteResult(topic_name, topic_buffer, topic_buffer.next_offsets(), files_written=files_written)
+
+
+class BackgroundBatchWriter:
+    """
+    Schreibt übergebene Topic-Puffer im Hintergrund nach MinIO, während der Haupt-Thread
+    in frische Puffer weiter konsumiert (Double Buffering). Es ist höchstens ein Batch
+    gleichzeitig in Arbeit; dessen Topics werden parallel über den gemeinsamen MinIO-Client
+    (und damit dessen Connection-Pool) hochgeladen.
+    Die Ergebnisse werden im Haupt-Thread mit collect_results() abgeholt, damit die
+    Offsets erst nach dauerhaftem Schreiben und vom Poll-Thread aus committet werden.
+    """
+
+    def __init__(self, minio_client, max_workers: int, base_prefix: str = 'cdc_events', history_prefix: str | None = None):
+        self._minio_client = minio_client
+        self._base_prefix = base_prefix
+        self._history_prefix = history_prefix
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="minio-writer")
+        self._in_flight: dict[str, tuple[object, Future]] = {}
+
+    @property
+    def busy(self) -> bool:
+        return bool(self._in_flight)
+
+    @property
+    def in_flight_bytes(self) -> int:
+        """Geschätzte Größe des laufenden Batches (für die Backpressure-Speicherbuchführung)."""
+        return sum(topic_buffer.estimated_bytes for topic_buffer, _ in self._in_flight.values())
+
+    def submit(self, batch: dict) -> None:
+        """Übergibt die Topic-Puffer eines Batches ({topic_name: topic_buffer}) an den Hintergrund-Writer."""
+        if self.busy:
+            raise RuntimeError("Es ist bereits ein Batch in Arbeit.")
+        for topic_name, topic_buffer in batch.items():
+            future = self._executor.submit(write_topic_buffer, self._minio_client, topic_name, topic_buffer, self._base_prefix, self._history_prefix)
+            self._in_flight[topic_name] = (topic_buffer, future)
+        logger.info(f"Batch mit {sum(len(b) for b in batch.values())} Nachrichten in {len(batch)} Topics an Hintergrund-Writer übergeben.")
+
+    def collect_results(self, wait: bool = False) -> list[TopicWriteResult] | None:
+        """
+        Gibt die Ergebnisse des laufenden Batches als Liste von TopicWriteResult zurück,
+        sobald alle Topics fertig sind, sonst None. Mit wait=True wird blockierend gewartet.
+        """
+        if not self._in_flight:
+            return None
+        if not wait and not all(future.done() for _, future in self._in_flight.values()):
+            return None
+
+        results = []
+        for topic_name, (topic_buffer, future) in self._in_flight.items():
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"Unerwarteter Fehler im Hintergrund-Writer für Topic '{topic_name}': {e}", exc_info=True)
+                result = TopicWriteResult(topic_name, topic_buffer, commit_offsets={}, failed_buffer=topic_buffer)
+            results.append(result)
+        self._in_flight = {}
+        return results
+
+    def close(self) -> list[TopicWriteResult] | None:
+        """Wartet auf den laufenden Batch, beendet den Thread-Pool und gibt die letzten Ergebnisse zurück."""
+        results = self.collect_results(wait=True)
+        self._executor.shutdown(wait=True)
+        return results
@@ -0,0 +1,250 @@
+import json
+import time
+from collections import defaultdict
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from . import config
+from .config import get_logger
+
+logger = get_logger(__name__)
+
+
+class TopicBufferTracking:
+    """
+    Gemeinsame Buchführung der Topic-Puffer für die Flush-Policy und das Offset-Commit:
+    Zeitpunkt der ersten Nachricht, geschätzte Größe (Rohbytes der Nachrichten),
+    höchster gepufferter Offset pro Partition und Wartezeit nach Schreibfehlern.
+    """
+
+    def _init_tracking(self) -> None:
+        self.first_message_time: float | None = None
+        self.estimated_bytes = 0
+        self.partition_offsets: dict[int, int] = {}
+        # Nach einem fehlgeschlagenen Schreibversuch frühestens ab diesem Zeitpunkt erneut versuchen
+        self.retry_not_before = 0.0
+
+    def track_messages(self, messages: list) -> None:
+        if self.first_message_time is None:
+            self.first_message_time = time.time()
+        partition_offsets = self.partition_offsets
+        for msg in messages:
+            value = msg.value()
+            if value:
+                self.estimated_bytes += len(value)
+            partition = msg.partition()
+            if msg.offset() > partition_offsets.get(partition, -1):
+                partition_offsets[partition] = msg.offset()
+
+    def _absorb_tracking(self, other: "TopicBufferTracking") -> None:
+        if other.first_message_time is not None:
+            self.first_message_time = min(self.first_message_time or other.first_message_time, other.first_message_time)
+        self.estimated_bytes += other.estimated_bytes
+        for partition, offset in other.partition_offsets.items():
+            if offset > self.partition_offsets.get(partition, -1):
+                self.partition_offsets[partition] = offset
+
+    def next_offsets(self) -> dict[int, int]:
+        """Nächster zu lesender Offset pro Partition, wenn der gesamte Puffer geschrieben wurde."""
+        return {partition: offset + 1 for partition, offset in self.partition_offsets.items()}
+
+    def age_seconds(self, now: float | None = None) -> float:
+        if self.first_message_time is None:
+            return 0.0
+        return (now or time.time()) - self.first_message_time
+
+
+class RecordTopicBuffer(TopicBufferTracking, list):
+    """
+    Puffer im ursprünglichen Format: eine Liste von Payload-Dictionaries pro Topic.
+    Wird über MESSAGE_BUFFER_FORMAT=records für Vergleichsmessungen weiterhin unterstützt.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._init_tracking()
+
+    def absorb(self, other: "RecordTopicBuffer") -> None:
+        """Hängt die (neueren) Nachrichten eines anderen Puffers desselben Topics an."""
+        self.extend(other)
+        self._absorb_tracking(other)
+
+
+class ColumnarTopicBuffer(TopicBufferTracking):
+    """
+    Spaltenorientierter Puffer für ein einzelnes Topic aus typisierten Arrow-Blöcken.
+    Einzeln dekodierte Felder werden in eine Liste pro Spalte angehängt und spätestens nach
+    COLUMNAR_CHUNK_ROWS Zeilen in einen Arrow-Block umgewandelt, sodass nie mehr als ein Block
+    als Python-Objekte im Speicher liegt. Bereits dekodierte Arrow-Tabellen (Batch-Dekodierung)
+    werden direkt als Block übernommen. Beim Flush wird daraus ohne Pandas-Umweg eine Arrow-Tabelle gebaut.
+    Bietet die gleiche append/extend/len-Schnittstelle wie der Listen-Puffer.
+    """
+
+    def __init__(self):
+        self.columns: dict[str, list] = {}
+        self.chunks: list[pa.Table] = []
+        self.num_rows = 0
+        self._column_rows = 0
+        self._init_tracking()
+
+    def append(self, payload: dict) -> None:
+        columns = self.columns
+        for key, value in payload.items():
+            column = columns.get(key)
+            if column is None:
+                # Neue Spalte mitten im Batch: bisherige Zeilen mit Nullwerten auffüllen
+                column = columns[key] = [None] * self._column_rows
+            column.append(value)
+        self._column_rows += 1
+        self.num_rows += 1
+        if len(payload) != len(columns):
+            # Fehlende Felder dieses Events als Nullwerte ergänzen
+            for column in columns.values():
+                if len(column) < self._column_rows:
+                    column.append(None)
+        if self._column_rows >= config.COLUMNAR_CHUNK_ROWS:
+            self._freeze_columns()
+
+    def extend(self, payloads: list[dict]) -> None:
+        for payload in payloads:
+            self.append(payload)
+
+    def append_table(self, table: pa.Table) -> None:
+        """Hängt eine bereits dekodierte Arrow-Tabelle (z.B. aus der Batch-Dekodierung) an."""
+        if table.num_rows:
+            # Zuvor einzeln angehängte Zeilen zuerst ablegen, damit die Reihenfolge der Offsets erhalten bleibt
+            self._freeze_columns()
+            self.chunks.append(table)
+            self.num_rows += table.num_rows
+
+    def absorb(self, other: "ColumnarTopicBuffer") -> None:
+        """Hängt die (neueren) Nachrichten eines anderen Puffers desselben Topics an."""
+        self._freeze_columns()
+        if other:
+            self.append_table(other.to_arrow_table())
+        self._absorb_tracking(other)
+
+    def _freeze_columns(self) -> None:
+        # Bisher spaltenweise gepufferte Zeilen als Tabelle ablegen, damit die Reihenfolge erhalten bleibt
+        if self._column_rows:
+            self.chunks.append(self._columns_to_table())
+            self.columns = {}
+            self._column_rows = 0
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def to_arrow_table(self) -> pa.Table:
+        """
+        Baut aus den gepufferten Spalten und angehängten Tabellen eine Arrow-Tabelle.
+        Abweichende Schemata der Teilstücke werden dabei vereinheitlicht.
+        """
+        tables = list(self.chunks)
+        if self._column_rows:
+            tables.append(self._columns_to_table())
+        if len(tables) == 1:
+            return tables[0]
+        try:
+            return pa.concat_tables(tables, promote_options="permissive")
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+            return pa.concat_tables(_stringify_conflicting_columns(tables, e), promote_options="permissive")
+
+    def _columns_to_table(self) -> pa.Table:
+        arrays = []
+        for name, values in self.columns.items():
+            try:
+                arrays.append(pa.array(values))
+            except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+                logger.warning(f"Uneinheitliche Typen in Spalte '{name}' ({e}). Speichere Spalte als String.")
+                arrays.append(_to_string_array(values))
+        return pa.Table.from_arrays(arrays, names=list(self.columns.keys()))
+
+
+def _to_string_array(values: list) -> pa.Array:
+    return pa.array(
+        [None if v is None else (v if isinstance(v, str) else json.dumps(v)) for v in values],
+        type=pa.string(),
+    )
+
+
+def _stringify_conflicting_columns(tables: list[pa.Table], error: Exception) -> list[pa.Table]:
+    """
+    Wandelt Spalten, deren Typen sich zwischen den Blöcken nicht vereinheitlichen lassen, in allen
+    Blöcken in Strings um (wie bei uneinheitlichen Typen innerhalb eines Blocks).
+    """
+    field_types: dict[str, list[pa.DataType]] = defaultdict(list)
+    for table in tables:
+        for field in table.schema:
+            if not pa.types.is_null(field.type) and field.type not in field_types[field.name]:
+                field_types[field.name].append(field.type)
+
+    conflicting = set()
+    for name, types in field_types.items():
+        try:
+            pa.unify_schemas([pa.schema([pa.field(name, t)]) for t in types], promote_options="permissive")
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            conflicting.add(name)
+    logger.warning(f"Uneinheitliche Typen zwischen Pufferblöcken ({error}). Speichere Spalten {sorted(conflicting)} als String.")
+
+    return [_stringify_columns(table, conflicting) for table in tables]
+
+
+def _stringify_columns(table: pa.Table, column_names: set[str]) -> pa.Table:
+    for index, name in enumerate(table.column_names):
+        if name in column_names:
+            table = table.set_column(index, name, _to_string_array(table.column(name).to_pylist()))
+    return table
+
+
+def create_retry_buffer(topic_buffer: TopicBufferTracking, frames: list) -> TopicBufferTracking:
+    """
+    Baut aus den nicht geschriebenen Dateien (Arrow-Tabellen bzw. DataFrames) eines Topic-Puffers
+    einen neuen Puffer für den nächsten Schreibversuch. Bereits geschriebene Dateien werden so
+    nicht erneut hochgeladen. Die Offset-Buchführung bleibt die des ursprünglichen Puffers,
+    da nach dem erfolgreichen Retry alle seine Nachrichten geschrieben sind.
+    """
+    if isinstance(topic_buffer, ColumnarTopicBuffer):
+        retry_buffer = ColumnarTopicBuffer()
+        for frame in frames:
+            retry_buffer.append_table(frame)
+    else:
+        retry_buffer = RecordTopicBuffer()
+        for frame in frames:
+            retry_buffer.extend(frame.to_pylist() if isinstance(frame, pa.Table) else frame.to_dict('records'))
+
+    retry_buffer.first_message_time = topic_buffer.first_message_time
+    retry_buffer.partition_offsets = dict(topic_buffer.partition_offsets)
+    retry_buffer.estimated_bytes = topic_buffer.estimated_bytes * len(retry_buffer) // max(len(topic_buffer), 1)
+    return retry_buffer
+
+
+def remove_partitions(topic_buffer: TopicBufferTracking, partitions: set[int]) -> TopicBufferTracking:
+    """
+    Gibt einen Puffer ohne die Zeilen und Offsets der angegebenen Kafka-Partitionen zurück,
+    z.B. nachdem diese Partitionen bei einem Rebalance abgegeben wurden.
+    """
+    if isinstance(topic_buffer, ColumnarTopicBuffer):
+        remaining = ColumnarTopicBuffer()
+        if topic_buffer:
+            table = topic_buffer.to_arrow_table()
+            if '_kafka_partition' in table.column_names:
+                partition_column = table.column('_kafka_partition')
+                in_partitions = pc.is_in(partition_column, value_set=pa.array(sorted(partitions), partition_column.type))
+                table = table.filter(pc.invert(in_partitions))
+            remaining.append_table(table)
+    else:
+        remaining = RecordTopicBuffer(payload for payload in topic_buffer if payload.get('_kafka_partition') not in partitions)
+
+    remaining.first_message_time = topic_buffer.first_message_time
+    remaining.partition_offsets = {p: o for p, o in topic_buffer.partition_offsets.items() if p not in partitions}
+    remaining.estimated_bytes = topic_buffer.estimated_bytes * len(remaining) // max(len(topic_buffer), 1)
+    remaining.retry_not_before = topic_buffer.retry_not_before
+    return remaining
+
+
+def create_message_buffer() -> defaultdict:
+    """Erstellt den Topic-Puffer im über MESSAGE_BUFFER_FORMAT konfigurierten Format."""
+    if config.MESSAGE_BUFFER_FORMAT == 'records':
+        return defaultdict(RecordTopicBuffer)
+    return defaultdict(ColumnarTopicBuffer)
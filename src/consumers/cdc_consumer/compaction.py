@@ -0,0 +1,46 @@
+import pandas as pd
+import pyarrow as pa
+
+from . import config
+from .config import get_logger
+from .parquet_profile import TABLE_PRIMARY_KEYS
+
+logger = get_logger(__name__)
+
+# Reihenfolge der Events eines Schlüssels: Debezium-Zeitstempel, bei Gleichstand die Kafka-Position
+EVENT_ORDER_COLUMNS = ['_ts_ms', '_kafka_partition', '_kafka_offset']
+
+
+def is_compaction_enabled(table_name: str) -> bool:
+    return table_name in config.COMPACTION_TABLES
+
+
+def compact_latest_per_key(frame: pd.DataFrame | pa.Table, table_name: str) -> pd.DataFrame | pa.Table:
+    """
+    Behält pro Primärschlüssel nur das letzte Event (nach _ts_ms und Kafka-Offset), inklusive Deletes.
+    Entspricht dem ROW_NUMBER() ... ORDER BY _ts_ms DESC der dbt Staging-Modelle, nur bereits im Batch.
+    Ohne Schlüsselspalten im Frame wird er unverändert zurückgegeben.
+    """
+    column_names = list(frame.columns) if isinstance(frame, pd.DataFrame) else frame.column_names
+    primary_key = TABLE_PRIMARY_KEYS.get(table_name, [])
+    if not primary_key or not set(primary_key) <= set(column_names):
+        logger.warning(f"Kein Primärschlüssel für Tabelle '{table_name}' im Batch gefunden. Überspringe Kompaktierung.")
+        return frame
+    order_columns = [name for name in EVENT_ORDER_COLUMNS if name in column_names]
+
+    if isinstance(frame, pd.DataFrame):
+        if order_columns:
+            frame = frame.sort_values(order_columns, kind='stable')
+        return frame.drop_duplicates(subset=primary_key, keep='last')
+
+    if order_columns:
+        frame = frame.sort_by([(name, 'ascending') for name in order_columns])
+    # Letzte Zeile pro Schlüssel = höchster Zeilenindex nach der Sortierung
+    row_index = pa.array(range(frame.num_rows), type=pa.int64())
+    latest_rows = (
+        frame.select(primary_key).append_column('_row', row_index)
+        .group_by(primary_key).aggregate([('_row', 'max')])
+        .column('_row_max')
+    )
+    # Zeilen in Event-Reihenfolge zurückgeben
+    return frame.take(latest_rows.sort())
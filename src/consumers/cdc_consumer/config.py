@@ -1,5 +1,6 @@
 import os
 import logging
+import socket
 
 # --- Kafka Configuration ---
 KAFKA_BOOTSTRAP_SERVERS = os.getenv('KAFKA_BOOTSTRAP_SERVERS', 'kafka:29092')
@@ -7,6 +8,30 @@ KAFKA_TOPIC_PATTERN = os.getenv('KAFKA_TOPIC_PATTERN', '^cdc\\.oltp_dabi\\.publi
 CONSUMER_GROUP_ID = os.getenv('CONSUMER_GROUP_ID', 'dabi2-minio-lake-writer')
 KAFKA_POLL_TIMEOUT = float(os.getenv('KAFKA_POLL_TIMEOUT', '1.0'))
 KAFKA_COMMIT_ASYNCHRONOUS = os.getenv('KAFKA_COMMIT_ASYNCHRONOUS', 'false').lower() == 'true'
+# 'single': ein poll() pro Nachricht, 'batch': bis zu KAFKA_BATCH_SIZE Nachrichten pro consume()-Aufruf
+KAFKA_CONSUME_MODE = os.getenv('KAFKA_CONSUME_MODE', 'single').lower()
+KAFKA_BATCH_SIZE = int(os.getenv('KAFKA_BATCH_SIZE', '1000'))
+KAFKA_BATCH_TIMEOUT = float(os.getenv('KAFKA_BATCH_TIMEOUT', '1.0'))
+# Im Batch-Modus mit spaltenorientiertem Puffer: JSON eines Batches pro Topic vektorisiert mit Arrow dekodieren
+VECTORIZED_JSON_DECODE = os.getenv('VECTORIZED_JSON_DECODE', 'true').lower() == 'true'
+# Inkrementelles Rebalancing: bei Zu-/Abgängen werden nur die betroffenen Partitionen neu verteilt
+KAFKA_PARTITION_ASSIGNMENT_STRATEGY = os.getenv('KAFKA_PARTITION_ASSIGNMENT_STRATEGY', 'cooperative-sticky')
+# Static Membership: stabile Instanz-ID pro Consumer-Prozess ('<CONSUMER_INSTANCE_ID>-<Prozessindex>'),
+# damit ein Neustart innerhalb von KAFKA_SESSION_TIMEOUT_MS kein Rebalance auslöst. Leer deaktiviert.
+CONSUMER_INSTANCE_ID = os.getenv('CONSUMER_INSTANCE_ID', socket.gethostname())
+KAFKA_SESSION_TIMEOUT_MS = int(os.getenv('KAFKA_SESSION_TIMEOUT_MS', '45000'))
+# Topic für nicht dekodierbare Nachrichten (Rohbytes + Herkunft in den Headern). Leer: nur protokollieren und überspringen
+DEAD_LETTER_TOPIC = os.getenv('DEAD_LETTER_TOPIC', 'cdc_dead_letter')
+# Maximale Wartezeit auf die Auslieferung der Dead Letters vor einem Offset-Commit
+DEAD_LETTER_FLUSH_TIMEOUT_SECONDS = float(os.getenv('DEAD_LETTER_FLUSH_TIMEOUT_SECONDS', '10.0'))
+
+# --- Multi-Prozess-Betrieb ---
+# Anzahl Consumer-Prozesse derselben Consumer-Gruppe (1 = ein Prozess ohne Supervisor)
+CONSUMER_PROCESSES = int(os.getenv('CONSUMER_PROCESSES', '1'))
+# Wartezeit vor dem Neustart eines abgestürzten Consumer-Prozesses
+CONSUMER_RESTART_BACKOFF_SECONDS = float(os.getenv('CONSUMER_RESTART_BACKOFF_SECONDS', '5.0'))
+# Maximale Wartezeit auf das saubere Beenden (inkl. Flush) der Consumer-Prozesse
+CONSUMER_SHUTDOWN_TIMEOUT_SECONDS = float(os.getenv('CONSUMER_SHUTDOWN_TIMEOUT_SECONDS', '60.0'))
 
 
 # --- MinIO Configuration ---
@@ -15,9 +40,98 @@ MINIO_ACCESS_KEY = os.getenv('MINIO_ACCESS_KEY', 'minioadmin')
 MINIO_SECRET_KEY = os.getenv('MINIO_SECRET_KEY')
 MINIO_BUCKET = os.getenv('MINIO_BUCKET', 'datalake')
 MINIO_USE_SSL = os.getenv('MINIO_USE_SSL', 'false').lower() == 'true'
+# Größe des HTTP-Connection-Pools des (wiederverwendeten) MinIO-Clients
+MINIO_MAX_POOL_CONNECTIONS = int(os.getenv('MINIO_MAX_POOL_CONNECTIONS', '10'))
+# Dateien ab dieser Arrow-Größe werden während der Kodierung per Multipart Upload gestreamt (0 = nie)
+MINIO_STREAMING_UPLOAD_MIN_BYTES = int(os.getenv('MINIO_STREAMING_UPLOAD_MIN_BYTES', str(32 * 1024 * 1024)))
+# Teilgröße des Multipart Uploads (S3-Minimum 5 MiB) und Anzahl parallel hochgeladener Teile
+MINIO_MULTIPART_PART_SIZE = int(os.getenv('MINIO_MULTIPART_PART_SIZE', str(16 * 1024 * 1024)))
+MINIO_MULTIPART_PARALLEL_UPLOADS = int(os.getenv('MINIO_MULTIPART_PARALLEL_UPLOADS', '3'))
 
 # --- Batching Configuration ---
 WRITE_INTERVAL_SECONDS = int(os.getenv('WRITE_INTERVAL_SECONDS', '20'))
+# 'columnar': spaltenorientierter Arrow-Puffer, 'records': eine Liste von Dictionaries pro Topic
+MESSAGE_BUFFER_FORMAT = os.getenv('MESSAGE_BUFFER_FORMAT', 'columnar').lower()
+# Einzeln dekodierte Events liegen im spaltenorientierten Puffer höchstens so viele Zeilen lang als
+# Python-Objekte vor, dann werden sie in typisierte Arrow-Arrays umgewandelt
+COLUMNAR_CHUNK_ROWS = max(1, int(os.getenv('COLUMNAR_CHUNK_ROWS', '1000')))
+# Event-Time-Partitionierung der Parquet-Dateien zusätzlich nach Stunde (hour=HH)
+PARTITION_BY_HOUR = os.getenv('PARTITION_BY_HOUR', 'false').lower() == 'true'
+# Schema pro Topic aus dem ersten Batch zwischenspeichern und spätere Batches darauf casten
+TOPIC_SCHEMA_CACHE = os.getenv('TOPIC_SCHEMA_CACHE', 'true').lower() == 'true'
+# Nur das letzte Event pro Primärschlüssel und Datei schreiben, für diese Tabellen (kommagetrennt, z.B. 'orders,products')
+COMPACTION_TABLES = [table.strip() for table in os.getenv('COMPACTION_TABLES', '').split(',') if table.strip()]
+# Bei Kompaktierung zusätzlich die vollständige Historie unter COMPACTION_HISTORY_PREFIX ablegen (wird nicht geladen)
+COMPACTION_KEEP_HISTORY = os.getenv('COMPACTION_KEEP_HISTORY', 'false').lower() == 'true'
+COMPACTION_HISTORY_PREFIX = os.getenv('COMPACTION_HISTORY_PREFIX', 'cdc_history')
+
+# --- Lokaler Spill bei nicht erreichbarem MinIO (leeres SPILL_DIR deaktiviert) ---
+SPILL_DIR = os.getenv('SPILL_DIR', '')
+# Maximale Größe der lokal abgelegten Segmente pro Consumer-Prozess (0 = unbegrenzt)
+SPILL_MAX_BYTES = int(os.getenv('SPILL_MAX_BYTES', str(10 * 1024 * 1024 * 1024)))
+# Abstand, in dem lokal abgelegte Segmente erneut nach MinIO geschrieben werden
+SPILL_DRAIN_INTERVAL_SECONDS = float(os.getenv('SPILL_DRAIN_INTERVAL_SECONDS', '30.0'))
+# Versuche, nach denen ein Segment, das nicht an MinIO, sondern an seinen Daten scheitert, nach failed/ verschoben wird
+SPILL_MAX_DRAIN_ATTEMPTS = int(os.getenv('SPILL_MAX_DRAIN_ATTEMPTS', '5'))
+
+# --- Parquet Writer-Profil (Standard für alle Tabellen, pro Tabelle über PARQUET_PROFILE_OVERRIDES anpassbar) ---
+PARQUET_COMPRESSION = os.getenv('PARQUET_COMPRESSION', 'zstd').lower()
+# Leer lässt den Codec-Standard von Arrow gelten (z.B. für snappy, das keine Level kennt)
+PARQUET_COMPRESSION_LEVEL = os.getenv('PARQUET_COMPRESSION_LEVEL', '3')
+PARQUET_COMPRESSION_LEVEL = int(PARQUET_COMPRESSION_LEVEL) if PARQUET_COMPRESSION_LEVEL else None
+PARQUET_ROW_GROUP_SIZE = int(os.getenv('PARQUET_ROW_GROUP_SIZE', str(128 * 1024)))
+# Dictionary-Encoding für Spalten mit höchstens diesem Anteil unterschiedlicher Werte (1 = alle, 0 = keine)
+PARQUET_DICTIONARY_MAX_RATIO = float(os.getenv('PARQUET_DICTIONARY_MAX_RATIO', '0.5'))
+PARQUET_WRITE_PAGE_INDEX = os.getenv('PARQUET_WRITE_PAGE_INDEX', 'true').lower() == 'true'
+# Zeilen jeder Datei nach Primärschlüssel und _ts_ms sortieren
+PARQUET_SORT_BY_KEY = os.getenv('PARQUET_SORT_BY_KEY', 'true').lower() == 'true'
+# Bloom-Filter auf den Primärschlüsselspalten (benötigt eine pyarrow-Version mit bloom_filter_options, wird beim Start geprüft)
+PARQUET_BLOOM_FILTERS = os.getenv('PARQUET_BLOOM_FILTERS', 'false').lower() == 'true'
+PARQUET_BLOOM_FILTER_FPP = float(os.getenv('PARQUET_BLOOM_FILTER_FPP', '0.05'))
+# JSON-Objekt pro Tabelle, z.B. '{"order_products": {"row_group_size": 1048576, "bloom_filter_columns": ["order_id"]}}'
+PARQUET_PROFILE_OVERRIDES = os.getenv('PARQUET_PROFILE_OVERRIDES', '{}')
+
+# --- Flush Policy (pro Topic, 0 deaktiviert den jeweiligen Trigger) ---
+FLUSH_MAX_RECORDS = int(os.getenv('FLUSH_MAX_RECORDS', '100000'))
+FLUSH_MAX_BYTES = int(os.getenv('FLUSH_MAX_BYTES', str(64 * 1024 * 1024)))
+FLUSH_MAX_AGE_SECONDS = float(os.getenv('FLUSH_MAX_AGE_SECONDS', str(WRITE_INTERVAL_SECONDS)))
+# JSON-Objekt pro Tabelle, z.B. '{"products": {"max_age_seconds": 2}, "order_products": {"max_bytes": 134217728}}'
+FLUSH_POLICY_OVERRIDES = os.getenv('FLUSH_POLICY_OVERRIDES', '{}')
+# Wartezeit bis zum nächsten Schreibversuch eines Topics nach einem Fehler
+FLUSH_RETRY_BACKOFF_SECONDS = float(os.getenv('FLUSH_RETRY_BACKOFF_SECONDS', str(WRITE_INTERVAL_SECONDS)))
+# 'inline': Schreiben im Poll-Thread, 'background': Puffer tauschen und im Hintergrund schreiben
+FLUSH_MODE = os.getenv('FLUSH_MODE', 'inline').lower()
+# Anzahl paralleler Topic-Uploads im Hintergrund-Modus
+WRITER_MAX_WORKERS = int(os.getenv('WRITER_MAX_WORKERS', '4'))
+
+# --- Manifeste geschriebener Dateien (inkrementelle Dateisuche des DWH Flows) ---
+MANIFEST_ENABLED = os.getenv('MANIFEST_ENABLED', 'true').lower() == 'true'
+# Manifeste liegen unter <MANIFEST_PREFIX>/<Präfix der Dateien>/, z.B. cdc_manifests/cdc_events/
+MANIFEST_PREFIX = os.getenv('MANIFEST_PREFIX', 'cdc_manifests')
+
+# --- Replay/Backfill (python main.py replay ...) ---
+# Präfix im Bucket für neu aufgebaute Dateien bzw. deren vollständige Historie bei Kompaktierung
+REPLAY_PREFIX = os.getenv('REPLAY_PREFIX', 'cdc_replay')
+REPLAY_HISTORY_PREFIX = os.getenv('REPLAY_HISTORY_PREFIX', 'cdc_replay_history')
+# Nachrichten pro consume()-Aufruf und Schwellwerte pro Topic-Datei (große Dateien statt kurzer Latenz)
+REPLAY_BATCH_SIZE = int(os.getenv('REPLAY_BATCH_SIZE', '10000'))
+REPLAY_FLUSH_MAX_RECORDS = int(os.getenv('REPLAY_FLUSH_MAX_RECORDS', '1000000'))
+REPLAY_FLUSH_MAX_BYTES = int(os.getenv('REPLAY_FLUSH_MAX_BYTES', str(512 * 1024 * 1024)))
+# Abbruch nach so vielen aufeinanderfolgenden fehlgeschlagenen Schreibversuchen
+REPLAY_MAX_WRITE_RETRIES = int(os.getenv('REPLAY_MAX_WRITE_RETRIES', '5'))
+# Eigenes DLQ-Topic des Replays (leer = nicht dekodierbare Nachrichten nur protokollieren), damit bereits
+# weitergeleitete historische Nachrichten nicht erneut in DEAD_LETTER_TOPIC des laufenden Consumers landen
+REPLAY_DEAD_LETTER_TOPIC = os.getenv('REPLAY_DEAD_LETTER_TOPIC', '')
+
+# --- Backpressure (gepufferte Rohbytes inkl. laufendem Hintergrund-Batch, 0 deaktiviert) ---
+BUFFER_HIGH_WATER_BYTES = int(os.getenv('BUFFER_HIGH_WATER_BYTES', str(512 * 1024 * 1024)))
+BUFFER_LOW_WATER_BYTES = int(os.getenv('BUFFER_LOW_WATER_BYTES', str(256 * 1024 * 1024)))
+
+# --- Metrics ---
+# Port des Prometheus-Endpunkts (/metrics); bei mehreren Prozessen METRICS_PORT + Prozessindex. 0 deaktiviert
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+# Intervall der librdkafka-Statistiken, aus denen der Consumer Lag gelesen wird (0 deaktiviert)
+KAFKA_STATISTICS_INTERVAL_MS = int(os.getenv('KAFKA_STATISTICS_INTERVAL_MS', '15000'))
 
 # --- Logging Configuration ---
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
@@ -26,6 +140,10 @@ LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 # --- Prefect Configuration ---
 PREFECT_FLOW_NAME = os.getenv('PREFECT_FLOW_NAME', "cdc_minio_to_duckdb_flow")
 PREFECT_DEPLOYMENT_NAME = os.getenv('PREFECT_DEPLOYMENT_NAME', "dwh-pipeline")
+# Abstand, in dem bei einem bereits geplanten/laufenden Run erneut geprüft wird, ob ein Folge-Run nötig ist
+PREFECT_TRIGGER_RECHECK_SECONDS = float(os.getenv('PREFECT_TRIGGER_RECHECK_SECONDS', 30.0))
+# Maximale Wartezeit auf einen laufenden Trigger beim Herunterfahren
+PREFECT_TRIGGER_SHUTDOWN_TIMEOUT_SECONDS = float(os.getenv('PREFECT_TRIGGER_SHUTDOWN_TIMEOUT_SECONDS', 10.0))
 
 # --- Application Information ---
 APP_NAME = os.getenv('APP_NAME', 'CDCKafkaMinIOWriter')
@@ -37,6 +155,21 @@ def validate_critical_config():
     missing_vars = [var for var, value in critical_vars.items() if value is None]
     if missing_vars:
         raise ValueError(f"Fehlende kritische Umgebungsvariablen: {', '.join(missing_vars)}")
+    if KAFKA_CONSUME_MODE not in ('single', 'batch'):
+        raise ValueError(f"Ungültiger KAFKA_CONSUME_MODE '{KAFKA_CONSUME_MODE}'. Erlaubt sind 'single' und 'batch'.")
+    if FLUSH_MODE not in ('inline', 'background'):
+        raise ValueError(f"Ungültiger FLUSH_MODE '{FLUSH_MODE}'. Erlaubt sind 'inline' und 'background'.")
+    if MESSAGE_BUFFER_FORMAT not in ('columnar', 'records'):
+        raise ValueError(f"Ungültiges MESSAGE_BUFFER_FORMAT '{MESSAGE_BUFFER_FORMAT}'. Erlaubt sind 'columnar' und 'records'.")
+    if MINIO_MULTIPART_PART_SIZE < 5 * 1024 * 1024:
+        raise ValueError(f"Ungültige MINIO_MULTIPART_PART_SIZE '{MINIO_MULTIPART_PART_SIZE}'. Mindestens 5 MiB (5242880).")
+    if CONSUMER_PROCESSES < 1:
+        raise ValueError(f"Ungültige Anzahl CONSUMER_PROCESSES '{CONSUMER_PROCESSES}'. Mindestens 1.")
+    # Writer-Profile und Flush-Schwellwerte beim Start prüfen statt im Hauptloop (Import hier wegen Zirkelbezug zu config)
+    from .parquet_profile import load_parquet_profiles
+    from .flush_policy import load_flush_thresholds
+    load_parquet_profiles()
+    load_flush_thresholds()
 
 def get_logger(name: str) -> logging.Logger:
     logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
@@ -0,0 +1,127 @@
+import threading
+from collections import defaultdict
+
+from confluent_kafka import KafkaException, Producer
+
+from . import config
+from .config import get_logger
+from .metrics import DEAD_LETTERS
+
+logger = get_logger(__name__)
+
+
+class DeadLetterQueue:
+    """
+    Leitet nicht dekodierbare Nachrichten unverändert (Rohbytes und Key) in ein Kafka DLQ-Topic weiter.
+    Herkunft und Fehler stehen in den Headern (cdc.source.topic/partition/offset, cdc.error).
+    produce() ist asynchron und kostet den Poll-Thread nur Mikrosekunden; vor jedem Offset-Commit
+    wird mit flush() sichergestellt, dass alle Dead Letters ausgeliefert sind.
+    """
+
+    def __init__(self, producer: Producer, topic: str):
+        self._producer = producer
+        self._topic = topic
+        self._lock = threading.Lock()
+        self._undelivered: list[dict] = []
+
+    def send(self, msg, error: Exception) -> None:
+        self._produce({
+            'value': msg.value(),
+            'key': msg.key(),
+            'headers': [
+                ('cdc.source.topic', msg.topic()),
+                ('cdc.source.partition', str(msg.partition())),
+                ('cdc.source.offset', str(msg.offset())),
+                ('cdc.error', f"{type(error).__name__}: {error}"),
+            ],
+        })
+
+    def _produce(self, record: dict) -> None:
+        def on_delivery(err, _msg):
+            if err is not None:
+                logger.error(f"Dead Letter konnte nicht an '{self._topic}' ausgeliefert werden: {err}")
+                with self._lock:
+                    self._undelivered.append(record)
+        try:
+            self._producer.produce(self._topic, on_delivery=on_delivery, **record)
+        except (BufferError, KafkaException) as e:
+            logger.error(f"Dead Letter konnte nicht an '{self._topic}' übergeben werden: {e}")
+            with self._lock:
+                self._undelivered.append(record)
+        self._producer.poll(0)
+
+    def flush(self, timeout: float) -> bool:
+        """Liefert alle ausstehenden Dead Letters aus. Gibt False zurück, wenn noch welche offen sind."""
+        with self._lock:
+            retry_records, self._undelivered = self._undelivered, []
+        for record in retry_records:
+            self._produce(record)
+        remaining = self._producer.flush(timeout)
+        with self._lock:
+            return remaining == 0 and not self._undelivered
+
+
+# Ziel-Topic des Prozesses (leer = nur protokollieren); der Replay setzt es über use_dead_letter_topic um
+_dead_letter_topic = config.DEAD_LETTER_TOPIC
+# Globale DLQ-Instanz (None, solange keine Nachricht weitergeleitet wurde)
+_dead_letter_queue = None
+_dead_letter_lock = threading.Lock()
+# Nicht dekodierbare Nachrichten pro Quell-Topic seit dem Start
+_dead_letter_counts: dict[str, int] = defaultdict(int)
+
+
+def _get_dead_letter_queue() -> DeadLetterQueue:
+    global _dead_letter_queue
+    with _dead_letter_lock:
+        if _dead_letter_queue is None:
+            producer = Producer({
+                'bootstrap.servers': config.KAFKA_BOOTSTRAP_SERVERS,
+                'enable.idempotence': True,
+                'linger.ms': 50,
+            })
+            _dead_letter_queue = DeadLetterQueue(producer, _dead_letter_topic)
+            logger.info(f"DLQ-Producer für Topic '{_dead_letter_topic}' erstellt.")
+        return _dead_letter_queue
+
+
+def use_dead_letter_topic(topic: str) -> None:
+    """Setzt das DLQ-Topic des Prozesses (leer = nur protokollieren), vor der ersten weitergeleiteten Nachricht."""
+    global _dead_letter_topic
+    with _dead_letter_lock:
+        if _dead_letter_queue is not None:
+            raise RuntimeError("Der DLQ-Producer ist bereits erstellt.")
+        _dead_letter_topic = topic
+
+
+def send_to_dead_letter(msg, error: Exception) -> None:
+    """Leitet eine nicht dekodierbare Nachricht weiter (bzw. protokolliert sie nur, wenn das DLQ-Topic leer ist)."""
+    _dead_letter_counts[msg.topic()] += 1
+    DEAD_LETTERS.labels(topic=msg.topic()).inc()
+    source = f"Topic '{msg.topic()}' [{msg.partition()}] @ {msg.offset()}"
+    if not _dead_letter_topic:
+        logger.error(f"Nachricht von {source} nicht dekodierbar ({type(error).__name__}: {error}). Überspringe Nachricht ({_dead_letter_counts[msg.topic()]} für dieses Topic).")
+        return
+    logger.warning(f"Nachricht von {source} nicht dekodierbar ({type(error).__name__}: {error}). Leite an DLQ '{_dead_letter_topic}' weiter ({_dead_letter_counts[msg.topic()]} für dieses Topic).")
+    _get_dead_letter_queue().send(msg, error)
+
+
+def flush_dead_letters(timeout: float | None = None) -> bool:
+    """Wird vor jedem Offset-Commit aufgerufen: True, wenn alle Dead Letters dauerhaft in Kafka liegen."""
+    if _dead_letter_queue is None:
+        return True
+    return _dead_letter_queue.flush(config.DEAD_LETTER_FLUSH_TIMEOUT_SECONDS if timeout is None else timeout)
+
+
+def get_dead_letter_counts() -> dict[str, int]:
+    """Anzahl nicht dekodierbarer Nachrichten pro Quell-Topic seit dem Start."""
+    return dict(_dead_letter_counts)
+
+
+def close_dead_letter_queue() -> None:
+    global _dead_letter_queue
+    with _dead_letter_lock:
+        dead_letter_queue, _dead_letter_queue = _dead_letter_queue, None
+    if dead_letter_queue is not None:
+        if not dead_letter_queue.flush(config.DEAD_LETTER_FLUSH_TIMEOUT_SECONDS):
+            logger.error("Nicht alle Dead Letters konnten vor dem Beenden ausgeliefert werden.")
+        logger.info(f"DLQ-Producer geschlossen. Weitergeleitete Nachrichten pro Topic: {get_dead_letter_counts()}")
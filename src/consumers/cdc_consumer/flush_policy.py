@@ -0,0 +1,104 @@
+import json
+import time
+from dataclasses import dataclass, replace
+
+from . import config
+from .config import get_logger
+
+logger = get_logger(__name__)
+
+
+@dataclass(frozen=True)
+class FlushThresholds:
+    """Schwellwerte, bei deren Erreichen der Puffer eines Topics geschrieben wird (0 = deaktiviert)."""
+    max_records: int
+    max_bytes: int
+    max_age_seconds: float
+
+
+_default_thresholds = FlushThresholds(
+    max_records=config.FLUSH_MAX_RECORDS,
+    max_bytes=config.FLUSH_MAX_BYTES,
+    max_age_seconds=config.FLUSH_MAX_AGE_SECONDS,
+)
+_table_thresholds: dict[str, FlushThresholds] | None = None
+
+
+def load_flush_thresholds() -> dict[str, FlushThresholds]:
+    """
+    Liest die tabellenspezifischen Überschreibungen aus FLUSH_POLICY_OVERRIDES.
+    Wirft ValueError bei ungültigem JSON, unbekannten Schlüsseln oder Werten, die keine
+    nicht-negativen Zahlen sind.
+    """
+    global _table_thresholds
+    if _table_thresholds is not None:
+        return _table_thresholds
+
+    try:
+        overrides = json.loads(config.FLUSH_POLICY_OVERRIDES)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"FLUSH_POLICY_OVERRIDES ist kein gültiges JSON: {e}") from e
+    if not isinstance(overrides, dict):
+        raise ValueError("FLUSH_POLICY_OVERRIDES muss ein JSON-Objekt mit Tabellennamen als Schlüssel sein.")
+
+    allowed_keys = set(FlushThresholds.__dataclass_fields__)
+    table_thresholds = {}
+    for table_name, table_override in overrides.items():
+        if not isinstance(table_override, dict):
+            raise ValueError(f"Flush-Schwellwerte für Tabelle '{table_name}' müssen ein JSON-Objekt sein.")
+        unknown_keys = set(table_override) - allowed_keys
+        if unknown_keys:
+            raise ValueError(f"Unbekannte Flush-Schwellwerte für Tabelle '{table_name}': {', '.join(sorted(unknown_keys))}")
+        for key, value in table_override.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                raise ValueError(f"Flush-Schwellwert '{key}' für Tabelle '{table_name}' muss eine nicht-negative Zahl sein, nicht {value!r}.")
+        table_thresholds[table_name] = replace(_default_thresholds, **table_override)
+
+    _table_thresholds = table_thresholds
+    return _table_thresholds
+
+
+def get_flush_thresholds(table_name: str) -> FlushThresholds:
+    return load_flush_thresholds().get(table_name, _default_thresholds)
+
+
+def get_flush_reason(topic_buffer, table_name: str, now: float | None = None, force: bool = False) -> str | None:
+    """
+    Prüft die Schwellwerte für einen Topic-Puffer und gibt den Auslöser zurück (oder None).
+    Mit force wird jeder nicht leere Puffer außerhalb des Fehler-Backoffs geschrieben (Backpressure).
+    Puffer ohne Zeilen, aber mit vorgemerkten Offsets (nur Tombstones oder DLQ-Nachrichten), werden
+    beim Alterslimit geschrieben, d.h. nur ihre Offsets committet (ohne Alterslimit sofort).
+    """
+    if not topic_buffer.partition_offsets:
+        return None
+    if topic_buffer.retry_not_before and (now or time.time()) < topic_buffer.retry_not_before:
+        return None
+    if force:
+        return "Backpressure"
+    thresholds = get_flush_thresholds(table_name)
+    if not topic_buffer:
+        age = topic_buffer.age_seconds(now)
+        max_age_seconds = thresholds.max_age_seconds or _default_thresholds.max_age_seconds
+        if age >= max_age_seconds:
+            return f"nur Offsets, Alter {age:.2f}s >= {max_age_seconds}s"
+        return None
+
+    if thresholds.max_records and len(topic_buffer) >= thresholds.max_records:
+        return f"{len(topic_buffer)} Nachrichten >= {thresholds.max_records}"
+    if thresholds.max_bytes and topic_buffer.estimated_bytes >= thresholds.max_bytes:
+        return f"{topic_buffer.estimated_bytes} Bytes >= {thresholds.max_bytes}"
+    age = topic_buffer.age_seconds(now)
+    if thresholds.max_age_seconds and age >= thresholds.max_age_seconds:
+        return f"Alter {age:.2f}s >= {thresholds.max_age_seconds}s"
+    return None
+
+
+def topics_due_for_flush(message_buffer: dict, now: float | None = None, force: bool = False) -> dict[str, str]:
+    """Gibt alle Topics zurück, deren Puffer geschrieben werden soll, jeweils mit dem Auslöser."""
+    now = now or time.time()
+    due_topics = {}
+    for topic_name, topic_buffer in message_buffer.items():
+        reason = get_flush_reason(topic_buffer, topic_name.split('.')[-1], now, force)
+        if reason:
+            due_topics[topic_name] = reason
+    return due_topics
@@ -1,14 +1,22 @@
 import json
-from confluent_kafka import Consumer, KafkaError, KafkaException
+import time
+from collections import defaultdict
+import pyarrow as pa
+from confluent_kafka import Consumer, KafkaError, KafkaException, TopicPartition
 
 from . import config 
 from .config import get_logger 
+from .message_processor import decode_debezium_batch
+from .dead_letter import send_to_dead_letter, flush_dead_letters
+from .metrics import MESSAGES_CONSUMED, COMMIT_DURATION, COMMIT_FAILURES, handle_kafka_statistics
 
 logger = get_logger(__name__)
 
-def create_kafka_consumer() -> Consumer | None:
+def create_kafka_consumer(worker_index: int = 0, on_assign=None, on_revoke=None, on_lost=None) -> Consumer | None:
     """
     Erstellt und konfiguriert einen Kafka Consumer.
+    worker_index unterscheidet die Consumer-Prozesse eines Supervisors (Static Membership).
+    Die Rebalance-Callbacks werden bei der Subscription registriert.
     Gibt den Consumer zurück oder None bei einem Fehler.
     """
     conf = {
@@ -16,16 +24,60 @@ def create_kafka_consumer() -> Consumer | None:
         'group.id': config.CONSUMER_GROUP_ID,
         'auto.offset.reset': 'earliest',
         'enable.auto.commit': False,  
+        # Offsets werden nur explizit für geschriebene Dateien gespeichert und committet
+        'enable.auto.offset.store': False,
+        'partition.assignment.strategy': config.KAFKA_PARTITION_ASSIGNMENT_STRATEGY,
+        'session.timeout.ms': config.KAFKA_SESSION_TIMEOUT_MS,
     }
+    if config.KAFKA_STATISTICS_INTERVAL_MS:
+        # Consumer Lag pro Partition für den Metrics-Endpunkt
+        conf['statistics.interval.ms'] = config.KAFKA_STATISTICS_INTERVAL_MS
+        conf['stats_cb'] = handle_kafka_statistics
+    if config.CONSUMER_INSTANCE_ID:
+        conf['group.instance.id'] = f"{config.CONSUMER_INSTANCE_ID}-{worker_index}"
+    callbacks = {name: callback for name, callback in (('on_assign', on_assign), ('on_revoke', on_revoke), ('on_lost', on_lost)) if callback}
     try:
         consumer = Consumer(conf)
-        consumer.subscribe([config.KAFKA_TOPIC_PATTERN])
-        logger.info(f"Kafka Consumer erstellt und auf Topic-Pattern '{config.KAFKA_TOPIC_PATTERN}' subscribed.")
+        consumer.subscribe([config.KAFKA_TOPIC_PATTERN], **callbacks)
+        logger.info(f"Kafka Consumer erstellt (Instanz: {conf.get('group.instance.id', '-')}, Strategie: {config.KAFKA_PARTITION_ASSIGNMENT_STRATEGY}) und auf Topic-Pattern '{config.KAFKA_TOPIC_PATTERN}' subscribed.")
         return consumer
     except KafkaException as e:
         logger.error(f"Kritischer Fehler bei der Kafka Consumer Initialisierung: {e}", exc_info=True)
         return None
 
+def _extract_payload(msg) -> dict | None:
+    """
+    Dekodiert den Wert einer Kafka-Nachricht und extrahiert das Debezium-Payload.
+    Partition und Offset der Nachricht werden als '_kafka_partition'/'_kafka_offset' ergänzt.
+    Gibt None zurück, wenn die Nachricht übersprungen werden soll (Tombstone).
+    Wirft ValueError (inkl. JSON- und UTF-8-Fehlern) bei nicht dekodierbaren Nachrichten.
+    """
+    if msg.value() is None:
+        # Tombstone-Nachricht (Löschmarker für Log Compaction) enthält keine Daten
+        return None
+    value_str = msg.value().decode('utf-8')
+    data = json.loads(value_str)
+    if not isinstance(data, dict):
+        raise ValueError(f"Nachricht ist kein JSON-Objekt: {type(data)}")
+
+    # Debezium-spezifische Payload-Extraktion
+    payload = data.get('payload', {}) 
+
+    # Falls 'payload' null ist oder kein Dictionary ist, die gesamte Nachricht als Fallback verwenden
+    if payload is None or not isinstance(payload, dict):
+        if payload is None: 
+            logger.warning(f"Nachricht für Topic '{msg.topic()}' hat 'payload: null'. Verwende leeres Payload.")
+            payload = {} 
+        else: 
+            logger.warning(f"Nachricht für Topic '{msg.topic()}' hat unerwarteten Payload-Typ: {type(payload)}. Wert: {payload}. Verwende die gesamte Nachricht als Payload.")
+            payload = data 
+            if not isinstance(payload, dict): 
+                raise ValueError(f"Selbst die gesamte Nachricht ist kein Dictionary: {type(payload)}")
+    payload['_kafka_partition'] = msg.partition()
+    payload['_kafka_offset'] = msg.offset()
+    return payload
+
+
 def consume_message(consumer: Consumer, message_buffer: dict) -> bool:
     """
     Konsumiert eine einzelne Nachricht von Kafka.
@@ -46,49 +98,143 @@ def consume_message(consumer: Consumer, message_buffer: dict) -> bool:
 
     # Erfolgreiche Nachricht
     try:
-        value_str = msg.value().decode('utf-8')
-        data = json.loads(value_str)
-
-        # Debezium-spezifische Payload-Extraktion
-        payload = data.get('payload', {}) 
-
-        # Falls 'payload' null ist oder kein Dictionary ist, die gesamte Nachricht als Fallback verwenden
-        if payload is None or not isinstance(payload, dict):
-            if payload is None: 
-                logger.warning(f"Nachricht für Topic '{msg.topic()}' hat 'payload: null'. Verwende leeres Payload.")
-                payload = {} 
-            else: 
-                logger.warning(f"Nachricht für Topic '{msg.topic()}' hat unerwarteten Payload-Typ: {type(payload)}. Wert: {payload}. Verwende die gesamte Nachricht als Payload.")
-                payload = data 
-                if not isinstance(payload, dict): 
-                    logger.error(f"Selbst die gesamte Nachricht für Topic '{msg.topic()}' ist kein Dictionary: {type(payload)}. Überspringe Nachricht.")
-                    return False 
+        topic_name = msg.topic()
+        MESSAGES_CONSUMED.labels(topic=topic_name).inc()
+        # Offset auch für übersprungene Nachrichten vormerken, damit er mit dem Topic committet wird
+        message_buffer[topic_name].track_messages([msg])
 
+        try:
+            payload = _extract_payload(msg)
+        except ValueError as e:
+            # JSON-/UTF-8-Fehler: Nachricht in die DLQ und sofort weiter, statt den Consumer anzuhalten
+            send_to_dead_letter(msg, e)
+            return False
+        if payload is None:
+            return False
 
-        topic_name = msg.topic()
         message_buffer[topic_name].append(payload)
         # logger.debug(f"Nachricht zu Puffer für Topic {topic_name} hinzugefügt. Puffergröße: {len(message_buffer[topic_name])}")
         return True
-    except json.JSONDecodeError:
-        logger.error(f"Fehler beim JSON-Dekodieren der Nachricht von Topic '{msg.topic()}': {msg.value()}", exc_info=True)
-        # Hier könnte man entscheiden, die Nachricht zu überspringen oder den Fehler weiterzuleiten
-        raise 
-    except UnicodeDecodeError:
-        logger.error(f"Fehler beim UTF-8 Dekodieren der Nachricht von Topic '{msg.topic()}'.", exc_info=True)
-        raise 
     except Exception as e:
         logger.error(f"Unerwarteter Fehler bei der Nachrichtenverarbeitung von Topic '{msg.topic()}': {e}", exc_info=True)
         raise 
 
 
-def commit_offsets(consumer: Consumer) -> bool:
+def _decode_messages_individually(messages: list) -> list[dict]:
+    """
+    Dekodiert Nachrichten einzeln mit json.loads.
+    Nicht dekodierbare Nachrichten werden an die DLQ weitergeleitet und übersprungen.
+    """
+    payloads = []
+    for msg in messages:
+        try:
+            payload = _extract_payload(msg)
+        except ValueError as e:
+            send_to_dead_letter(msg, e)
+            continue
+        if payload is not None:
+            payloads.append(payload)
+    return payloads
+
+
+def _decode_topic_batch(topic_name: str, messages: list) -> pa.Table | None:
+    """
+    Dekodiert alle Nachrichten eines Topics aus einem Batch in einem Aufruf zu einer Arrow-Tabelle.
+    Gibt None zurück, wenn der Batch nicht vektorisiert dekodiert werden kann.
+    """
+    try:
+        table = decode_debezium_batch([msg.value() for msg in messages])
+    except (pa.ArrowInvalid, ValueError) as e:
+        logger.warning(f"Batch-Dekodierung für Topic '{topic_name}' ({len(messages)} Nachrichten) fehlgeschlagen: {e}. Dekodiere Nachrichten einzeln.")
+        return None
+    # Herkunft jeder Zeile mitführen, damit pro geschriebener Datei die Offsets bekannt sind
+    table = table.append_column('_kafka_partition', pa.array([msg.partition() for msg in messages], pa.int64()))
+    return table.append_column('_kafka_offset', pa.array([msg.offset() for msg in messages], pa.int64()))
+
+
+def consume_batch(consumer: Consumer, message_buffer: dict) -> int:
+    """
+    Konsumiert bis zu KAFKA_BATCH_SIZE Nachrichten mit einem einzigen consume()-Aufruf
+    (maximal KAFKA_BATCH_TIMEOUT Sekunden Wartezeit) und hängt die Payloads pro Topic
+    in einem Schritt an den message_buffer an.
+    Mit VECTORIZED_JSON_DECODE und spaltenorientiertem Puffer werden die Rohdaten pro Topic
+    gesammelt und in einem Aufruf dekodiert; json.loads pro Nachricht dient nur als Fallback.
+    Nicht dekodierbare Nachrichten werden an die DLQ weitergeleitet und übersprungen, damit der Rest
+    des Batches nicht verloren geht. Gibt die Anzahl der gepufferten Nachrichten zurück.
+    """
+    messages = consumer.consume(num_messages=config.KAFKA_BATCH_SIZE, timeout=config.KAFKA_BATCH_TIMEOUT)
+    if not messages:
+        return 0
+
+    messages_by_topic = defaultdict(list)
+    kafka_error = None
+
+    for msg in messages:
+        if msg.error():
+            if msg.error().code() != KafkaError._PARTITION_EOF:
+                logger.error(f"Kafka Error: {msg.error()}")
+                kafka_error = kafka_error or msg.error()
+            continue
+        messages_by_topic[msg.topic()].append(msg)
+
+    vectorized = config.VECTORIZED_JSON_DECODE and config.MESSAGE_BUFFER_FORMAT == 'columnar'
+    added_count = 0
+    for topic_name, topic_messages in messages_by_topic.items():
+        MESSAGES_CONSUMED.labels(topic=topic_name).inc(len(topic_messages))
+        message_buffer[topic_name].track_messages(topic_messages)
+        topic_messages = [msg for msg in topic_messages if msg.value() is not None]  # Tombstones
+        if not topic_messages:
+            continue
+
+        decoded_table = _decode_topic_batch(topic_name, topic_messages) if vectorized else None
+        if decoded_table is not None:
+            message_buffer[topic_name].append_table(decoded_table)
+            added_count += decoded_table.num_rows
+            continue
+
+        payloads = _decode_messages_individually(topic_messages)
+        message_buffer[topic_name].extend(payloads)
+        added_count += len(payloads)
+
+    if kafka_error is not None:
+        # Erst nach dem Puffern werfen, damit bereits gelesene Nachrichten des Batches erhalten bleiben
+        raise KafkaException(kafka_error)
+
+    return added_count
+
+
+def build_commit_offsets(topic_name: str, next_offsets: dict[int, int]) -> list[TopicPartition]:
+    """
+    Baut die Commit-Liste für ein Topic aus dem nächsten zu lesenden Offset pro Partition
+    (wie von Kafka erwartet, also höchster geschriebener Offset + 1).
+    """
+    return [TopicPartition(topic_name, partition, offset) for partition, offset in next_offsets.items()]
+
+
+def commit_offsets(consumer: Consumer, offsets: list[TopicPartition] | None = None) -> bool:
     """
     Führt ein synchrones Commit der aktuellen Offsets durch.
+    Werden offsets übergeben, werden nur diese Partitionen gespeichert und committet
+    (z.B. nach dem Flush einzelner Topics bzw. Dateien).
+    Vorher müssen alle Dead Letters ausgeliefert sein, sonst wird nicht committet.
     """
+    start_time = time.perf_counter()
+    if not flush_dead_letters():
+        logger.error("Dead Letters konnten nicht an die DLQ ausgeliefert werden. Offsets werden nicht committet.")
+        COMMIT_FAILURES.inc()
+        return False
     try:
-        consumer.commit(asynchronous=config.KAFKA_COMMIT_ASYNCHRONOUS)
+        if offsets is not None:
+            if not offsets:
+                return True
+            consumer.store_offsets(offsets=offsets)
+            consumer.commit(offsets=offsets, asynchronous=config.KAFKA_COMMIT_ASYNCHRONOUS)
+        else:
+            consumer.commit(asynchronous=config.KAFKA_COMMIT_ASYNCHRONOUS)
+        COMMIT_DURATION.observe(time.perf_counter() - start_time)
         logger.info("Kafka Offsets erfolgreich committed.")
         return True
     except KafkaException as e:
         logger.error(f"Fehler beim Committen der Kafka Offsets: {e}", exc_info=True)
+        COMMIT_FAILURES.inc()
         return False
\ No newline at end of file
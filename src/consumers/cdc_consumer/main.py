@@ -5,139 +5,297 @@ from collections import defaultdict
 from . import config 
 from .config import get_logger 
 from .utils import GracefulKiller
-from .kafka_handler import create_kafka_consumer, consume_message, commit_offsets
-from .message_processor import transform_payloads_to_dataframe, prepare_dataframe_for_parquet_storage
-from .minio_handler import get_minio_client, write_dataframe_to_minio
-from .prefect_handler import trigger_prefect_dwh_flow_run_sync
+from .kafka_handler import create_kafka_consumer, consume_message, consume_batch, commit_offsets, build_commit_offsets
+from .flush_policy import load_flush_thresholds, topics_due_for_flush
+from .buffers import create_message_buffer, remove_partitions
+from .batch_writer import BackgroundBatchWriter, write_topic_buffer, write_partition_file
+from .backpressure import BackpressureController
+from .minio_handler import get_minio_client
+from .prefect_handler import request_dwh_flow_run, close_prefect_trigger
+from .spill import init_spill_store, close_spill_store
+from .dead_letter import close_dead_letter_queue
+from .metrics import start_metrics_server, clear_consumer_lag
 
 # Globale Zustandsvariablen
-message_buffer = defaultdict(list)
+message_buffer = create_message_buffer()
 last_successful_write_time = time.time()
+messages_consumed_since_last_write = 0
 
 logger = get_logger(config.APP_NAME) 
 
-def process_and_write_batches(minio_client, kafka_consumer_for_commit):
+def process_and_write_batches(minio_client, kafka_consumer_for_commit, topics=None):
     """
-    Verarbeitet alle Nachrichten im Puffer, schreibt sie nach MinIO und löst Prefect aus.
-    Committet Kafka Offsets bei Erfolg.
+    Verarbeitet die Nachrichten im Puffer, schreibt sie nach MinIO und löst Prefect aus.
+    Ohne topics werden alle gepufferten Topics geschrieben, sonst nur die übergebenen (Flush-Policy).
+    Committet pro Topic und Partition genau die Offsets, deren Nachrichten in geschriebenen Dateien
+    liegen; ein fehlschlagendes Topic hält die übrigen nicht auf.
     """
-    global last_successful_write_time, message_buffer
+    global last_successful_write_time, message_buffer, messages_consumed_since_last_write
 
-    if not any(message_buffer.values()):
+    # Auch Puffer ohne Zeilen (nur Tombstones/DLQ) haben Offsets, die committet werden müssen
+    if not any(topic_buffer.partition_offsets for topic_buffer in message_buffer.values()):
         logger.debug("Keine Nachrichten im Puffer zum Schreiben.")
         last_successful_write_time = time.time()
+        messages_consumed_since_last_write = 0
         return
 
-    logger.info(f"Starte Schreibzyklus. {sum(len(msgs) for msgs in message_buffer.values())} Nachrichten in {len(message_buffer)} Topics im Puffer.")
-    all_writes_this_cycle_successful = True
-    topics_successfully_processed_this_cycle = set()
+    topics_to_process = list(message_buffer.keys()) if topics is None else [t for t in topics if t in message_buffer]
 
-    for topic_name in list(message_buffer.keys()):
+    elapsed_since_last_write = max(time.time() - last_successful_write_time, 1e-6)
+    logger.info(f"Konsumrate seit letztem Schreibzyklus ({config.KAFKA_CONSUME_MODE}-Modus): {messages_consumed_since_last_write / elapsed_since_last_write:.1f} msgs/s ({messages_consumed_since_last_write} Nachrichten in {elapsed_since_last_write:.2f}s).")
+    logger.info(f"Starte Schreibzyklus. {sum(len(message_buffer[t]) for t in topics_to_process)} Nachrichten in {len(topics_to_process)} Topics werden geschrieben.")
+    failed_topics = []
+    offsets_to_commit = []
+    files_written = 0
+
+    for topic_name in topics_to_process:
         payloads_for_topic = message_buffer[topic_name]
         if not payloads_for_topic:
+            # Nur übersprungene Nachrichten (z.B. Tombstones): Offsets trotzdem mitcommitten
+            offsets_to_commit.extend(build_commit_offsets(topic_name, payloads_for_topic.next_offsets()))
             del message_buffer[topic_name] 
             continue
 
-        table_name = topic_name.split('.')[-1] # Einfache Extraktion, ggf. anpassen
-        logger.info(f"Verarbeite Batch für Topic '{topic_name}' (Tabelle: '{table_name}') mit {len(payloads_for_topic)} Nachrichten.")
-
-        # 1. Nachrichten transformieren
-        processed_df = transform_payloads_to_dataframe(payloads_for_topic, topic_name)
-        if processed_df is None or processed_df.empty:
-            logger.info(f"Keine validen Daten für Topic '{topic_name}' nach Transformation. Nachrichten werden aus Puffer entfernt.")
-            message_buffer[topic_name] = [] 
-            if not message_buffer[topic_name]:
-                del message_buffer[topic_name]
-            topics_successfully_processed_this_cycle.add(topic_name)
-            continue 
-
-        # 2. DataFrame für Parquet vorbereiten (Spalten entfernen, Partitionierungsinfo holen)
-        df_for_parquet, partition_info = prepare_dataframe_for_parquet_storage(processed_df)
-        if df_for_parquet.empty and partition_info is None: # Zusätzliche Prüfung
-             logger.warning(f"DataFrame für Topic '{topic_name}' wurde nach Vorbereitung für Parquet leer. Überspringe Schreibvorgang.")
-             message_buffer[topic_name] = []
-             if not message_buffer[topic_name]:
-                del message_buffer[topic_name]
-             topics_successfully_processed_this_cycle.add(topic_name)
-             continue
-
-        # 3. Nach MinIO schreiben
-        write_ok = write_dataframe_to_minio(minio_client, df_for_parquet, table_name, partition_info)
-
-        if write_ok:
-            logger.info(f"Batch für Topic '{topic_name}' erfolgreich nach MinIO geschrieben.")
-            message_buffer[topic_name] = [] 
-            if not message_buffer[topic_name]: 
-                del message_buffer[topic_name] 
-            topics_successfully_processed_this_cycle.add(topic_name)
-
-            # 4. Prefect Flow Run triggern (nur wenn Schreiben erfolgreich war)
-            logger.info(f"Versuche Prefect Flow für erfolgreichen Upload von Topic '{topic_name}' zu triggern.")
-            flow_run_id = trigger_prefect_dwh_flow_run_sync()
-            if flow_run_id:
-                logger.info(f"Prefect Flow Run für Topic '{topic_name}' getriggert: ID {flow_run_id}")
-            else:
-                logger.warning(f"Prefect Flow Run für Topic '{topic_name}' konnte NICHT getriggert werden.")
+        result = write_topic_buffer(minio_client, topic_name, payloads_for_topic)
+        offsets_to_commit.extend(build_commit_offsets(topic_name, result.commit_offsets))
+        files_written += result.files_written
+        if result.success:
+            del message_buffer[topic_name] 
         else:
-            logger.error(f"FEHLER beim Schreiben des Batches für Topic '{topic_name}' nach MinIO. Nachrichten bleiben im Puffer.")
-            all_writes_this_cycle_successful = False
+            logger.error(f"{len(result.failed_buffer)} Nachrichten für Topic '{topic_name}' bleiben im Puffer. Nächster Versuch in {config.FLUSH_RETRY_BACKOFF_SECONDS}s.")
+            result.failed_buffer.retry_not_before = time.time() + config.FLUSH_RETRY_BACKOFF_SECONDS
+            message_buffer[topic_name] = result.failed_buffer
+            failed_topics.append(topic_name)
 
-    # Nach der Verarbeitung aller Topics im Puffer:
-    if all_writes_this_cycle_successful and topics_successfully_processed_this_cycle: # Nur committen, wenn etwas erfolgreich war
-        logger.info("Alle Schreibvorgänge in diesem Zyklus waren erfolgreich (oder Nachrichten wurden als leer/ungültig korrekt entfernt). Committe Kafka Offsets.")
-        if not commit_offsets(kafka_consumer_for_commit):
+    # Nur die Offsets geschriebener Dateien committen; fehlgeschlagene Topics werden
+    # ab ihrem ersten nicht geschriebenen Offset erneut versucht
+    if offsets_to_commit:
+        if not commit_offsets(kafka_consumer_for_commit, offsets_to_commit):
             logger.error("KRITISCH: Offsets konnten NICHT committed werden, obwohl Schreibvorgänge erfolgreich schienen! Daten könnten erneut verarbeitet werden.")
         else:
-            logger.info("Offsets erfolgreich committet.")
-    elif not topics_successfully_processed_this_cycle and not any(message_buffer.values()):
-        logger.info("Puffer ist nun leer, aber es gab keine explizit erfolgreichen Schreibvorgänge (nur leere/ungültige Nachrichten entfernt). Kein Commit notwendig.")
-    else:
-        logger.warning("Einige Batches konnten in diesem Zyklus nicht nach MinIO geschrieben werden. Offsets werden NICHT committed. Fehlgeschlagene Nachrichten bleiben im Puffer.")
+            logger.info(f"Offsets für {len(offsets_to_commit)} Partitionen erfolgreich committet.")
+    if failed_topics:
+        logger.warning(f"Schreibvorgänge für Topics {failed_topics} sind (teilweise) fehlgeschlagen. Nicht geschriebene Nachrichten bleiben im Puffer.")
+
+    # Ein einziger (nicht blockierender) DWH Flow Run für alle Topics des Zyklus
+    if files_written:
+        request_dwh_flow_run()
 
     last_successful_write_time = time.time() 
+    messages_consumed_since_last_write = 0
     logger.info("Schreibzyklus beendet.")
 
 
-def run():
-    """Hauptfunktion zum Starten des Consumers."""
-    logger.info(f"Starte {config.APP_NAME}...")
+def hand_off_to_background_writer(background_writer: BackgroundBatchWriter, topics: list[str]):
+    """
+    Tauscht die Puffer der übergebenen Topics gegen frische aus und übergibt die vollen
+    Puffer an den Hintergrund-Writer. Neue Nachrichten landen sofort in den frischen Puffern.
+    """
+    global last_successful_write_time, messages_consumed_since_last_write
+
+    batch = {topic_name: message_buffer.pop(topic_name) for topic_name in topics if topic_name in message_buffer}
+    if not batch:
+        return
+
+    elapsed_since_last_write = max(time.time() - last_successful_write_time, 1e-6)
+    logger.info(f"Konsumrate seit letzter Übergabe ({config.KAFKA_CONSUME_MODE}-Modus): {messages_consumed_since_last_write / elapsed_since_last_write:.1f} msgs/s ({messages_consumed_since_last_write} Nachrichten in {elapsed_since_last_write:.2f}s).")
+    background_writer.submit(batch)
+    last_successful_write_time = time.time()
+    messages_consumed_since_last_write = 0
+
+
+def handle_background_write_results(background_writer: BackgroundBatchWriter, kafka_consumer_for_commit, wait: bool = False):
+    """
+    Holt die Ergebnisse des Hintergrund-Writers ab. Die Offsets geschriebener Dateien werden
+    committet; nicht geschriebene Nachrichten kommen (vor den inzwischen neu konsumierten
+    Nachrichten) zurück in den aktiven Puffer und werden nach dem Backoff erneut geschrieben.
+    """
+    results = background_writer.collect_results(wait=wait)
+    if not results:
+        return
+
+    offsets_to_commit = []
+    for result in results:
+        topic_name = result.topic_name
+        offsets_to_commit.extend(build_commit_offsets(topic_name, result.commit_offsets))
+        if result.success:
+            continue
+
+        topic_buffer = result.failed_buffer
+        logger.error(f"Hintergrund-Schreibvorgang für Topic '{topic_name}' fehlgeschlagen. {len(topic_buffer)} Nachrichten kommen zurück in den Puffer. Nächster Versuch in {config.FLUSH_RETRY_BACKOFF_SECONDS}s.")
+        topic_buffer.retry_not_before = time.time() + config.FLUSH_RETRY_BACKOFF_SECONDS
+        if topic_name in message_buffer:
+            topic_buffer.absorb(message_buffer[topic_name])
+        message_buffer[topic_name] = topic_buffer
+
+    if offsets_to_commit:
+        if commit_offsets(kafka_consumer_for_commit, offsets_to_commit):
+            logger.info(f"Offsets für {len(offsets_to_commit)} Partitionen nach Hintergrund-Schreibvorgang committet.")
+        else:
+            logger.error("KRITISCH: Offsets konnten nach erfolgreichem Hintergrund-Schreibvorgang NICHT committed werden! Daten könnten erneut verarbeitet werden.")
+
+    # Ein einziger (nicht blockierender) DWH Flow Run für alle Topics des Batches
+    if any(result.files_written for result in results):
+        request_dwh_flow_run()
+
+
+def drop_buffered_partitions(partitions: list) -> None:
+    """Entfernt gepufferte Nachrichten und Offsets der angegebenen Partitionen (TopicPartition) aus dem Puffer."""
+    partitions_by_topic = defaultdict(set)
+    for topic_partition in partitions:
+        partitions_by_topic[topic_partition.topic].add(topic_partition.partition)
+
+    for topic_name, topic_partitions in partitions_by_topic.items():
+        topic_buffer = message_buffer.get(topic_name)
+        if topic_buffer is None:
+            continue
+        remaining = remove_partitions(topic_buffer, topic_partitions)
+        dropped_count = len(topic_buffer) - len(remaining)
+        if dropped_count:
+            logger.warning(f"{dropped_count} nicht geschriebene Nachrichten der Partitionen {sorted(topic_partitions)} von Topic '{topic_name}' verworfen. Der neue Besitzer liest sie ab dem letzten Commit erneut.")
+        if remaining or remaining.partition_offsets:
+            message_buffer[topic_name] = remaining
+        else:
+            del message_buffer[topic_name]
+
+
+def handle_partitions_assigned(kafka_consumer, partitions: list) -> None:
+    """Rebalance-Callback (on_assign). Bei cooperative-sticky enthält partitions nur neu hinzugekommene Partitionen."""
+    if partitions:
+        logger.info(f"Partitionen zugewiesen: {', '.join(f'{tp.topic}[{tp.partition}]' for tp in partitions)}")
+
+
+def handle_partitions_revoked(minio_client, background_writer, kafka_consumer, partitions: list) -> None:
+    """
+    Rebalance-Callback (on_revoke): Schreibt vor der Abgabe die gepufferten Nachrichten der
+    betroffenen Topics und committet deren Offsets, solange die Partitionen noch zugewiesen sind.
+    Danach nicht geschriebene Nachrichten der abgegebenen Partitionen werden verworfen.
+    """
+    if not partitions:
+        return
+    logger.info(f"Partitionen werden abgegeben: {', '.join(f'{tp.topic}[{tp.partition}]' for tp in partitions)}. Schreibe gepufferte Nachrichten...")
+    if background_writer:
+        handle_background_write_results(background_writer, kafka_consumer, wait=True)
+    revoked_topics = {tp.topic for tp in partitions}
+    process_and_write_batches(minio_client, kafka_consumer, topics=[t for t in revoked_topics if t in message_buffer])
+    drop_buffered_partitions(partitions)
+    clear_consumer_lag(partitions)
+
+
+def handle_partitions_lost(kafka_consumer, partitions: list) -> None:
+    """Rebalance-Callback (on_lost): Partitionen sind bereits neu vergeben, ein Commit ist nicht mehr möglich."""
+    logger.warning(f"Partitionen verloren: {', '.join(f'{tp.topic}[{tp.partition}]' for tp in partitions)}.")
+    drop_buffered_partitions(partitions)
+    clear_consumer_lag(partitions)
+
+
+def get_buffered_bytes(background_writer: BackgroundBatchWriter | None = None) -> int:
+    """Geschätzte Größe aller gepufferten Nachrichten, inklusive des laufenden Hintergrund-Batches."""
+    buffered_bytes = sum(topic_buffer.estimated_bytes for topic_buffer in message_buffer.values())
+    if background_writer:
+        buffered_bytes += background_writer.in_flight_bytes
+    return buffered_bytes
+
+
+def run(worker_index: int = 0):
+    """
+    Hauptfunktion zum Starten des Consumers.
+    worker_index identifiziert den Prozess, wenn mehrere Consumer-Prozesse vom Supervisor gestartet werden.
+    """
+    global messages_consumed_since_last_write
+
+    logger.info(f"Starte {config.APP_NAME} (Prozess {worker_index})...")
     logger.info(f"Kafka Server: {config.KAFKA_BOOTSTRAP_SERVERS}, Topic Pattern: {config.KAFKA_TOPIC_PATTERN}, Group ID: {config.CONSUMER_GROUP_ID}")
     logger.info(f"MinIO Endpoint: {config.MINIO_ENDPOINT}, Bucket: {config.MINIO_BUCKET}")
-    logger.info(f"Schreibintervall: {config.WRITE_INTERVAL_SECONDS} Sekunden")
+    logger.info(f"Flush-Policy (Standard): max. {config.FLUSH_MAX_RECORDS} Nachrichten, {config.FLUSH_MAX_BYTES} Bytes, {config.FLUSH_MAX_AGE_SECONDS}s pro Topic")
+    logger.info(f"Konsum-Modus: {config.KAFKA_CONSUME_MODE} (Batch-Größe: {config.KAFKA_BATCH_SIZE}, Batch-Timeout: {config.KAFKA_BATCH_TIMEOUT}s)")
     logger.info(f"Log Level: {config.LOG_LEVEL}")
+    logger.info(f"Puffer-Format: {config.MESSAGE_BUFFER_FORMAT}")
+    logger.info(f"Flush-Modus: {config.FLUSH_MODE} (Writer-Threads: {config.WRITER_MAX_WORKERS})")
+    logger.info(f"Backpressure: High-Water {config.BUFFER_HIGH_WATER_BYTES} Bytes, Low-Water {config.BUFFER_LOW_WATER_BYTES} Bytes")
+
+    try:
+        for table_name, thresholds in load_flush_thresholds().items():
+            logger.info(f"Flush-Policy für Tabelle '{table_name}': {thresholds}")
+    except ValueError as e:
+        logger.error(f"Ungültige Flush-Policy: {e}. Anwendung wird beendet.")
+        sys.exit(1)
 
     # Graceful Shutdown Handler initialisieren
     killer = GracefulKiller()
 
-    # Kafka Consumer und MinIO Client initialisieren
-    kafka_consumer = create_kafka_consumer()
+    # MinIO Client und Kafka Consumer (mit Rebalance-Callbacks) initialisieren
     minio_client = get_minio_client()
+    if not minio_client:
+        logger.error("Fehler bei der Initialisierung des MinIO Clients. Anwendung wird beendet.")
+        sys.exit(1)
+
+    # Lokaler Spill: beim Start noch vorhandene Segmente werden im Hintergrund nach MinIO geschrieben
+    spill_store = init_spill_store(worker_index)
+    if spill_store:
+        spill_store.start_drainer(minio_client, write_partition_file)
+
+    # Prometheus-Endpunkt; Puffertiefe wird erst beim Scrape aus dem aktuellen Puffer gelesen
+    start_metrics_server(lambda: message_buffer, worker_index)
 
-    if not kafka_consumer or not minio_client:
-        logger.error("Fehler bei der Initialisierung von Kafka Consumer oder MinIO Client. Anwendung wird beendet.")
+    background_writer = None
+    if config.FLUSH_MODE == 'background':
+        background_writer = BackgroundBatchWriter(minio_client, max_workers=config.WRITER_MAX_WORKERS)
+
+    kafka_consumer = create_kafka_consumer(
+        worker_index,
+        on_assign=handle_partitions_assigned,
+        on_revoke=lambda consumer, partitions: handle_partitions_revoked(minio_client, background_writer, consumer, partitions),
+        on_lost=handle_partitions_lost,
+    )
+    if not kafka_consumer:
+        logger.error("Fehler bei der Initialisierung des Kafka Consumers. Anwendung wird beendet.")
+        if background_writer:
+            background_writer.close()
+        close_spill_store()
         sys.exit(1)
 
+    backpressure = None
+    if config.BUFFER_HIGH_WATER_BYTES > 0:
+        backpressure = BackpressureController(config.BUFFER_HIGH_WATER_BYTES, config.BUFFER_LOW_WATER_BYTES)
+
     logger.info("Initialisierung erfolgreich. Starte Konsumationsschleife (Strg+C zum Beenden)...")
 
     try:
         while not killer.kill_now:
             try:
-                # 1. Nachricht konsumieren
-                message_added_to_buffer = consume_message(kafka_consumer, message_buffer)
+                # 1. Nachricht(en) konsumieren
+                if config.KAFKA_CONSUME_MODE == 'batch':
+                    messages_added = consume_batch(kafka_consumer, message_buffer)
+                else:
+                    messages_added = int(consume_message(kafka_consumer, message_buffer))
+                messages_consumed_since_last_write += messages_added
 
             except Exception as e_consume: 
                 logger.error(f"Fehler beim Konsumieren/Verarbeiten einer Kafka-Nachricht: {e_consume}", exc_info=True)
                 time.sleep(5)
                 continue 
 
-            # 2. Schreibbedingungen prüfen
-            current_time = time.time()
-            time_since_last_write = current_time - last_successful_write_time
+            # 2. Ergebnisse des Hintergrund-Writers abholen und Offsets committen
+            if background_writer:
+                handle_background_write_results(background_writer, kafka_consumer)
+
+            # 3. Speicherbuchführung: Partitionen über der High-Water-Mark pausieren, unter der Low-Water-Mark fortsetzen
+            if backpressure:
+                backpressure.update(kafka_consumer, get_buffered_bytes(background_writer))
 
-            if (time_since_last_write >= config.WRITE_INTERVAL_SECONDS) and any(message_buffer.values()):
-                logger.info(f"Schreibintervall ({config.WRITE_INTERVAL_SECONDS}s) erreicht ({time_since_last_write:.2f}s vergangen) und Puffer enthält Daten.")
-                process_and_write_batches(minio_client, kafka_consumer)
-            elif not message_added_to_buffer and not any(message_buffer.values()):
+            # 4. Schreibbedingungen pro Topic prüfen (einmal pro Nachricht bzw. einmal pro Batch);
+            #    bei pausiertem Konsum alle Topics schreiben, damit der Puffer abgebaut wird
+            due_topics = topics_due_for_flush(message_buffer, force=bool(backpressure and backpressure.paused))
+
+            if due_topics and not (background_writer and background_writer.busy):
+                for topic_name, reason in due_topics.items():
+                    logger.info(f"Flush-Schwellwert für Topic '{topic_name}' erreicht: {reason}.")
+                if background_writer:
+                    hand_off_to_background_writer(background_writer, list(due_topics))
+                else:
+                    process_and_write_batches(minio_client, kafka_consumer, topics=list(due_topics))
+            elif not messages_added and not any(message_buffer.values()):
                 time.sleep(0.1) 
 
     except KeyboardInterrupt:
@@ -146,12 +304,21 @@ def run():
         logger.error(f"Unerwarteter schwerwiegender Fehler in der Hauptschleife: {e_main_loop}", exc_info=True)
     finally:
         logger.info("Consumer wird heruntergefahren. Versuche, verbleibende Nachrichten im Puffer zu schreiben...")
-        if any(message_buffer.values()):
+        if background_writer:
+            logger.info("Warte auf laufenden Hintergrund-Schreibvorgang...")
+            handle_background_write_results(background_writer, kafka_consumer, wait=True)
+            background_writer.close()
+        if any(topic_buffer.partition_offsets for topic_buffer in message_buffer.values()):
             logger.info(f"Es sind noch {sum(len(msgs) for msgs in message_buffer.values())} Nachrichten in {len(message_buffer)} Topics im Puffer.")
             process_and_write_batches(minio_client, kafka_consumer) 
         else:
             logger.info("Keine Nachrichten mehr im Puffer beim Herunterfahren.")
 
+        close_spill_store()
+        close_prefect_trigger(timeout=config.PREFECT_TRIGGER_SHUTDOWN_TIMEOUT_SECONDS)
+
+        close_dead_letter_queue()
+
         if kafka_consumer:
             logger.info("Schließe Kafka Consumer...")
             kafka_consumer.close()
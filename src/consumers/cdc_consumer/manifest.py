@@ -0,0 +1,72 @@
+import json
+import uuid
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+from io import BytesIO
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from minio.error import S3Error
+
+from . import config
+from .config import get_logger
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class ManifestEntry:
+    """Eine nach MinIO geschriebene Datei, wie sie der DWH Flow zum Laden braucht."""
+    object_key: str
+    table_name: str
+    row_count: int
+    min_ts_ms: int | None
+    max_ts_ms: int | None
+
+
+def build_manifest_entry(object_key: str, frame: pd.DataFrame | pa.Table, table_name: str) -> ManifestEntry:
+    """Erstellt den Manifest-Eintrag einer Datei (Zeilenzahl und Event-Time-Bereich aus '_ts_ms')."""
+    min_ts_ms = max_ts_ms = None
+    if isinstance(frame, pa.Table):
+        if '_ts_ms' in frame.column_names:
+            ts_range = pc.min_max(frame.column('_ts_ms')).as_py()
+            min_ts_ms, max_ts_ms = ts_range['min'], ts_range['max']
+    elif '_ts_ms' in frame.columns and frame['_ts_ms'].notna().any():
+        min_ts_ms, max_ts_ms = int(frame['_ts_ms'].min()), int(frame['_ts_ms'].max())
+    return ManifestEntry(object_key, table_name, len(frame), min_ts_ms, max_ts_ms)
+
+
+def build_manifest_object_name(base_prefix: str) -> str:
+    """
+    Objektname eines neuen Manifests. Der UTC-Zeitstempel am Anfang macht die Namen lexikographisch
+    nach Erstellungszeit sortierbar. Da parallele Writer ihre Manifeste nicht in Namensreihenfolge
+    hochladen, liest der Flow ab seinem Checkpoint mit einem Rückblickfenster erneut.
+    """
+    created_at = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+    return f"{config.MANIFEST_PREFIX}/{base_prefix}/{created_at}_{uuid.uuid4().hex[:8]}.json"
+
+
+def write_manifest(minio_client, entries: list[ManifestEntry], base_prefix: str = 'cdc_events') -> bool:
+    """
+    Legt die Einträge einer Schreibrunde als eigenes kleines Manifest-Objekt ab (S3-Objekte lassen sich
+    nicht anhängen). Gibt False zurück, wenn das Manifest nicht geschrieben werden konnte; die Dateien
+    der Runde gelten dann als nicht geschrieben, damit ihre Offsets nicht committet werden.
+    """
+    if not config.MANIFEST_ENABLED or not entries:
+        return True
+    object_name = build_manifest_object_name(base_prefix)
+    body = json.dumps({
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'files': [asdict(entry) for entry in entries],
+    }).encode('utf-8')
+    try:
+        minio_client.put_object(config.MINIO_BUCKET, object_name, data=BytesIO(body), length=len(body), content_type='application/json')
+    except S3Error as e:
+        logger.error(f"MinIO S3 Fehler beim Schreiben des Manifests '{object_name}': {e}")
+        return False
+    except Exception as e:
+        logger.error(f"Allgemeiner Fehler beim Schreiben des Manifests '{object_name}': {e}", exc_info=True)
+        return False
+    logger.info(f"Manifest '{object_name}' mit {len(entries)} Datei(en) geschrieben.")
+    return True
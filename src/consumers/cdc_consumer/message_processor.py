@@ -1,10 +1,22 @@
 import pandas as pd
-from datetime import datetime
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json as pa_json
+from io import BytesIO
+from datetime import datetime, timezone
 
+from . import config
 from .config import get_logger
 
 logger = get_logger(__name__)
 
+# Spalten, die nicht im Parquet File selbst gespeichert werden sollen
+COLUMNS_TO_DROP_FOR_PARQUET = [
+    '_kafka_topic',          
+    '_processing_ts_iso',    
+    '_cdc_processed_datetime',
+]
+
 def transform_payloads_to_dataframe(payloads: list, topic_name: str) -> pd.DataFrame | None:
     """
     Transformiert eine Liste von rohen Nachrichten-Payloads in einen Pandas DataFrame,
@@ -25,8 +37,9 @@ def transform_payloads_to_dataframe(payloads: list, topic_name: str) -> pd.DataF
         record_data = payload.copy() # Kopie erstellen, um das Original im Puffer nicht zu verändern
 
         # Debezium-spezifische Felder extrahieren und umbenennen/entfernen
-        actual_op = record_data.pop('__op', None)
-        actual_ts_ms = record_data.pop('__ts_ms', None)
+        # (bereits umbenannte Felder bleiben erhalten, z.B. bei erneutem Schreibversuch)
+        actual_op = record_data.pop('__op', record_data.get('_op'))
+        actual_ts_ms = record_data.pop('__ts_ms', record_data.get('_ts_ms'))
         record_data.pop('__deleted', None) 
         # record_data.pop('__source_ts_ms', None) 
         record_data.pop('__table', None)
@@ -62,45 +75,206 @@ def transform_payloads_to_dataframe(payloads: list, topic_name: str) -> pd.DataF
     return df
 
 
-def prepare_dataframe_for_parquet_storage(df: pd.DataFrame) -> tuple[pd.DataFrame, dict | None]:
+def prepare_dataframe_for_parquet_storage(df: pd.DataFrame) -> list[tuple[pd.DataFrame, dict]]:
     """
     Bereitet den DataFrame für die Speicherung als Parquet vor.
     Entfernt Spalten, die nicht im Parquet-File gespeichert werden sollen (z.B. temporäre Verarbeitungsspalten).
-    Extrahiert Informationen für die Partitionierung des Dateipfads.
+    Teilt den Batch nach Event-Time-Partition (aus '_ts_ms') und Kafka-Partition auf, sodass pro
+    Kombination eine Datei mit zusammenhängender Herkunft entsteht (Dateiname aus dem Offset-Bereich).
+    Gibt eine Liste von (DataFrame, Partitionierungsdetails) zurück.
     """
     if df.empty:
-        return df, None
+        return []
+
+    existing_columns_to_drop = [col for col in COLUMNS_TO_DROP_FOR_PARQUET if col in df.columns]
+    df_for_parquet = df.drop(columns=existing_columns_to_drop)
+
+    partition_format = _partition_key_format()
+    if '_ts_ms' in df_for_parquet.columns:
+        event_times = pd.to_datetime(df_for_parquet['_ts_ms'], unit='ms', errors='coerce')
+        partition_keys = event_times.dt.strftime(partition_format)
+    else:
+        partition_keys = pd.Series(pd.NA, index=df_for_parquet.index, dtype=object)
+    partition_keys = partition_keys.fillna(_fallback_partition_key(partition_keys.isna().sum(), partition_format))
+
+    partitions = [
+        (kafka_group.reset_index(drop=True), _partition_details_from_key(key))
+        for key, group in df_for_parquet.groupby(partition_keys, sort=True)
+        for kafka_group in _split_dataframe_by_kafka_partition(group)
+    ]
+    logger.debug(f"DataFrame für Parquet vorbereitet. Spalten: {df_for_parquet.columns.tolist()}, Partitionen: {[details for _, details in partitions]}")
+    return partitions
+
+
+def _split_dataframe_by_kafka_partition(df: pd.DataFrame) -> list[pd.DataFrame]:
+    if '_kafka_partition' not in df.columns:
+        return [df]
+    return [group for _, group in df.groupby('_kafka_partition', sort=True, dropna=False)]
+
+
+def _split_table_by_kafka_partition(table: pa.Table) -> list[pa.Table]:
+    if '_kafka_partition' not in table.column_names:
+        return [table]
+    kafka_partitions = table.column('_kafka_partition')
+    tables = [
+        table.filter(pc.equal(kafka_partitions, kafka_partition))
+        for kafka_partition in sorted(pc.unique(kafka_partitions).drop_null().to_pylist())
+    ]
+    if kafka_partitions.null_count:
+        tables.append(table.filter(pc.is_null(kafka_partitions)))
+    return tables
+
+
+def _partition_key_format() -> str:
+    return "%Y-%m-%d-%H" if config.PARTITION_BY_HOUR else "%Y-%m-%d"
+
+
+def _fallback_partition_key(missing_count: int, partition_format: str) -> str:
+    """Partitionsschlüssel für Events ohne gültigen '_ts_ms' (Verarbeitungszeit, UTC)."""
+    fallback_key = datetime.now(timezone.utc).strftime(partition_format)
+    if missing_count:
+        logger.warning(f"{missing_count} Events ohne gültigen '_ts_ms'. Verwende Verarbeitungszeit für Partitionierung: {fallback_key}")
+    return fallback_key
+
+
+def _partition_details_from_key(partition_key: str) -> dict:
+    parts = partition_key.split('-')
+    partition_details = {
+        'year': int(parts[0]),
+        'month': parts[1],
+        'day': parts[2]
+    }
+    if len(parts) > 3:
+        partition_details['hour'] = parts[3]
+    return partition_details
+
+
+def decode_debezium_batch(raw_values: list[bytes]) -> pa.Table:
+    """
+    Dekodiert die rohen Nachrichtenwerte eines Topics in einem einzigen Aufruf als NDJSON
+    mit dem vektorisierten JSON-Reader von Arrow und gibt die Spalten des Debezium-'payload' zurück.
+    Nachrichten ohne Envelope werden unverändert als Zeilen übernommen.
+    Wirft pa.ArrowInvalid bzw. ValueError, wenn der Batch nicht einheitlich dekodierbar ist.
+    """
+    ndjson = b"\n".join(raw_values)
+    # Ein einzelner Block über den gesamten Batch, damit die Typinferenz alle Zeilen sieht
+    read_options = pa_json.ReadOptions(block_size=max(len(ndjson) + 1, 1 << 20))
+    table = pa_json.read_json(BytesIO(ndjson), read_options=read_options)
+
+    if table.num_rows != len(raw_values):
+        raise ValueError(f"Anzahl dekodierter Zeilen ({table.num_rows}) passt nicht zur Anzahl Nachrichten ({len(raw_values)}).")
+
+    if 'payload' not in table.column_names:
+        return table
+
+    payload_column = table.column('payload')
+    if not pa.types.is_struct(payload_column.type):
+        raise ValueError(f"Unerwarteter Typ für 'payload': {payload_column.type}")
+
+    payload_array = payload_column.combine_chunks()
+    return pa.Table.from_arrays(
+        payload_array.flatten(),
+        names=[field.name for field in payload_column.type],
+    )
+
+
+def unwrap_debezium_columns(table: pa.Table) -> pa.Table:
+    """
+    Führt die Debezium-Extraktion als Spaltenoperation aus:
+    '__op'/'__ts_ms' werden zu '_op'/'_ts_ms', '__deleted' und '__table' werden entfernt.
+    Bereits entpackte Zeilen (z.B. fehlgeschlagene Dateien im Retry-Puffer) behalten ihre Werte.
+    """
+    num_rows = table.num_rows
+    column_names = table.column_names
 
-    # Partitionierungsdetails aus der ersten Zeile extrahieren (da sie für den gesamten Batch gelten)
+    op_column = _unwrapped_column(table, '__op', '_op', pa.string())
     try:
-        year_val = df['year'].iloc[0]
-        month_val = df['month'].iloc[0]
-        day_val = df['day'].iloc[0]
-        partition_details = {
-            'year': int(year_val), 
-            'month': str(month_val),
-            'day': str(day_val)
-        }
-    except (KeyError, IndexError) as e:
-        logger.error(f"Fehler beim Extrahieren der Partitionierungsdetails: {e}. Partitionierungsspalten fehlen oder DataFrame ist leer.", exc_info=True)
-        now = datetime.now()
-        partition_details = {
-            'year': now.year,
-            'month': f"{now.month:02d}",
-            'day': f"{now.day:02d}"
-        }
-        logger.warning(f"Verwende aktuelle Zeit für Partitionierung aufgrund eines Fehlers: {partition_details}")
-
-
-    # Spalten, die nicht im Parquet File selbst gespeichert werden sollen
-    columns_to_drop_for_parquet = [
-        '_kafka_topic',          
-        '_processing_ts_iso',    
-        '_cdc_processed_datetime',
+        ts_column = _unwrapped_column(table, '__ts_ms', '_ts_ms', pa.int64())
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+        logger.warning(f"'__ts_ms' konnte nicht nach Int64 konvertiert werden ({e}). Setze Nullwerte.")
+        ts_column = pa.nulls(num_rows, pa.int64())
+
+    columns_to_remove = [col for col in ('__op', '__ts_ms', '__deleted', '__table', '_op', '_ts_ms') if col in column_names]
+    table = table.drop_columns(columns_to_remove)
+    table = table.append_column('_op', op_column)
+    table = table.append_column('_ts_ms', ts_column)
+    return table
+
+
+def _unwrapped_column(table: pa.Table, debezium_name: str, unwrapped_name: str, target_type: pa.DataType):
+    # Debezium-Feld bevorzugen, für bereits entpackte Zeilen den vorhandenen Wert übernehmen
+    columns = [
+        pc.cast(table.column(name), target_type)
+        for name in (debezium_name, unwrapped_name) if name in table.column_names
     ]
+    if not columns:
+        return pa.nulls(table.num_rows, target_type)
+    if len(columns) == 1:
+        return columns[0]
+    return pc.coalesce(*columns)
 
-    existing_columns_to_drop = [col for col in columns_to_drop_for_parquet if col in df.columns]
-    df_for_parquet = df.drop(columns=existing_columns_to_drop)
 
-    logger.debug(f"DataFrame für Parquet vorbereitet. Spalten: {df_for_parquet.columns.tolist()}")
-    return df_for_parquet, partition_details
\ No newline at end of file
+def transform_column_buffer_to_table(buffer, topic_name: str) -> pa.Table | None:
+    """
+    Wandelt einen spaltenorientierten Topic-Puffer (ColumnarTopicBuffer) direkt in eine
+    Arrow-Tabelle um, ohne Kopie der Einzel-Payloads und ohne Pandas DataFrame.
+    """
+    if not buffer:
+        logger.debug(f"Keine Payloads zum Transformieren für Topic '{topic_name}'.")
+        return None
+
+    try:
+        table = buffer.to_arrow_table()
+    except Exception as e:
+        logger.error(f"Fehler beim Erstellen der Arrow-Tabelle für Topic '{topic_name}': {e}", exc_info=True)
+        return None
+
+    table = unwrap_debezium_columns(table)
+    logger.debug(f"Arrow-Tabelle für Topic '{topic_name}' mit {table.num_rows} Zeilen und Spalten {table.column_names} erstellt.")
+    return table
+
+
+def prepare_table_for_parquet_storage(table: pa.Table) -> list[tuple[pa.Table, dict]]:
+    """
+    Gegenstück zu prepare_dataframe_for_parquet_storage für Arrow-Tabellen.
+    Entfernt nicht zu speichernde Spalten und teilt die Tabelle nach Event-Time-Partition
+    (UTC-Datum bzw. -Stunde aus '_ts_ms') und Kafka-Partition auf.
+    """
+    if table.num_rows == 0:
+        return []
+
+    existing_columns_to_drop = [col for col in COLUMNS_TO_DROP_FOR_PARQUET if col in table.column_names]
+    table_for_parquet = table.drop_columns(existing_columns_to_drop)
+
+    partition_format = _partition_key_format()
+    if '_ts_ms' in table_for_parquet.column_names:
+        event_times = pc.cast(table_for_parquet.column('_ts_ms'), pa.timestamp('ms'))
+        partition_keys = pc.strftime(event_times, format=partition_format)
+    else:
+        partition_keys = pa.nulls(table_for_parquet.num_rows, pa.string())
+    partition_keys = pc.fill_null(partition_keys, _fallback_partition_key(partition_keys.null_count, partition_format))
+
+    partitions = []
+    for partition_key in sorted(pc.unique(partition_keys).to_pylist()):
+        partition_table = table_for_parquet.filter(pc.equal(partition_keys, partition_key))
+        partition_details = _partition_details_from_key(partition_key)
+        partitions.extend((kafka_table, partition_details) for kafka_table in _split_table_by_kafka_partition(partition_table))
+
+    logger.debug(f"Arrow-Tabelle für Parquet vorbereitet. Spalten: {table_for_parquet.column_names}, Partitionen: {[details for _, details in partitions]}")
+    return partitions
+
+
+def min_offsets_by_partition(frame: pd.DataFrame | pa.Table) -> dict[int, int] | None:
+    """
+    Niedrigster Kafka-Offset pro Partition in einer (Datei-)Tabelle bzw. einem DataFrame.
+    Gibt None zurück, wenn die Spalten '_kafka_partition'/'_kafka_offset' fehlen.
+    """
+    if isinstance(frame, pa.Table):
+        if not {'_kafka_partition', '_kafka_offset'} <= set(frame.column_names):
+            return None
+        grouped = frame.group_by('_kafka_partition').aggregate([('_kafka_offset', 'min')])
+        return dict(zip(grouped.column('_kafka_partition').to_pylist(), grouped.column('_kafka_offset_min').to_pylist()))
+
+    if not {'_kafka_partition', '_kafka_offset'} <= set(frame.columns):
+        return None
+    return {int(partition): int(offset) for partition, offset in frame.groupby('_kafka_partition')['_kafka_offset'].min().items()}
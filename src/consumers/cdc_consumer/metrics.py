@@ -0,0 +1,105 @@
+import json
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from prometheus_client.core import GaugeMetricFamily, REGISTRY
+
+from . import config
+from .config import get_logger
+
+logger = get_logger(__name__)
+
+# Buckets von 1 ms bis 2 min, passend für Encode-, Upload- und Commit-Dauern
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# --- Konsum ---
+MESSAGES_CONSUMED = Counter('cdc_messages_consumed_total', 'Von Kafka gelesene Nachrichten', ['topic'])
+DEAD_LETTERS = Counter('cdc_dead_letters_total', 'Nicht dekodierbare Nachrichten (DLQ)', ['topic'])
+CONSUMER_LAG = Gauge('cdc_consumer_lag_messages', 'Consumer Lag pro Partition (aus den librdkafka-Statistiken)', ['topic', 'partition'])
+
+# --- Schreibzyklus (process_and_write_batches / write_topic_buffer) ---
+FLUSH_DURATION = Histogram('cdc_flush_duration_seconds', 'Dauer des Schreibens eines Topic-Puffers (Transformation bis Upload)', ['topic'], buckets=DURATION_BUCKETS)
+FLUSH_MESSAGES = Counter('cdc_flush_messages_total', 'Geschriebene (transformierte) Nachrichten', ['topic'])
+TRANSFORM_DURATION = Histogram('cdc_transform_duration_seconds', 'Dauer der Transformation eines Topic-Puffers', ['topic'], buckets=DURATION_BUCKETS)
+PARQUET_ENCODE_DURATION = Histogram('cdc_parquet_encode_duration_seconds', 'Dauer der Parquet-Kodierung einer Datei (ohne gestreamte Dateien)', ['table'], buckets=DURATION_BUCKETS)
+UPLOAD_DURATION = Histogram('cdc_upload_duration_seconds', 'Dauer des Uploads einer Datei (gestreamt inkl. Kodierung)', ['table'], buckets=DURATION_BUCKETS)
+FILES_WRITTEN = Counter('cdc_files_written_total', 'Nach MinIO geschriebene Dateien', ['table'])
+FILE_WRITE_FAILURES = Counter('cdc_file_write_failures_total', 'Fehlgeschlagene Datei-Uploads', ['table'])
+BYTES_WRITTEN = Counter('cdc_bytes_written_total', 'Nach MinIO geschriebene Parquet-Bytes', ['table'])
+FILES_SPILLED = Counter('cdc_files_spilled_total', 'Lokal abgelegte Dateien (Spill)', ['table'])
+SPILL_SEGMENTS_FAILED = Counter('cdc_spill_segments_failed_total', 'Lokale Segmente, die nach SPILL_MAX_DRAIN_ATTEMPTS Versuchen nach failed/ verschoben wurden')
+
+# --- Offset Commit ---
+COMMIT_DURATION = Histogram('cdc_commit_duration_seconds', 'Dauer eines Offset-Commits (inkl. DLQ-Flush)', buckets=DURATION_BUCKETS)
+COMMIT_FAILURES = Counter('cdc_commit_failures_total', 'Fehlgeschlagene Offset-Commits')
+
+
+class BufferCollector:
+    """Liest Puffertiefe und -größe erst beim Scrape, damit der Poll-Thread nichts zusätzlich tun muss."""
+
+    def __init__(self, get_message_buffer):
+        self._get_message_buffer = get_message_buffer
+
+    def collect(self):
+        buffered_messages = GaugeMetricFamily('cdc_buffer_messages', 'Gepufferte Nachrichten pro Topic', labels=['topic'])
+        buffered_bytes = GaugeMetricFamily('cdc_buffer_bytes', 'Geschätzte Größe des Puffers pro Topic in Bytes', labels=['topic'])
+        for topic_name, topic_buffer in list(self._get_message_buffer().items()):
+            buffered_messages.add_metric([topic_name], len(topic_buffer))
+            buffered_bytes.add_metric([topic_name], topic_buffer.estimated_bytes)
+        yield buffered_messages
+        yield buffered_bytes
+
+
+# Label-Sets (topic, partition) des exportierten Consumer Lags; nur im Poll-Thread verändert
+_lag_partitions: set[tuple[str, str]] = set()
+
+
+def _remove_consumer_lag(label_sets) -> None:
+    for topic_name, partition in label_sets:
+        try:
+            CONSUMER_LAG.remove(topic_name, partition)
+        except KeyError:
+            pass
+        _lag_partitions.discard((topic_name, partition))
+
+
+def handle_kafka_statistics(stats_json: str) -> None:
+    """
+    stats_cb des Consumers (alle KAFKA_STATISTICS_INTERVAL_MS, im Poll-Thread):
+    übernimmt den Consumer Lag der zugewiesenen Partitionen. Partitionen, die nicht mehr
+    gemeldet werden oder keinen Lag mehr haben, werden aus der Metrik entfernt, damit kein
+    veralteter Lag stehen bleibt (und nach einem Rebalance nicht von zwei Prozessen gemeldet wird).
+    """
+    try:
+        stats = json.loads(stats_json)
+    except json.JSONDecodeError:
+        return
+    reported = set()
+    for topic_name, topic_stats in stats.get('topics', {}).items():
+        for partition, partition_stats in topic_stats.get('partitions', {}).items():
+            lag = partition_stats.get('consumer_lag', -1)
+            # Partition -1 ist die interne UA-Partition, Lag -1 bedeutet unbekannt (nicht zugewiesen)
+            if partition == '-1' or lag < 0:
+                continue
+            CONSUMER_LAG.labels(topic=topic_name, partition=partition).set(lag)
+            reported.add((topic_name, partition))
+    _remove_consumer_lag(_lag_partitions - reported)
+    _lag_partitions.update(reported)
+
+
+def clear_consumer_lag(partitions: list) -> None:
+    """Entfernt den Lag abgegebener bzw. verlorener Partitionen (TopicPartition) sofort aus der Metrik."""
+    _remove_consumer_lag([(tp.topic, str(tp.partition)) for tp in partitions])
+
+
+def start_metrics_server(get_message_buffer, worker_index: int = 0) -> None:
+    """Startet den HTTP-Endpunkt (/metrics) auf METRICS_PORT + worker_index (0 = deaktiviert)."""
+    if not config.METRICS_PORT:
+        return
+    port = config.METRICS_PORT + worker_index
+    try:
+        start_http_server(port)
+    except OSError as e:
+        logger.error(f"Metrics-Endpunkt auf Port {port} konnte nicht gestartet werden: {e}. Consumer läuft ohne Metriken weiter.")
+        return
+    REGISTRY.register(BufferCollector(get_message_buffer))
+    logger.info(f"Metrics-Endpunkt gestartet: http://0.0.0.0:{port}/metrics")
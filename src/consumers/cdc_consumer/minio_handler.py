@@ -1,11 +1,19 @@
+import time
 from io import BytesIO
 from datetime import datetime
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import urllib3
 from minio import Minio
 from minio.error import S3Error
 
 from . import config 
 from .config import get_logger
+from .metrics import PARQUET_ENCODE_DURATION, UPLOAD_DURATION, FILES_WRITTEN, FILE_WRITE_FAILURES, BYTES_WRITTEN
+from .multipart_upload import MultipartUploadStream
+from .parquet_profile import prepare_parquet_write
 
 logger = get_logger(__name__)
 
@@ -16,6 +24,8 @@ def get_minio_client() -> Minio | None:
     """
     Initialisiert und gibt eine MinIO Client-Instanz zurück.
     Verwendet eine Singleton-ähnliche Instanz, um die Verbindung wiederzuverwenden.
+    Der Client ist threadsicher; sein Connection-Pool (MINIO_MAX_POOL_CONNECTIONS) wird von
+    parallelen Uploads des Hintergrund-Writers gemeinsam genutzt.
     Stellt sicher, dass der Ziel-Bucket existiert und erstellt ihn bei Bedarf.
     """
     global _minio_client_instance
@@ -24,11 +34,17 @@ def get_minio_client() -> Minio | None:
 
     try:
         config.validate_critical_config() 
+        http_client = urllib3.PoolManager(
+            maxsize=max(config.MINIO_MAX_POOL_CONNECTIONS, config.WRITER_MAX_WORKERS),
+            timeout=urllib3.Timeout(connect=30, read=300),
+            retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+        )
         client = Minio(
             config.MINIO_ENDPOINT,
             access_key=config.MINIO_ACCESS_KEY,
             secret_key=config.MINIO_SECRET_KEY,
-            secure=config.MINIO_USE_SSL
+            secure=config.MINIO_USE_SSL,
+            http_client=http_client
         )
         logger.info(f"Überprüfe Existenz des MinIO Buckets '{config.MINIO_BUCKET}'...")
         found = client.bucket_exists(config.MINIO_BUCKET)
@@ -51,40 +67,130 @@ def get_minio_client() -> Minio | None:
         return None
 
 
+def build_object_file_name(dataframe: pd.DataFrame | pa.Table, table_name: str, topic_name: str | None = None) -> str:
+    """
+    Leitet den Dateinamen aus Topic, Kafka-Partition und Offset-Bereich der enthaltenen Zeilen ab
+    ('<topic>_p<partition>_<erster Offset>-<letzter Offset>.parquet'). Ein erneutes Schreiben derselben
+    Nachrichten (z.B. nach einem Absturz vor dem Offset-Commit) überschreibt so dasselbe Objekt.
+    Ohne eindeutige Kafka-Herkunft wird wie bisher ein Zeitstempel verwendet.
+    """
+    if isinstance(dataframe, pa.Table):
+        column_names = dataframe.column_names
+        if '_kafka_partition' in column_names and '_kafka_offset' in column_names:
+            partitions = pc.unique(dataframe.column('_kafka_partition')).to_pylist()
+            offset_range = pc.min_max(dataframe.column('_kafka_offset')).as_py()
+            first_offset, last_offset = offset_range['min'], offset_range['max']
+        else:
+            partitions = []
+    elif '_kafka_partition' in dataframe.columns and '_kafka_offset' in dataframe.columns:
+        partitions = dataframe['_kafka_partition'].dropna().unique().tolist()
+        first_offset, last_offset = dataframe['_kafka_offset'].min(), dataframe['_kafka_offset'].max()
+    else:
+        partitions = []
+
+    if len(partitions) == 1 and partitions[0] is not None and first_offset is not None:
+        return f"{topic_name or table_name}_p{int(partitions[0])}_{int(first_offset):019d}-{int(last_offset):019d}.parquet"
+
+    logger.warning(f"Keine eindeutige Kafka-Herkunft für Datei der Tabelle '{table_name}'. Verwende Zeitstempel als Dateinamen.")
+    file_timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+    return f"{table_name}_{file_timestamp}.parquet"
+
+
+def build_object_prefix(table_name: str, partition_details: dict | None, base_prefix: str = 'cdc_events') -> str:
+    """Baut den Pfad der Event-Time-Partition, z.B. cdc_events/orders/year=2024/month=10/day=04."""
+    if not partition_details:
+        logger.warning(f"Keine Partitionierungsdetails für Tabelle '{table_name}'. Verwende Standardpfad.")
+        return f"{base_prefix}/{table_name}/unpartitioned"
+    year = partition_details.get('year', 'unknown_year')
+    month = partition_details.get('month', 'unknown_month')
+    day = partition_details.get('day', 'unknown_day')
+    object_name_prefix = f"{base_prefix}/{table_name}/year={year}/month={month}/day={day}"
+    if 'hour' in partition_details:
+        object_name_prefix += f"/hour={partition_details['hour']}"
+    return object_name_prefix
+
+
+def is_storage_error(error: BaseException) -> bool:
+    """
+    Prüft, ob ein Schreibfehler von MinIO bzw. der Verbindung kommt (vorübergehend, lokal ablegbar)
+    und nicht von den Daten selbst (z.B. Kodierungsfehler, die sich bei jedem Versuch wiederholen).
+    Verpackte Fehler des Multipart Uploads werden über ihre Ursache geprüft.
+    """
+    while error is not None:
+        if isinstance(error, (S3Error, urllib3.exceptions.HTTPError, ConnectionError, TimeoutError)):
+            return True
+        error = error.__cause__
+    return False
+
+
+def _stream_parquet_to_minio(minio_client: Minio, object_name: str, table: pa.Table, write_options: dict, row_group_size: int) -> int:
+    """
+    Kodiert die Tabelle Row Group für Row Group direkt in einen Multipart Upload, statt die ganze
+    Datei vorher im Speicher zu halten. Gibt die Dateigröße zurück; wirft bei Fehlern, der Upload
+    wird dann abgebrochen.
+    """
+    upload_stream = MultipartUploadStream(
+        minio_client, config.MINIO_BUCKET, object_name, 'application/parquet',
+        part_size=config.MINIO_MULTIPART_PART_SIZE, parallel_uploads=config.MINIO_MULTIPART_PARALLEL_UPLOADS,
+    )
+    try:
+        with pq.ParquetWriter(upload_stream, table.schema, **write_options) as writer:
+            writer.write_table(table, row_group_size=row_group_size)
+    except Exception as e:
+        upload_stream.abort(e)
+        raise
+    upload_stream.finish()
+    return upload_stream.tell()
+
+
 def write_dataframe_to_minio(
     minio_client: Minio,
-    dataframe: pd.DataFrame,
+    dataframe: pd.DataFrame | pa.Table,
     table_name: str,
-    partition_details: dict | None
+    partition_details: dict | None,
+    topic_name: str | None = None,
+    base_prefix: str = 'cdc_events',
+    file_name: str | None = None,
+    write_errors: list | None = None,
 ) -> bool:
     """
-    Schreibt einen Pandas DataFrame als Parquet-Datei in den MinIO Bucket.
-    Der Dateipfad wird basierend auf Tabellenname und Partitionierungsdetails konstruiert.
+    Schreibt einen Pandas DataFrame oder eine Arrow-Tabelle als Parquet-Datei in den MinIO Bucket.
+    Arrow-Tabellen werden direkt kodiert, ohne Umweg über Pandas; kodiert wird mit dem
+    Writer-Profil der Tabelle (siehe parquet_profile.prepare_parquet_write). Große Tabellen
+    (ab MINIO_STREAMING_UPLOAD_MIN_BYTES) werden per Multipart Upload gestreamt.
+    Der Dateipfad wird basierend auf Tabellenname und Partitionierungsdetails konstruiert,
+    der Dateiname aus Topic, Kafka-Partition und Offset-Bereich (siehe build_object_file_name),
+    sofern file_name nicht vorgegeben ist. Ist write_errors gesetzt, wird der Fehler eines
+    fehlgeschlagenen Schreibvorgangs dort angehängt (siehe is_storage_error).
     """
-    if dataframe.empty:
+    if len(dataframe) == 0:
         logger.info(f"DataFrame für Tabelle '{table_name}' ist leer. Kein Upload nach MinIO.")
         return True 
 
-    if partition_details:
-        year = partition_details.get('year', 'unknown_year')
-        month = partition_details.get('month', 'unknown_month')
-        day = partition_details.get('day', 'unknown_day')
-        object_name_prefix = f"cdc_events/{table_name}/year={year}/month={month}/day={day}"
-    else:
-        logger.warning(f"Keine Partitionierungsdetails für Tabelle '{table_name}'. Verwende Standardpfad.")
-        object_name_prefix = f"cdc_events/{table_name}/unpartitioned"
-
-    # Zeitstempel für Dateinamen, um Eindeutigkeit zu gewährleisten
-    file_timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
-    object_name = f"{object_name_prefix}/{table_name}_{file_timestamp}.parquet"
+    object_name = f"{build_object_prefix(table_name, partition_details, base_prefix)}/{file_name or build_object_file_name(dataframe, table_name, topic_name)}"
 
     try:
-        # DataFrame in einen In-Memory Buffer als Parquet schreiben
-        out_buffer = BytesIO()
-        dataframe.to_parquet(out_buffer, index=False, engine='pyarrow', compression='snappy')
-        out_buffer.seek(0) 
+        # Writer-Profil der Tabelle (Codec, Row Groups, Sortierung, Dictionary, Page Index, Bloom-Filter)
+        table, write_options, row_group_size = prepare_parquet_write(dataframe, table_name)
 
         logger.info(f"Schreibe DataFrame ({len(dataframe)} Zeilen) für Tabelle '{table_name}' nach MinIO: {config.MINIO_BUCKET}/{object_name}")
+        if config.MINIO_STREAMING_UPLOAD_MIN_BYTES and table.nbytes >= config.MINIO_STREAMING_UPLOAD_MIN_BYTES:
+            # Kodierung und Upload überlappen; die Upload-Dauer enthält hier die Kodierung
+            upload_start = time.perf_counter()
+            file_size = _stream_parquet_to_minio(minio_client, object_name, table, write_options, row_group_size)
+            UPLOAD_DURATION.labels(table=table_name).observe(time.perf_counter() - upload_start)
+            FILES_WRITTEN.labels(table=table_name).inc()
+            BYTES_WRITTEN.labels(table=table_name).inc(file_size)
+            logger.info(f"Upload für '{object_name}' erfolgreich (Multipart).")
+            return True
+
+        # Kleine Dateien komplett in einen In-Memory Buffer kodieren und in einem Request hochladen
+        encode_start = time.perf_counter()
+        out_buffer = BytesIO()
+        pq.write_table(table, out_buffer, row_group_size=row_group_size, **write_options)
+        out_buffer.seek(0) 
+        upload_start = time.perf_counter()
+        PARQUET_ENCODE_DURATION.labels(table=table_name).observe(upload_start - encode_start)
         minio_client.put_object(
             config.MINIO_BUCKET,
             object_name,
@@ -92,11 +198,20 @@ def write_dataframe_to_minio(
             length=out_buffer.getbuffer().nbytes, 
             content_type='application/parquet'
         )
+        UPLOAD_DURATION.labels(table=table_name).observe(time.perf_counter() - upload_start)
+        FILES_WRITTEN.labels(table=table_name).inc()
+        BYTES_WRITTEN.labels(table=table_name).inc(out_buffer.getbuffer().nbytes)
         logger.info(f"Upload für '{object_name}' erfolgreich.")
         return True
     except S3Error as e:
         logger.error(f"MinIO S3 Fehler beim Upload von '{object_name}': {e}", exc_info=True)
+        FILE_WRITE_FAILURES.labels(table=table_name).inc()
+        if write_errors is not None:
+            write_errors.append(e)
         return False
     except Exception as e: 
         logger.error(f"Allgemeiner Fehler beim Schreiben/Upload von '{object_name}': {e}", exc_info=True)
+        FILE_WRITE_FAILURES.labels(table=table_name).inc()
+        if write_errors is not None:
+            write_errors.append(e)
         return False
\ No newline at end of file
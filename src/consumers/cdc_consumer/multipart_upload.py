@@ -0,0 +1,103 @@
+import threading
+
+from minio import Minio
+
+from .config import get_logger
+
+logger = get_logger(__name__)
+
+
+class MultipartUploadStream:
+    """
+    Dateiähnliches Objekt, in das der Parquet-Writer Row Group für Row Group schreibt, während ein
+    Upload-Thread die Bytes per Multipart Upload (put_object mit unbekannter Länge) nach MinIO lädt.
+    Es wird höchstens part_size Bytes zwischengepuffert; ist der Puffer voll, blockiert der Writer,
+    bis der Upload aufgeholt hat. Kodierung und Netzwerk laufen so überlappend mit begrenztem Speicher.
+    Das Objekt wird erst mit dem Abschluss des Multipart Uploads sichtbar.
+    """
+
+    def __init__(self, minio_client: Minio, bucket_name: str, object_name: str, content_type: str,
+                 part_size: int, parallel_uploads: int):
+        self.object_name = object_name
+        self.closed = False
+        self._max_buffer_bytes = part_size
+        self._buffer = bytearray()
+        self._position = 0
+        self._eof = False
+        self._writer_error: Exception | None = None
+        self._upload_error: Exception | None = None
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._upload,
+            args=(minio_client, bucket_name, object_name, content_type, part_size, parallel_uploads),
+            name=f"multipart-upload-{object_name.rsplit('/', 1)[-1]}",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _upload(self, minio_client: Minio, bucket_name: str, object_name: str, content_type: str,
+                part_size: int, parallel_uploads: int) -> None:
+        try:
+            # length=-1: MinIO liest Teile der Größe part_size, bis read() EOF meldet
+            minio_client.put_object(
+                bucket_name, object_name, data=self, length=-1, content_type=content_type,
+                part_size=part_size, num_parallel_uploads=parallel_uploads,
+            )
+        except Exception as e:
+            with self._condition:
+                self._upload_error = e
+                self._condition.notify_all()
+
+    # --- Schreibseite (Parquet-Writer) ---
+
+    def write(self, data) -> int:
+        with self._condition:
+            while len(self._buffer) >= self._max_buffer_bytes and self._upload_error is None:
+                self._condition.wait()
+            if self._upload_error is not None:
+                raise IOError(f"Multipart Upload von '{self.object_name}' fehlgeschlagen: {self._upload_error}") from self._upload_error
+            self._buffer.extend(data)
+            self._position += len(data)
+            self._condition.notify_all()
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def writable(self) -> bool:
+        return True
+
+    def finish(self) -> None:
+        """Meldet das Ende der Datei und wartet auf den Abschluss des Uploads. Wirft den Upload-Fehler weiter."""
+        with self._condition:
+            self._eof = True
+            self.closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        if self._upload_error is not None:
+            raise self._upload_error
+
+    def abort(self, error: Exception) -> None:
+        """Bricht den Upload ab (Fehler beim Kodieren); MinIO verwirft die bereits hochgeladenen Teile."""
+        with self._condition:
+            self._writer_error = error
+            self.closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    # --- Leseseite (MinIO put_object im Upload-Thread) ---
+
+    def read(self, size: int = -1) -> bytes:
+        with self._condition:
+            while not self._buffer and not self._eof and self._writer_error is None:
+                self._condition.wait()
+            if self._writer_error is not None:
+                raise IOError(f"Kodierung von '{self.object_name}' abgebrochen: {self._writer_error}")
+            chunk_size = len(self._buffer) if size is None or size < 0 else min(size, len(self._buffer))
+            chunk = bytes(self._buffer[:chunk_size])
+            del self._buffer[:chunk_size]
+            self._condition.notify_all()
+        return chunk
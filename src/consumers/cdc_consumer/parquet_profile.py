@@ -0,0 +1,190 @@
+import json
+from dataclasses import dataclass, replace
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from . import config
+from .config import get_logger
+
+logger = get_logger(__name__)
+
+# Primärschlüssel der OLTP-Tabellen (entspricht dem ORDER BY der ClickHouse Staging-Tabellen)
+TABLE_PRIMARY_KEYS = {
+    "aisles": ["aisle_id"],
+    "products": ["product_id"],
+    "departments": ["department_id"],
+    "users": ["user_id"],
+    "orders": ["order_id"],
+    "order_products": ["order_id", "product_id"],
+}
+
+
+@dataclass(frozen=True)
+class ParquetWriterProfile:
+    """
+    Einstellungen, mit denen die Parquet-Dateien einer Tabelle geschrieben werden.
+    sort_by/bloom_filter_columns = None bedeutet: aus dem Primärschlüssel der Tabelle ableiten.
+    """
+    compression: str
+    compression_level: int | None
+    row_group_size: int
+    dictionary_max_ratio: float
+    write_page_index: bool
+    sort_by: list[str] | None = None
+    bloom_filter_columns: list[str] | None = None
+
+
+def _supports_compression_level(compression: str) -> bool:
+    """Prüft den Codec; 'none' (unkomprimiert) kennt kein Level, unbekannte Codecs sind ein Konfigurationsfehler."""
+    if compression.lower() == 'none':
+        return False
+    try:
+        return pa.Codec.supports_compression_level(compression)
+    except (ValueError, pa.ArrowInvalid) as e:
+        raise ValueError(f"Unbekannter Parquet-Kompressions-Codec '{compression}': {e}") from e
+
+
+def _supports_bloom_filters() -> bool:
+    """Prüft per Probeschreiben, ob der installierte Parquet-Writer bloom_filter_options kennt."""
+    try:
+        pq.write_table(pa.table({'probe': [1]}), pa.BufferOutputStream(), bloom_filter_options={'probe': {'ndv': 1, 'fpp': 0.05}})
+    except TypeError:
+        return False
+    return True
+
+
+def _default_compression_level(compression: str) -> int | None:
+    # Der Standard-Level (PARQUET_COMPRESSION_LEVEL=3) gilt nur für Codecs, die ein Level kennen
+    if config.PARQUET_COMPRESSION_LEVEL is not None and not _supports_compression_level(compression):
+        return None
+    return config.PARQUET_COMPRESSION_LEVEL
+
+
+_default_profile = ParquetWriterProfile(
+    compression=config.PARQUET_COMPRESSION,
+    compression_level=_default_compression_level(config.PARQUET_COMPRESSION),
+    row_group_size=config.PARQUET_ROW_GROUP_SIZE,
+    dictionary_max_ratio=config.PARQUET_DICTIONARY_MAX_RATIO,
+    write_page_index=config.PARQUET_WRITE_PAGE_INDEX,
+)
+_table_profiles: dict[str, ParquetWriterProfile] | None = None
+
+
+def load_parquet_profiles() -> dict[str, ParquetWriterProfile]:
+    """
+    Liest die tabellenspezifischen Überschreibungen aus PARQUET_PROFILE_OVERRIDES.
+    Wirft ValueError bei ungültigem JSON, unbekannten Schlüsseln oder Codecs, bei einem
+    compression_level für einen Codec ohne Level sowie bei Bloom-Filtern, die die installierte
+    pyarrow-Version nicht schreiben kann. Wird beim Start über validate_critical_config()
+    aufgerufen, damit Fehler nicht erst beim Schreiben (und dann bei jedem Versuch) auftreten.
+    """
+    global _table_profiles
+    if _table_profiles is not None:
+        return _table_profiles
+
+    try:
+        overrides = json.loads(config.PARQUET_PROFILE_OVERRIDES)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"PARQUET_PROFILE_OVERRIDES ist kein gültiges JSON: {e}") from e
+    if not isinstance(overrides, dict):
+        raise ValueError("PARQUET_PROFILE_OVERRIDES muss ein JSON-Objekt mit Tabellennamen als Schlüssel sein.")
+
+    allowed_keys = set(ParquetWriterProfile.__dataclass_fields__)
+    table_profiles = {}
+    for table_name, table_override in overrides.items():
+        if not isinstance(table_override, dict):
+            raise ValueError(f"Parquet-Einstellungen für Tabelle '{table_name}' müssen ein JSON-Objekt sein.")
+        unknown_keys = set(table_override) - allowed_keys
+        if unknown_keys:
+            raise ValueError(f"Unbekannte Parquet-Einstellungen für Tabelle '{table_name}': {', '.join(sorted(unknown_keys))}")
+        profile = replace(_default_profile, **table_override)
+        if profile.compression_level is not None and not _supports_compression_level(profile.compression):
+            if 'compression_level' in table_override:
+                raise ValueError(f"Codec '{profile.compression}' der Tabelle '{table_name}' unterstützt kein compression_level.")
+            # Geerbtes Standard-Level verwerfen, z.B. bei {"orders": {"compression": "snappy"}}
+            profile = replace(profile, compression_level=None)
+        table_profiles[table_name] = profile
+
+    bloom_filter_tables = sorted(
+        table_name for table_name in set(TABLE_PRIMARY_KEYS) | set(table_profiles)
+        if _bloom_filter_columns(table_profiles.get(table_name, _default_profile), table_name)
+    )
+    if bloom_filter_tables and not _supports_bloom_filters():
+        # Sonst scheitert jeder Schreibversuch dieser Tabellen (kein Speicherfehler, also auch kein Spill)
+        raise ValueError(f"Die installierte pyarrow-Version {pa.__version__} kann keine Parquet-Bloom-Filter schreiben (Tabellen: {', '.join(bloom_filter_tables)}). PARQUET_BLOOM_FILTERS bzw. bloom_filter_columns deaktivieren.")
+
+    _table_profiles = table_profiles
+    return _table_profiles
+
+
+def get_parquet_profile(table_name: str) -> ParquetWriterProfile:
+    return load_parquet_profiles().get(table_name, _default_profile)
+
+
+def _sort_columns(profile: ParquetWriterProfile, table_name: str) -> list[str]:
+    if profile.sort_by is not None:
+        return profile.sort_by
+    if not config.PARQUET_SORT_BY_KEY:
+        return []
+    return TABLE_PRIMARY_KEYS.get(table_name, []) + ['_ts_ms']
+
+
+def _bloom_filter_columns(profile: ParquetWriterProfile, table_name: str) -> list[str]:
+    if profile.bloom_filter_columns is not None:
+        return profile.bloom_filter_columns
+    if not config.PARQUET_BLOOM_FILTERS:
+        return []
+    return TABLE_PRIMARY_KEYS.get(table_name, [])
+
+
+def _dictionary_columns(table: pa.Table, max_ratio: float) -> list[str] | bool:
+    """
+    Dictionary-Encoding nur für Spalten mit wenigen unterschiedlichen Werten (z.B. _op),
+    bei eindeutigen Spalten (IDs, Offsets) kostet das Dictionary nur Platz und CPU.
+    """
+    if max_ratio >= 1:
+        return True
+    if max_ratio <= 0 or table.num_rows == 0:
+        return False
+    columns = []
+    for field, column in zip(table.schema, table.columns):
+        if pa.types.is_nested(field.type) or pa.types.is_null(field.type):
+            continue
+        distinct_count = pc.count_distinct(column, mode='all').as_py()
+        if distinct_count / table.num_rows <= max_ratio:
+            columns.append(field.name)
+    return columns
+
+
+def prepare_parquet_write(frame: pd.DataFrame | pa.Table, table_name: str) -> tuple[pa.Table, dict, int]:
+    """
+    Wendet das Writer-Profil der Tabelle an: sortiert die Zeilen nach Primärschlüssel und _ts_ms
+    (enge Min/Max-Statistiken pro Row Group, damit ClickHouse s3() und DuckDB read_parquet
+    Row Groups überspringen können) und baut die Argumente für den Parquet-Writer.
+    Gibt (Arrow-Tabelle, Writer-Argumente, Zeilen pro Row Group) zurück.
+    """
+    profile = get_parquet_profile(table_name)
+    table = frame if isinstance(frame, pa.Table) else pa.Table.from_pandas(frame, preserve_index=False)
+
+    sort_keys = [(name, 'ascending') for name in _sort_columns(profile, table_name) if name in table.column_names]
+    sorting_columns = None
+    if sort_keys:
+        table = table.sort_by(sort_keys)
+        sorting_columns = pq.SortingColumn.from_ordering(table.schema, sort_keys)
+
+    write_options = {
+        'compression': profile.compression,
+        'compression_level': profile.compression_level,
+        'use_dictionary': _dictionary_columns(table, profile.dictionary_max_ratio),
+        'write_page_index': profile.write_page_index,
+        'sorting_columns': sorting_columns,
+    }
+    bloom_filter_columns = [name for name in _bloom_filter_columns(profile, table_name) if name in table.column_names]
+    if bloom_filter_columns:
+        # NDV pro Row Group: jede Row Group hat ihren eigenen Bloom-Filter
+        ndv = max(min(table.num_rows, profile.row_group_size), 1)
+        write_options['bloom_filter_options'] = {name: {'ndv': ndv, 'fpp': config.PARQUET_BLOOM_FILTER_FPP} for name in bloom_filter_columns}
+    return table, write_options, profile.row_group_size
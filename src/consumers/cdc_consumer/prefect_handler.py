@@ -1,81 +1,195 @@
 import asyncio
-import logging
-from datetime import datetime
-from prefect import get_client, exceptions as prefect_exceptions 
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import datetime, timezone
 
-from . import config 
+import httpx
+from prefect import get_client, exceptions as prefect_exceptions
+from prefect.client.schemas.filters import (
+    DeploymentFilter, DeploymentFilterId, FlowRunFilter, FlowRunFilterExpectedStartTime,
+    FlowRunFilterState, FlowRunFilterStateType,
+)
+from prefect.client.schemas.objects import StateType
+
+from . import config
 from .config import get_logger
 
 logger = get_logger(__name__)
 
-async def _trigger_prefect_dwh_flow_run_async_internal():
+# Zustände, in denen ein Flow Run die neuen Dateien gerade aufnimmt bzw. verarbeitet.
+# Geplante Runs zählen nur, wenn sie bereits fällig sind (siehe _read_active_flow_run): die vom
+# Scheduler im Voraus angelegten Runs eines Intervall-Deployments würden den Trigger sonst dauerhaft sperren.
+ACTIVE_FLOW_RUN_STATES = [StateType.PENDING, StateType.RUNNING]
+
+
+class PrefectFlowTrigger:
     """
-    Interne asynchrone Funktion zum Triggern eines Prefect Flow Runs.
+    Triggert den DWH Flow aus einem eigenen Event-Loop-Thread, ohne den Poll-Thread zu blockieren.
+    Deployment-ID und Prefect-Client werden einmal aufgebaut und wiederverwendet.
+    Anfragen werden zusammengefasst: Solange ein Trigger läuft oder ein Run des Deployments
+    geplant bzw. aktiv ist, wird kein weiterer Run erzeugt. Nach Ende des aktiven Runs folgt
+    höchstens ein weiterer Run für die in der Zwischenzeit geschriebenen Dateien.
     """
-    try:
-        async with get_client() as client:
-            flow_name_on_prefect = config.PREFECT_FLOW_NAME
-            deployment_name_on_prefect = config.PREFECT_DEPLOYMENT_NAME
-            prefect_deployment_identifier = f"{flow_name_on_prefect}/{deployment_name_on_prefect}"
 
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="prefect-trigger", daemon=True)
+        self._thread.start()
+        self._lock = threading.Lock()
+        self._requested = False
+        self._worker = None
+        self._client = None
+        self._deployment_id = None
+
+    def request_flow_run(self) -> None:
+        """Fordert einen DWH Flow Run an und kehrt sofort zurück."""
+        with self._lock:
+            self._requested = True
+            if self._worker is not None and not self._worker.done():
+                return
+            self._worker = asyncio.run_coroutine_threadsafe(self._process_requests(), self._loop)
+
+    async def _process_requests(self) -> None:
+        while True:
+            with self._lock:
+                if not self._requested:
+                    return
+                self._requested = False
+
+            if await self._trigger_once() == 'active':
+                # Aktiver Run könnte die neuen Dateien verpassen: nach dessen Ende erneut prüfen
+                with self._lock:
+                    self._requested = True
+                await asyncio.sleep(config.PREFECT_TRIGGER_RECHECK_SECONDS)
+
+    async def _trigger_once(self) -> str:
+        """Gibt 'triggered', 'active' (Run bereits geplant/aktiv) oder 'failed' zurück."""
+        prefect_deployment_identifier = f"{config.PREFECT_FLOW_NAME}/{config.PREFECT_DEPLOYMENT_NAME}"
+        try:
+            client = await self._get_client()
+            deployment_id = await self._get_deployment_id(client, prefect_deployment_identifier)
+            if deployment_id is None:
+                return 'failed'
+
+            active_run = await self._read_active_flow_run(client, deployment_id)
+            if active_run is not None:
+                logger.info(f"Prefect Flow Run '{active_run.name}' für '{prefect_deployment_identifier}' ist bereits {active_run.state_type.value}. Kein weiterer Run getriggert.")
+                return 'active'
+
+            flow_run_name = f"dwh-run-from-cdc-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}"
+            logger.info(f"Triggere Prefect DWH Flow Run von Deployment ID: {deployment_id} (Name: '{prefect_deployment_identifier}') mit Flow Run Name: '{flow_run_name}'")
+            flow_run = await client.create_flow_run_from_deployment(deployment_id=deployment_id, name=flow_run_name)
+            logger.info(f"Prefect DWH Flow Run (ID: {flow_run.id}, Name: '{flow_run.name}') erfolgreich getriggert.")
+            return 'triggered'
+
+        except prefect_exceptions.ObjectNotFound:
+            # Deployment wurde gelöscht oder neu angelegt: ID beim nächsten Versuch neu auflösen
+            logger.error(f"Prefect Deployment '{prefect_deployment_identifier}' (ID: {self._deployment_id}) NICHT GEFUNDEN.")
+            self._deployment_id = None
+        except prefect_exceptions.PrefectHTTPStatusError as e_http:
+            logger.error(f"Prefect HTTP Fehler: Status {e_http.response.status_code} - {e_http.response.text}", exc_info=True)
+        except httpx.ConnectError:
+            logger.error("Prefect API nicht erreichbar (ConnectError). Läuft der Prefect Server/Agent?", exc_info=True)
+            await self._close_client()
+        except Exception as e:
+            logger.error(f"Unerwarteter Fehler beim Triggern des Prefect Flow Runs: {e}", exc_info=True)
+            await self._close_client()
+        return 'failed'
+
+    @staticmethod
+    async def _read_active_flow_run(client, deployment_id):
+        """Gibt einen laufenden, wartenden oder fälligen geplanten Run des Deployments zurück (sonst None)."""
+        deployment_filter = DeploymentFilter(id=DeploymentFilterId(any_=[deployment_id]))
+        active_runs = await client.read_flow_runs(
+            deployment_filter=deployment_filter,
+            flow_run_filter=FlowRunFilter(state=FlowRunFilterState(type=FlowRunFilterStateType(any_=ACTIVE_FLOW_RUN_STATES))),
+            limit=1,
+        )
+        if active_runs:
+            return active_runs[0]
+        due_runs = await client.read_flow_runs(
+            deployment_filter=deployment_filter,
+            flow_run_filter=FlowRunFilter(
+                state=FlowRunFilterState(type=FlowRunFilterStateType(any_=[StateType.SCHEDULED])),
+                expected_start_time=FlowRunFilterExpectedStartTime(before_=datetime.now(timezone.utc)),
+            ),
+            limit=1,
+        )
+        return due_runs[0] if due_runs else None
+
+    async def _get_client(self):
+        if self._client is None:
+            client = get_client()
+            await client.__aenter__()
+            self._client = client
+        return self._client
+
+    async def _close_client(self) -> None:
+        client, self._client = self._client, None
+        if client is not None:
+            try:
+                await client.__aexit__(None, None, None)
+            except Exception as e:
+                logger.warning(f"Fehler beim Schließen des Prefect Clients: {e}")
+
+    async def _get_deployment_id(self, client, prefect_deployment_identifier: str):
+        if self._deployment_id is None:
             logger.info(f"Versuche, Prefect Deployment Details für '{prefect_deployment_identifier}' abzurufen...")
             try:
                 deployment = await client.read_deployment_by_name(name=prefect_deployment_identifier)
             except prefect_exceptions.ObjectNotFound:
                 logger.error(f"Prefect Deployment '{prefect_deployment_identifier}' NICHT GEFUNDEN.")
                 return None
-            except Exception as e_read: 
-                 logger.error(f"Fehler beim Lesen des Prefect Deployments '{prefect_deployment_identifier}': {e_read}", exc_info=True)
-                 return None
+            self._deployment_id = deployment.id
+            logger.info(f"Prefect Deployment '{prefect_deployment_identifier}' aufgelöst: ID {self._deployment_id}")
+        return self._deployment_id
 
+    def close(self, timeout: float | None = None) -> None:
+        """Wartet auf einen laufenden Trigger (ohne erneutes Prüfen aktiver Runs) und beendet den Loop-Thread."""
+        with self._lock:
+            worker = self._worker
+        if worker is not None and not worker.done():
+            try:
+                worker.result(timeout=timeout)
+            except Exception:
+                # Timeout oder Warten auf einen aktiven Run: beim Herunterfahren nicht weiter warten
+                worker.cancel()
+        close_future = asyncio.run_coroutine_threadsafe(self._close_client(), self._loop)
+        try:
+            close_future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # Hängender Client darf das Herunterfahren nicht abbrechen
+            logger.warning(f"Prefect Client konnte nicht innerhalb von {timeout}s geschlossen werden.")
+            close_future.cancel()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=timeout)
 
-            if not deployment: 
-                logger.error(f"Prefect Deployment '{prefect_deployment_identifier}' nicht gefunden (zweite Prüfung).")
-                return None
 
-            deployment_id_to_trigger = deployment.id
-            flow_run_name = f"dwh-run-from-cdc-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}"
+# Globale Trigger-Instanz, um Client, Loop und Deployment-ID wiederzuverwenden
+_prefect_trigger_instance = None
+_prefect_trigger_lock = threading.Lock()
 
-            logger.info(f"Triggere Prefect DWH Flow Run von Deployment ID: {deployment_id_to_trigger} (Name: '{prefect_deployment_identifier}') mit Flow Run Name: '{flow_run_name}'")
 
-            flow_run = await client.create_flow_run_from_deployment(
-                deployment_id=deployment_id_to_trigger,
-                name=flow_run_name,
-            )
-            logger.info(f"Prefect DWH Flow Run (ID: {flow_run.id}, Name: '{flow_run.name}') erfolgreich getriggert.")
-            return flow_run.id
-
-    except prefect_exceptions.PrefectHTTPStatusError as e_http:
-        logger.error(f"Prefect HTTP Fehler: Status {e_http.response.status_code} - {e_http.response.text}", exc_info=True)
-        return None
-    except ConnectionRefusedError:
-        logger.error("Prefect API nicht erreichbar (ConnectionRefusedError). Läuft der Prefect Server/Agent?", exc_info=True)
-        return None
-    except Exception as e: 
-        logger.error(f"Unerwarteter Fehler in _trigger_prefect_dwh_flow_run_async_internal: {e}", exc_info=True)
-        return None
-
-def trigger_prefect_dwh_flow_run_sync() -> str | None:
+def get_prefect_trigger() -> PrefectFlowTrigger:
+    global _prefect_trigger_instance
+    with _prefect_trigger_lock:
+        if _prefect_trigger_instance is None:
+            _prefect_trigger_instance = PrefectFlowTrigger()
+        return _prefect_trigger_instance
+
+
+def request_dwh_flow_run() -> None:
     """
-    Synchroner Wrapper zum Triggern des Prefect DWH Flow Runs.
-    Diese Funktion kann aus dem synchronen Haupt-Thread aufgerufen werden.
+    Fordert (nicht blockierend) einen Prefect DWH Flow Run an.
+    Wird einmal pro Schreibzyklus aufgerufen, in dem Dateien nach MinIO geschrieben wurden.
     """
-    logger.info("Versuche, Prefect DWH Flow Run synchron zu triggern...")
-    try:
-        try:
-            loop = asyncio.get_running_loop()
-        except RuntimeError:  
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-
-        flow_run_id = loop.run_until_complete(_trigger_prefect_dwh_flow_run_async_internal())
-
-        if flow_run_id:
-            logger.info(f"Prefect DWH Flow Run wurde erfolgreich getriggert mit ID: {flow_run_id}.")
-        else:
-            logger.warning("Prefect DWH Flow Run konnte nicht getriggert werden (Details siehe vorherige Logs).")
-        return flow_run_id
-
-    except Exception as e_sync_wrapper:
-        logger.error(f"Fehler im synchronen Wrapper für Prefect Trigger: {e_sync_wrapper}", exc_info=True)
-        return None
\ No newline at end of file
+    get_prefect_trigger().request_flow_run()
+
+
+def close_prefect_trigger(timeout: float | None = None) -> None:
+    """Beendet die Trigger-Instanz, falls vorhanden (beim Herunterfahren des Consumers)."""
+    global _prefect_trigger_instance
+    with _prefect_trigger_lock:
+        trigger, _prefect_trigger_instance = _prefect_trigger_instance, None
+    if trigger is not None:
+        trigger.close(timeout=timeout)
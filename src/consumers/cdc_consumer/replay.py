@@ -0,0 +1,321 @@
+import argparse
+import re
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from confluent_kafka import Consumer, KafkaError, KafkaException, TopicPartition
+
+from . import config
+from .config import get_logger
+from .batch_writer import BackgroundBatchWriter
+from .buffers import create_message_buffer
+from .dead_letter import close_dead_letter_queue, use_dead_letter_topic
+from .kafka_handler import consume_batch
+from .minio_handler import get_minio_client
+from .utils import GracefulKiller
+
+logger = get_logger(__name__)
+
+KAFKA_METADATA_TIMEOUT_SECONDS = 10.0
+
+
+@dataclass(frozen=True)
+class ReplayRange:
+    """Zu lesender Offset-Bereich einer Partition (end_offset ist der erste nicht mehr gelesene Offset)."""
+    topic: str
+    partition: int
+    start_offset: int
+    end_offset: int
+
+
+@dataclass
+class ReplayProgress:
+    messages_written: int = 0
+    files_written: int = 0
+    consecutive_failures: int = 0
+
+
+def parse_timestamp_ms(value: str) -> int:
+    """Zeitpunkt als Epoch-Millisekunden oder ISO 8601 (ohne Zeitzone als UTC interpretiert)."""
+    if value.isdigit():
+        return int(value)
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return int(timestamp.timestamp() * 1000)
+
+
+def create_replay_consumer() -> Consumer:
+    """Consumer für den Replay: Partitionen werden per assign() zugewiesen, Offsets nie committet."""
+    return Consumer({
+        'bootstrap.servers': config.KAFKA_BOOTSTRAP_SERVERS,
+        # Eigene Gruppe, damit die Offsets des laufenden Consumers unberührt bleiben
+        'group.id': f"{config.CONSUMER_GROUP_ID}-replay",
+        'enable.auto.commit': False,
+        'enable.auto.offset.store': False,
+        'enable.partition.eof': True,
+        'auto.offset.reset': 'earliest',
+        # Große Fetches: Durchsatz statt Latenz
+        'fetch.min.bytes': 1024 * 1024,
+        'queued.max.messages.kbytes': 256 * 1024,
+    })
+
+
+def _select_topics(metadata, topics: list[str] | None, topic_pattern: str) -> list[str]:
+    if topics:
+        missing_topics = [topic for topic in topics if topic not in metadata.topics]
+        if missing_topics:
+            raise ValueError(f"Topics nicht gefunden: {', '.join(missing_topics)}")
+        return topics
+    pattern = re.compile(topic_pattern)
+    return sorted(topic for topic in metadata.topics if pattern.match(topic) and not topic.startswith('__'))
+
+
+def _offsets_for_time(consumer: Consumer, partitions: list[TopicPartition], timestamp_ms: int, high_watermarks: dict) -> dict:
+    """Erster Offset mit Zeitstempel >= timestamp_ms pro Partition (ohne solche Nachricht: das Partitionsende)."""
+    found = consumer.offsets_for_times(
+        [TopicPartition(tp.topic, tp.partition, timestamp_ms) for tp in partitions],
+        timeout=KAFKA_METADATA_TIMEOUT_SECONDS,
+    )
+    return {
+        (tp.topic, tp.partition): tp.offset if tp.offset >= 0 else high_watermarks[(tp.topic, tp.partition)]
+        for tp in found
+    }
+
+
+def resolve_replay_ranges(
+    consumer: Consumer,
+    topics: list[str] | None,
+    topic_pattern: str,
+    from_offset: int | None = None,
+    from_timestamp_ms: int | None = None,
+    to_offset: int | None = None,
+    to_timestamp_ms: int | None = None,
+) -> list[ReplayRange]:
+    """
+    Bestimmt pro Partition den zu lesenden Bereich. Ohne Start wird ab dem ältesten verfügbaren Offset
+    gelesen, ohne Ende bis zum Partitionsende zum Startzeitpunkt des Replays (der Replay endet also auch
+    bei weiter laufender Produktion). Leere Bereiche werden weggelassen.
+    """
+    metadata = consumer.list_topics(timeout=KAFKA_METADATA_TIMEOUT_SECONDS)
+    partitions = [
+        TopicPartition(topic, partition)
+        for topic in _select_topics(metadata, topics, topic_pattern)
+        for partition in sorted(metadata.topics[topic].partitions)
+    ]
+    low_watermarks, high_watermarks = {}, {}
+    for tp in partitions:
+        low, high = consumer.get_watermark_offsets(tp, timeout=KAFKA_METADATA_TIMEOUT_SECONDS, cached=False)
+        low_watermarks[(tp.topic, tp.partition)] = low
+        high_watermarks[(tp.topic, tp.partition)] = high
+
+    start_offsets = dict(low_watermarks)
+    if from_offset is not None:
+        start_offsets = {key: max(low, from_offset) for key, low in low_watermarks.items()}
+    elif from_timestamp_ms is not None:
+        start_offsets = _offsets_for_time(consumer, partitions, from_timestamp_ms, high_watermarks)
+
+    end_offsets = dict(high_watermarks)
+    if to_offset is not None:
+        end_offsets = {key: min(high, to_offset) for key, high in high_watermarks.items()}
+    elif to_timestamp_ms is not None:
+        end_offsets = _offsets_for_time(consumer, partitions, to_timestamp_ms, high_watermarks)
+
+    ranges = []
+    for tp in partitions:
+        key = (tp.topic, tp.partition)
+        if start_offsets[key] < end_offsets[key]:
+            ranges.append(ReplayRange(tp.topic, tp.partition, start_offsets[key], end_offsets[key]))
+    return ranges
+
+
+class BoundedReplayConsumer:
+    """
+    Stellt consume() für consume_batch bereit: liest REPLAY_BATCH_SIZE Nachrichten pro Aufruf und
+    verwirft Nachrichten hinter dem Ende des Replay-Bereichs. Partitionen, deren Ende erreicht ist
+    (letzter Offset des Bereichs oder Partitionsende), werden pausiert.
+    """
+
+    def __init__(self, consumer: Consumer, ranges: list[ReplayRange]):
+        self._consumer = consumer
+        self._end_offsets = {(r.topic, r.partition): r.end_offset for r in ranges}
+
+    @property
+    def done(self) -> bool:
+        return not self._end_offsets
+
+    def consume(self, num_messages: int = 1, timeout: float | None = None) -> list:
+        messages = self._consumer.consume(num_messages=config.REPLAY_BATCH_SIZE, timeout=timeout)
+        in_range = []
+        for msg in messages:
+            key = (msg.topic(), msg.partition())
+            end_offset = self._end_offsets.get(key)
+            if msg.error():
+                if msg.error().code() != KafkaError._PARTITION_EOF:
+                    in_range.append(msg)  # Fehler wirft consume_batch
+                elif end_offset is not None:
+                    self._finish(key)
+                continue
+            if end_offset is None:
+                continue
+            if msg.offset() >= end_offset:
+                # Der letzte Offset des Bereichs fehlt (z.B. Transaktionsmarker oder kompaktiert)
+                self._finish(key)
+                continue
+            in_range.append(msg)
+            if msg.offset() >= end_offset - 1:
+                self._finish(key)
+        return in_range
+
+    def _finish(self, key: tuple[str, int]) -> None:
+        del self._end_offsets[key]
+        self._consumer.pause([TopicPartition(*key)])
+        logger.info(f"Replay-Ende für {key[0]}[{key[1]}] erreicht. {len(self._end_offsets)} Partitionen ausstehend.")
+
+
+def _replay_flush_due(topic_buffer) -> bool:
+    return len(topic_buffer) >= config.REPLAY_FLUSH_MAX_RECORDS or topic_buffer.estimated_bytes >= config.REPLAY_FLUSH_MAX_BYTES
+
+
+def _collect_write_results(writer: BackgroundBatchWriter, message_buffer: dict, progress: ReplayProgress, wait: bool) -> None:
+    """
+    Holt die Ergebnisse des Hintergrund-Writers ab. Nicht geschriebene Zeilen kommen zurück in den Puffer;
+    nach REPLAY_MAX_WRITE_RETRIES aufeinanderfolgenden Fehlschlägen wird der Replay abgebrochen.
+    """
+    results = writer.collect_results(wait=wait)
+    if not results:
+        return
+    failed = False
+    for result in results:
+        progress.files_written += result.files_written
+        if result.success:
+            progress.messages_written += len(result.topic_buffer)
+            continue
+        failed = True
+        topic_buffer = result.failed_buffer
+        progress.messages_written += len(result.topic_buffer) - len(topic_buffer)
+        if result.topic_name in message_buffer:
+            topic_buffer.absorb(message_buffer[result.topic_name])
+        message_buffer[result.topic_name] = topic_buffer
+
+    if not failed:
+        progress.consecutive_failures = 0
+        return
+    progress.consecutive_failures += 1
+    if progress.consecutive_failures > config.REPLAY_MAX_WRITE_RETRIES:
+        raise RuntimeError(f"Schreiben nach MinIO {progress.consecutive_failures}-mal in Folge fehlgeschlagen.")
+    logger.error(f"Schreibvorgang im Replay fehlgeschlagen ({progress.consecutive_failures}/{config.REPLAY_MAX_WRITE_RETRIES}). Nächster Versuch in {config.FLUSH_RETRY_BACKOFF_SECONDS}s.")
+    time.sleep(config.FLUSH_RETRY_BACKOFF_SECONDS)
+
+
+def run_replay(
+    topics: list[str] | None = None,
+    topic_pattern: str = config.KAFKA_TOPIC_PATTERN,
+    from_offset: int | None = None,
+    from_timestamp_ms: int | None = None,
+    to_offset: int | None = None,
+    to_timestamp_ms: int | None = None,
+    prefix: str = config.REPLAY_PREFIX,
+    history_prefix: str = config.REPLAY_HISTORY_PREFIX,
+) -> int:
+    """
+    Liest die Bereiche mit großen Batches erneut und schreibt sie unter prefix in den Bucket, ohne
+    Offset-Commits und ohne Prefect-Trigger. Während ein Batch im Hintergrund geschrieben wird, wird
+    weiter konsumiert. Die Dateinamen ergeben sich wie im Normalbetrieb aus dem Offset-Bereich, ein
+    abgebrochener Replay kann also einfach wiederholt werden. Gibt den Exit Code zurück.
+    """
+    if prefix == 'cdc_events':
+        logger.warning("Replay schreibt in das Präfix des laufenden Consumers ('cdc_events').")
+    killer = GracefulKiller()
+    # Nicht dekodierbare Nachrichten wurden im Normalbetrieb bereits weitergeleitet
+    use_dead_letter_topic(config.REPLAY_DEAD_LETTER_TOPIC)
+    minio_client = get_minio_client()
+    if not minio_client:
+        logger.error("Fehler bei der Initialisierung des MinIO Clients. Replay wird beendet.")
+        return 1
+
+    try:
+        consumer = create_replay_consumer()
+    except KafkaException as e:
+        logger.error(f"Kritischer Fehler bei der Kafka Consumer Initialisierung: {e}", exc_info=True)
+        return 1
+    try:
+        ranges = resolve_replay_ranges(consumer, topics, topic_pattern, from_offset, from_timestamp_ms, to_offset, to_timestamp_ms)
+    except (KafkaException, ValueError) as e:
+        logger.error(f"Replay-Bereich konnte nicht bestimmt werden: {e}")
+        consumer.close()
+        return 1
+    if not ranges:
+        logger.info("Keine Nachrichten im angegebenen Bereich. Replay beendet.")
+        consumer.close()
+        return 0
+
+    for replay_range in ranges:
+        logger.info(f"Replay {replay_range.topic}[{replay_range.partition}]: Offsets {replay_range.start_offset} bis {replay_range.end_offset - 1}")
+    logger.info(f"Starte Replay von {sum(r.end_offset - r.start_offset for r in ranges)} Nachrichten aus {len(ranges)} Partitionen nach {config.MINIO_BUCKET}/{prefix}/")
+
+    consumer.assign([TopicPartition(r.topic, r.partition, r.start_offset) for r in ranges])
+    bounded_consumer = BoundedReplayConsumer(consumer, ranges)
+    writer = BackgroundBatchWriter(minio_client, max_workers=config.WRITER_MAX_WORKERS, base_prefix=prefix, history_prefix=history_prefix)
+    message_buffer = create_message_buffer()
+    progress = ReplayProgress()
+    start_time = time.time()
+    exit_code = 0
+    try:
+        while not killer.kill_now and not bounded_consumer.done:
+            consume_batch(bounded_consumer, message_buffer)
+            _collect_write_results(writer, message_buffer, progress, wait=False)
+            full_topics = [topic_name for topic_name, topic_buffer in message_buffer.items() if _replay_flush_due(topic_buffer)]
+            if full_topics:
+                # Höchstens ein Batch in Arbeit, damit der Puffer nicht unbegrenzt wächst
+                _collect_write_results(writer, message_buffer, progress, wait=True)
+                writer.submit({topic_name: message_buffer.pop(topic_name) for topic_name in full_topics if topic_name in message_buffer})
+
+        # Restliche Puffer schreiben (auch nach Abbruch, damit das bereits Gelesene nicht verloren ist)
+        _collect_write_results(writer, message_buffer, progress, wait=True)
+        while remaining := {topic_name: topic_buffer for topic_name, topic_buffer in message_buffer.items() if topic_buffer}:
+            message_buffer.clear()
+            writer.submit(remaining)
+            _collect_write_results(writer, message_buffer, progress, wait=True)
+        if not bounded_consumer.done:
+            logger.warning("Replay vor Erreichen des Endes beendet. Er kann mit denselben Parametern wiederholt werden.")
+            exit_code = 1
+    except Exception as e:
+        logger.error(f"Replay abgebrochen: {e}", exc_info=True)
+        exit_code = 1
+    finally:
+        writer.close()
+        close_dead_letter_queue()
+        consumer.close()
+
+    elapsed = max(time.time() - start_time, 1e-6)
+    logger.info(f"Replay beendet: {progress.messages_written} Nachrichten in {progress.files_written} Dateien unter '{prefix}/' in {elapsed:.1f}s ({progress.messages_written / elapsed:.0f} msgs/s).")
+    return exit_code
+
+
+def run_replay_cli(argv: list[str]) -> int:
+    """Einstiegspunkt für 'python main.py replay ...'."""
+    parser = argparse.ArgumentParser(
+        prog='main.py replay',
+        description="Liest einen Offset- oder Zeitbereich erneut und schreibt ihn in ein eigenes Präfix im Bucket (ohne Offset-Commits und Prefect-Trigger).",
+    )
+    topic_group = parser.add_mutually_exclusive_group()
+    topic_group.add_argument('--topics', nargs='+', help="Zu lesende Topics (Standard: alle Topics zu --topic-pattern).")
+    topic_group.add_argument('--topic-pattern', default=config.KAFKA_TOPIC_PATTERN, help="Regex für die Topics (Standard: KAFKA_TOPIC_PATTERN).")
+    start_group = parser.add_mutually_exclusive_group()
+    start_group.add_argument('--from-offset', type=int, help="Start-Offset pro Partition (Standard: ältester verfügbarer Offset).")
+    start_group.add_argument('--from-timestamp', type=parse_timestamp_ms, help="Startzeitpunkt (ISO 8601, ohne Zeitzone UTC, oder Epoch-Millisekunden).")
+    end_group = parser.add_mutually_exclusive_group()
+    end_group.add_argument('--to-offset', type=int, help="Erster nicht mehr gelesener Offset pro Partition (Standard: Partitionsende beim Start).")
+    end_group.add_argument('--to-timestamp', type=parse_timestamp_ms, help="Endzeitpunkt (exklusiv), Format wie --from-timestamp.")
+    parser.add_argument('--prefix', default=config.REPLAY_PREFIX, help="Präfix im Bucket (Standard: REPLAY_PREFIX).")
+    parser.add_argument('--history-prefix', default=config.REPLAY_HISTORY_PREFIX, help="Präfix für die vollständige Historie bei Kompaktierung (Standard: REPLAY_HISTORY_PREFIX).")
+    args = parser.parse_args(argv)
+
+    return run_replay(
+        topics=args.topics, topic_pattern=args.topic_pattern,
+        from_offset=args.from_offset, from_timestamp_ms=args.from_timestamp,
+        to_offset=args.to_offset, to_timestamp_ms=args.to_timestamp,
+        prefix=args.prefix, history_prefix=args.history_prefix,
+    )
@@ -0,0 +1,112 @@
+import hashlib
+import threading
+
+import pandas as pd
+import pyarrow as pa
+
+from .config import get_logger
+
+logger = get_logger(__name__)
+
+
+class TopicSchema:
+    """Zwischengespeichertes Arrow-Schema eines Topics."""
+
+    def __init__(self, schema: pa.Schema):
+        self.schema = schema
+
+    @property
+    def fingerprint(self) -> str:
+        # Aus dem Schema abgeleitet und damit über Neustarts und Consumer-Instanzen hinweg eindeutig;
+        # eine prozesslokale Versionsnummer würde nach einem Neustart für andere Schemas wiederverwendet
+        return hashlib.sha1(self.schema.remove_metadata().to_string().encode('utf-8')).hexdigest()[:16]
+
+    def metadata(self) -> dict[bytes, bytes]:
+        return {b'cdc.schema.fingerprint': self.fingerprint.encode('utf-8')}
+
+
+# Globaler Schema-Cache pro Topic (von den Writer-Threads gemeinsam genutzt)
+_topic_schemas: dict[str, TopicSchema] = {}
+_topic_schemas_lock = threading.Lock()
+
+
+def _to_arrow_table(frame: pd.DataFrame | pa.Table, topic_name: str) -> pa.Table | None:
+    if isinstance(frame, pa.Table):
+        return frame
+    try:
+        return pa.Table.from_pandas(frame, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+        logger.warning(f"DataFrame für Topic '{topic_name}' konnte nicht in eine Arrow-Tabelle umgewandelt werden ({e}). Schreibe ohne Schema-Cache.")
+        return None
+
+
+def _conform_column(column, field: pa.Field) -> tuple[object, pa.Field, bool]:
+    """
+    Passt eine Spalte an den Typ des Cache-Felds an.
+    Gibt (Spalte, ggf. angepasstes Feld, echte Typänderung) zurück.
+    """
+    if column.type == field.type:
+        return column, field, False
+    if pa.types.is_null(field.type):
+        # Bisher nur Nullwerte gesehen: Typ verfeinern, keine Schemaänderung
+        return column, field.with_type(column.type), False
+    try:
+        return column.cast(field.type), field, False
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        pass
+    promoted_type = pa.unify_schemas(
+        [pa.schema([field]), pa.schema([pa.field(field.name, column.type)])],
+        promote_options='permissive',
+    ).field(field.name).type
+    try:
+        return column.cast(promoted_type), field.with_type(promoted_type), True
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        # Kein gemeinsamer Typ: als String speichern
+        return column.cast(pa.string()), field.with_type(pa.string()), True
+
+
+def conform_to_topic_schema(topic_name: str, frame: pd.DataFrame | pa.Table) -> pd.DataFrame | pa.Table:
+    """
+    Castet die transformierten Daten eines Flushes auf das zwischengespeicherte Schema des Topics,
+    statt die Typen bei jedem Batch neu abzuleiten. Das Schema stammt aus dem ersten Batch;
+    reine Nullspalten werden beim ersten konkreten Wert verfeinert. Nur echte Änderungen
+    (neue Spalten, nicht verlustfrei castbare Typen) ändern den Schema-Fingerprint und werden geloggt.
+    Der Fingerprint wird als Parquet-Metadaten mitgeschrieben.
+    """
+    table = _to_arrow_table(frame, topic_name)
+    if table is None:
+        return frame
+
+    with _topic_schemas_lock:
+        topic_schema = _topic_schemas.get(topic_name)
+        if topic_schema is None:
+            topic_schema = _topic_schemas[topic_name] = TopicSchema(table.schema.remove_metadata())
+            logger.info(f"Schema für Topic '{topic_name}' zwischengespeichert (Fingerprint {topic_schema.fingerprint}): {topic_schema.schema.names}")
+            return table.replace_schema_metadata(topic_schema.metadata())
+
+        fields, columns, changed_columns = [], [], []
+        for field in topic_schema.schema:
+            if field.name in table.column_names:
+                column, field, changed = _conform_column(table.column(field.name), field)
+                if changed:
+                    changed_columns.append(f"{field.name}: {field.type}")
+            else:
+                # Spalte fehlt in diesem Batch: mit Nullwerten auffüllen, Schema bleibt stabil
+                column = pa.nulls(table.num_rows, field.type)
+            fields.append(field)
+            columns.append(column)
+
+        new_columns = [name for name in table.column_names if name not in topic_schema.schema.names]
+        for name in new_columns:
+            fields.append(table.schema.field(name))
+            columns.append(table.column(name))
+
+        topic_schema.schema = pa.schema(fields)
+        if new_columns or changed_columns:
+            logger.warning(f"Schemaänderung für Topic '{topic_name}' erkannt (Fingerprint {topic_schema.fingerprint}): neue Spalten {new_columns}, geänderte Typen {changed_columns}.")
+        return pa.Table.from_arrays(columns, schema=topic_schema.schema.with_metadata(topic_schema.metadata()))
+
+
+def get_topic_schema(topic_name: str) -> TopicSchema | None:
+    with _topic_schemas_lock:
+        return _topic_schemas.get(topic_name)
@@ -0,0 +1,245 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+
+from . import config
+from .config import get_logger
+from .manifest import write_manifest
+from .metrics import SPILL_SEGMENTS_FAILED
+from .minio_handler import build_object_prefix, build_object_file_name, is_storage_error
+from .prefect_handler import request_dwh_flow_run
+
+logger = get_logger(__name__)
+
+SPILL_SEGMENT_SUFFIX = '.arrow'
+# Unterverzeichnis für Segmente, die wiederholt nicht geschrieben werden konnten (werden nicht mehr abgearbeitet)
+SPILL_FAILED_DIR = 'failed'
+# Schema-Metadaten eines Segments, mit denen die Datei später unverändert nach MinIO geschrieben wird
+SPILL_METADATA_PREFIX = b'cdc.spill.'
+
+
+class SpillStore:
+    """
+    Lokaler Write-Ahead-Spill für Dateien, die nicht nach MinIO geschrieben werden konnten.
+    Jede Datei wird als Arrow-IPC-Segment (fsync + atomares Umbenennen) unter demselben Pfad wie
+    das Zielobjekt abgelegt und gilt damit als dauerhaft geschrieben; ihre Offsets dürfen committet
+    werden. Ein Hintergrund-Thread liest die Segmente per Memory Map und schreibt sie nach MinIO,
+    sobald es wieder erreichbar ist. Segmente überdauern Neustarts und werden beim Start abgearbeitet.
+    Scheitert ein Segment nicht an MinIO, sondern an seinen Daten, wird es nach
+    SPILL_MAX_DRAIN_ATTEMPTS Versuchen nach failed/ verschoben, damit es die übrigen nicht blockiert.
+    Die Größe der ausstehenden Segmente (für max_bytes) wird beim Start einmal ermittelt und danach
+    mitgezählt, statt bei jedem Ablegen das Verzeichnis zu durchsuchen.
+    """
+
+    def __init__(self, root_dir: Path, max_bytes: int):
+        self.root_dir = root_dir
+        self.max_bytes = max_bytes
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._drainer = None
+        self.failed_dir = self.root_dir / SPILL_FAILED_DIR
+        # Fehlgeschlagene Versuche pro Segment (nur Fehler in den Daten, nicht bei nicht erreichbarem MinIO)
+        self._drain_attempts: dict[Path, int] = {}
+        # Reste eines Absturzes während des Schreibens eines Segments
+        for stale_file in self.root_dir.rglob(f"*{SPILL_SEGMENT_SUFFIX}.tmp"):
+            stale_file.unlink(missing_ok=True)
+        self._used_bytes = sum(path.stat().st_size for path in self.segments())
+
+    def segments(self) -> list[Path]:
+        return sorted(path for path in self.root_dir.rglob(f"*{SPILL_SEGMENT_SUFFIX}") if self.failed_dir not in path.parents)
+
+    def used_bytes(self) -> int:
+        """Größe der ausstehenden Segmente (ohne failed/)."""
+        with self._lock:
+            return self._used_bytes
+
+    def spill(
+        self, frame: pd.DataFrame | pa.Table, table_name: str, partition_details: dict | None, topic_name: str,
+        base_prefix: str = 'cdc_events', history_prefix: str | None = None,
+    ) -> bool:
+        """
+        Schreibt eine Datei als lokales Segment. base_prefix und history_prefix werden im Segment vermerkt,
+        damit es später unter denselben Präfixen geschrieben wird (z.B. im Replay-Modus).
+        Gibt False zurück, wenn sie nicht dauerhaft abgelegt werden konnte.
+        """
+        try:
+            table = frame if isinstance(frame, pa.Table) else pa.Table.from_pandas(frame, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+            logger.error(f"Daten für Tabelle '{table_name}' können nicht lokal abgelegt werden: {e}")
+            return False
+
+        file_name = Path(build_object_file_name(table, table_name, topic_name)).stem + SPILL_SEGMENT_SUFFIX
+        segment_path = self.root_dir / build_object_prefix(table_name, partition_details, base_prefix) / file_name
+        metadata = dict(table.schema.metadata or {})
+        metadata.update({
+            SPILL_METADATA_PREFIX + b'table_name': table_name.encode('utf-8'),
+            SPILL_METADATA_PREFIX + b'topic_name': topic_name.encode('utf-8'),
+            SPILL_METADATA_PREFIX + b'partition_details': json.dumps(partition_details).encode('utf-8'),
+            SPILL_METADATA_PREFIX + b'base_prefix': base_prefix.encode('utf-8'),
+            SPILL_METADATA_PREFIX + b'history_prefix': (history_prefix or '').encode('utf-8'),
+        })
+        table = table.replace_schema_metadata(metadata)
+
+        with self._lock:
+            if self.max_bytes and self._used_bytes + table.nbytes > self.max_bytes:
+                logger.error(f"Spill-Verzeichnis '{self.root_dir}' ist voll (SPILL_MAX_BYTES={self.max_bytes}). Daten für Tabelle '{table_name}' bleiben im Speicher.")
+                return False
+            temp_path = segment_path.with_name(segment_path.name + '.tmp')
+            try:
+                segment_path.parent.mkdir(parents=True, exist_ok=True)
+                with open(temp_path, 'wb') as sink:
+                    with pa.ipc.new_file(sink, table.schema) as writer:
+                        writer.write_table(table)
+                    sink.flush()
+                    os.fsync(sink.fileno())
+                segment_size = temp_path.stat().st_size
+                # Gleichnamiges Segment (gleicher Offset-Bereich) wird ersetzt
+                replaced_size = segment_path.stat().st_size if segment_path.exists() else 0
+                os.replace(temp_path, segment_path)
+                _fsync_directory(segment_path.parent)
+            except OSError as e:
+                logger.error(f"Fehler beim lokalen Ablegen von '{segment_path}': {e}", exc_info=True)
+                temp_path.unlink(missing_ok=True)
+                return False
+            self._used_bytes += segment_size - replaced_size
+        logger.warning(f"{table.num_rows} Zeilen für Tabelle '{table_name}' lokal abgelegt: {segment_path}")
+        return True
+
+    def drain(self, minio_client, write_partition_file) -> int:
+        """
+        Schreibt alle Segmente nach MinIO und löscht sie danach. Ein Segment wird erst gelöscht, wenn
+        auch sein Manifest geschrieben ist. Bricht beim ersten S3- oder Verbindungsfehler ab (MinIO
+        vermutlich weiterhin nicht erreichbar); andere Fehler zählen als Versuch des Segments, danach
+        geht es mit dem nächsten weiter. Gibt die Anzahl geschriebener Segmente zurück.
+        """
+        drained = 0
+        for segment_path in self.segments():
+            if self._stop_event.is_set():
+                break
+            manifest_entries = []
+            write_errors = []
+            base_prefix = 'cdc_events'
+            try:
+                with pa.memory_map(str(segment_path)) as source:
+                    table = pa.ipc.open_file(source).read_all()
+                    metadata = table.schema.metadata or {}
+                    spill_metadata = {key[len(SPILL_METADATA_PREFIX):].decode('utf-8'): value.decode('utf-8') for key, value in metadata.items() if key.startswith(SPILL_METADATA_PREFIX)}
+                    table = table.replace_schema_metadata({key: value for key, value in metadata.items() if not key.startswith(SPILL_METADATA_PREFIX)})
+                    # Segmente früherer Versionen ohne Präfix stammen aus dem Standardpfad
+                    base_prefix = spill_metadata.get('base_prefix', base_prefix)
+                    written = write_partition_file(
+                        minio_client, table, spill_metadata['table_name'],
+                        json.loads(spill_metadata['partition_details']), spill_metadata['topic_name'],
+                        base_prefix=base_prefix, history_prefix=spill_metadata.get('history_prefix') or None,
+                        manifest_entries=manifest_entries, write_errors=write_errors,
+                    )
+            except Exception as e:
+                logger.error(f"Lokales Segment '{segment_path}' kann nicht gelesen werden: {e}", exc_info=True)
+                written = False
+                write_errors.append(e)
+            if written and write_manifest(minio_client, manifest_entries, base_prefix):
+                self._remove_segment(segment_path)
+                self._drain_attempts.pop(segment_path, None)
+                drained += 1
+                continue
+            if not write_errors or any(is_storage_error(error) for error in write_errors):
+                logger.warning(f"Lokales Segment '{segment_path}' konnte noch nicht nach MinIO geschrieben werden. {len(self.segments())} Segmente ausstehend.")
+                break
+            attempts = self._drain_attempts.get(segment_path, 0) + 1
+            if attempts >= config.SPILL_MAX_DRAIN_ATTEMPTS:
+                self._quarantine(segment_path)
+            else:
+                self._drain_attempts[segment_path] = attempts
+                logger.warning(f"Lokales Segment '{segment_path}' fehlgeschlagen (Versuch {attempts} von {config.SPILL_MAX_DRAIN_ATTEMPTS}).")
+        if drained:
+            logger.info(f"{drained} lokale Segmente nach MinIO geschrieben.")
+            request_dwh_flow_run()
+        return drained
+
+    def _remove_segment(self, segment_path: Path) -> None:
+        with self._lock:
+            try:
+                segment_size = segment_path.stat().st_size
+                segment_path.unlink()
+            except FileNotFoundError:
+                return
+            self._used_bytes -= segment_size
+
+    def _quarantine(self, segment_path: Path) -> None:
+        """Verschiebt ein dauerhaft fehlschlagendes Segment nach failed/ (gleicher relativer Pfad)."""
+        self._drain_attempts.pop(segment_path, None)
+        target_path = self.failed_dir / segment_path.relative_to(self.root_dir)
+        with self._lock:
+            try:
+                segment_size = segment_path.stat().st_size
+                target_path.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(segment_path, target_path)
+                _fsync_directory(target_path.parent)
+            except OSError as e:
+                logger.error(f"Fehler beim Verschieben von '{segment_path}' nach '{target_path}': {e}", exc_info=True)
+                return
+            # Segmente in failed/ zählen nicht mehr gegen max_bytes
+            self._used_bytes -= segment_size
+        SPILL_SEGMENTS_FAILED.inc()
+        logger.error(f"Lokales Segment '{segment_path}' nach {config.SPILL_MAX_DRAIN_ATTEMPTS} Versuchen nach '{target_path}' verschoben. Die Zeilen werden nicht mehr automatisch geschrieben.")
+
+    def start_drainer(self, minio_client, write_partition_file) -> None:
+        """Startet den Hintergrund-Thread, der die Segmente alle SPILL_DRAIN_INTERVAL_SECONDS abarbeitet."""
+        def drain_loop():
+            while not self._stop_event.is_set():
+                if self.segments():
+                    try:
+                        self.drain(minio_client, write_partition_file)
+                    except Exception as e:
+                        logger.error(f"Unerwarteter Fehler beim Abarbeiten der lokalen Segmente: {e}", exc_info=True)
+                self._stop_event.wait(config.SPILL_DRAIN_INTERVAL_SECONDS)
+
+        self._drainer = threading.Thread(target=drain_loop, name="spill-drainer", daemon=True)
+        self._drainer.start()
+
+    def close(self, timeout: float | None = None) -> None:
+        """Beendet den Hintergrund-Thread. Nicht geschriebene Segmente bleiben für den nächsten Start liegen."""
+        self._stop_event.set()
+        if self._drainer is not None:
+            self._drainer.join(timeout=timeout)
+        remaining = len(self.segments())
+        if remaining:
+            logger.warning(f"{remaining} lokale Segmente in '{self.root_dir}' werden beim nächsten Start nach MinIO geschrieben.")
+
+
+def _fsync_directory(path: Path) -> None:
+    # Umbenennung dauerhaft machen
+    directory_fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(directory_fd)
+    finally:
+        os.close(directory_fd)
+
+
+# Globale Spill-Instanz des Prozesses (None, wenn SPILL_DIR nicht gesetzt ist)
+_spill_store_instance = None
+
+
+def init_spill_store(worker_index: int = 0) -> SpillStore | None:
+    """Legt das Spill-Verzeichnis des Prozesses an (eigenes Unterverzeichnis pro Consumer-Prozess)."""
+    global _spill_store_instance
+    if config.SPILL_DIR and _spill_store_instance is None:
+        _spill_store_instance = SpillStore(Path(config.SPILL_DIR) / f"worker-{worker_index}", config.SPILL_MAX_BYTES)
+        logger.info(f"Lokaler Spill aktiv: {_spill_store_instance.root_dir} ({len(_spill_store_instance.segments())} ausstehende Segmente).")
+    return _spill_store_instance
+
+
+def get_spill_store() -> SpillStore | None:
+    return _spill_store_instance
+
+
+def close_spill_store(timeout: float | None = None) -> None:
+    global _spill_store_instance
+    spill_store, _spill_store_instance = _spill_store_instance, None
+    if spill_store is not None:
+        spill_store.close(timeout=timeout)
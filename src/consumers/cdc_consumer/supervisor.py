@@ -0,0 +1,87 @@
+import multiprocessing
+import sys
+import time
+
+from . import config
+from .config import get_logger
+from .utils import GracefulKiller
+
+logger = get_logger(__name__)
+
+
+def _run_worker(worker_index: int) -> None:
+    """Einstiegspunkt eines Consumer-Prozesses. Jeder Prozess hat eigenen Puffer, Consumer und MinIO-Client."""
+    from . import main
+    try:
+        main.run(worker_index)
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
+class ConsumerSupervisor:
+    """
+    Startet CONSUMER_PROCESSES Consumer-Prozesse in derselben Consumer-Gruppe, damit die
+    Partitionen (z.B. von order_products) auf mehrere Kerne verteilt werden.
+    Abgestürzte Prozesse werden mit demselben Index (und damit derselben group.instance.id)
+    neu gestartet, sodass Kafka ihnen ihre bisherigen Partitionen ohne Rebalance zurückgibt.
+    SIGINT/SIGTERM werden an die Prozesse weitergereicht, die ihre Puffer vor dem Beenden schreiben.
+    """
+
+    def __init__(self, num_processes: int):
+        self.num_processes = num_processes
+        # 'spawn', damit keine Threads oder Verbindungen des Supervisors in die Prozesse kopiert werden
+        self._context = multiprocessing.get_context('spawn')
+        self._processes: dict[int, multiprocessing.Process] = {}
+        self._restart_not_before: dict[int, float] = {}
+
+    def _start_worker(self, worker_index: int) -> None:
+        process = self._context.Process(target=_run_worker, args=(worker_index,), name=f"cdc-consumer-{worker_index}")
+        process.start()
+        self._processes[worker_index] = process
+        logger.info(f"Consumer-Prozess {worker_index} gestartet (PID {process.pid}).")
+
+    def run(self) -> int:
+        killer = GracefulKiller()
+        logger.info(f"Starte {self.num_processes} Consumer-Prozesse in Consumer-Gruppe '{config.CONSUMER_GROUP_ID}'...")
+        for worker_index in range(self.num_processes):
+            self._start_worker(worker_index)
+
+        while not killer.kill_now:
+            now = time.time()
+            for worker_index, process in list(self._processes.items()):
+                if process.is_alive():
+                    continue
+                if worker_index not in self._restart_not_before:
+                    logger.error(f"Consumer-Prozess {worker_index} (PID {process.pid}) beendet mit Exit Code {process.exitcode}. Neustart in {config.CONSUMER_RESTART_BACKOFF_SECONDS}s.")
+                    self._restart_not_before[worker_index] = now + config.CONSUMER_RESTART_BACKOFF_SECONDS
+                elif now >= self._restart_not_before[worker_index]:
+                    del self._restart_not_before[worker_index]
+                    self._start_worker(worker_index)
+            time.sleep(1)
+
+        return self.shutdown()
+
+    def shutdown(self) -> int:
+        """Beendet alle Prozesse sauber (SIGTERM), nach CONSUMER_SHUTDOWN_TIMEOUT_SECONDS hart."""
+        logger.info("Beende Consumer-Prozesse...")
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+
+        deadline = time.time() + config.CONSUMER_SHUTDOWN_TIMEOUT_SECONDS
+        exit_code = 0
+        for worker_index, process in self._processes.items():
+            process.join(timeout=max(deadline - time.time(), 0))
+            if process.is_alive():
+                logger.error(f"Consumer-Prozess {worker_index} hat sich nicht rechtzeitig beendet. Erzwinge Abbruch.")
+                process.kill()
+                process.join()
+            if process.exitcode:
+                exit_code = 1
+        logger.info("Alle Consumer-Prozesse beendet.")
+        return exit_code
+
+
+def run_supervisor(num_processes: int) -> int:
+    """Startet den Supervisor und gibt den Exit Code zurück."""
+    return ConsumerSupervisor(num_processes).run()
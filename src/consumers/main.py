@@ -3,12 +3,21 @@ import sys
 # sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), 'src')))
 
 from cdc_consumer import main 
+from cdc_consumer import config
 from cdc_consumer.config import get_logger 
+from cdc_consumer.supervisor import run_supervisor
+from cdc_consumer.replay import run_replay_cli
 
 runner_logger = get_logger("CdcConsumerRunner")
 
 if __name__ == "__main__":
     try:
+        if sys.argv[1:2] == ['replay']:
+            # Replay/Backfill eines Offset- oder Zeitbereichs in ein eigenes Präfix, danach Ende
+            sys.exit(run_replay_cli(sys.argv[2:]))
+        if config.CONSUMER_PROCESSES > 1:
+            # Mehrere Consumer-Prozesse derselben Gruppe, verwaltet vom Supervisor
+            sys.exit(run_supervisor(config.CONSUMER_PROCESSES))
         main.run() 
     except SystemExit as e:
         runner_logger.info(f"Anwendung beendet mit Exit Code {e.code}.")
@@ -14,7 +14,7 @@ ranked AS (
 
     SELECT
         *,
-        ROW_NUMBER() OVER (PARTITION BY order_id ORDER BY _ts_ms DESC) as rn
+        ROW_NUMBER() OVER (PARTITION BY order_id ORDER BY _ts_ms DESC, _kafka_partition DESC, _kafka_offset DESC) as rn
     FROM source
 
 )
@@ -1,18 +1,29 @@
 import duckdb
 import os
-from datetime import datetime
+import json
+import re
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
 from minio import Minio
 from minio.error import S3Error
 from minio.commonconfig import CopySource
+from minio.deleteobjects import DeleteObject
 from prefect import flow, task, get_run_logger
 from prefect_aws.credentials import MinIOCredentials 
 from pathlib import Path
 import time
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import clickhouse_connect
 
 
 from tasks.run_dbt_runner import run_dbt_command_runner
-from utils.schema import get_staging_table_schema
+from utils.schema import get_staging_table_schema, get_staging_table_migrations
+from utils.load_ledger import (
+    STATUS_LOADED, STATUS_FAILED, STATUS_MISSING, STATUS_ARCHIVED,
+    ensure_load_ledger, compact_load_ledger, fetch_ledger_entries, fetch_failed_object_keys, fetch_unarchived_object_keys,
+    mark_archived, record_load_results,
+)
 
 # --- Konfiguration ---
 MINIO_BUCKET = "datalake"
@@ -20,6 +31,9 @@ MINIO_SERVICE_NAME = "minio"
 MINIO_PORT = 9000
 CDC_STAGING_PREFIX = "cdc_events/"
 CDC_ARCHIVE_PREFIX = "cdc-archive/"
+# Manifeste des CDC-Consumers (ein Objekt pro Schreibrunde) und Checkpoint des zuletzt verarbeiteten Manifests
+CDC_MANIFEST_PREFIX = "cdc_manifests/cdc_events/"
+CDC_MANIFEST_CHECKPOINT_KEY = "cdc_manifests/_checkpoints/cdc_events.json"
 DUCKDB_PATH = "/app/dbt_setup/dev.duckdb"
 STAGING_TABLE_PREFIX = "stg_raw_"
 MINIO_BLOCK_NAME = "minio-credentials"
@@ -36,13 +50,342 @@ CLICKHOUSE_PORT = int(os.getenv("CLICKHOUSE_PORT", 8123))
 CLICKHOUSE_USER = os.getenv("CLICKHOUSE_USER", "default")
 CLICKHOUSE_PASSWORD = os.getenv("CLICKHOUSE_PASSWORD", "devpassword")
 
+# Dateinamen des CDC-Consumers: <topic>_p<partition>_<erster Offset>-<letzter Offset>.parquet
+CDC_FILE_OFFSET_PATTERN = re.compile(r"_p(\d+)_(\d+)-(\d+)\.parquet$")
+KAFKA_SOURCE_SCHEMA = "_kafka_partition Int64, _kafka_offset Int64"
+
+# 'manifest': nur neue Manifeste lesen, 'listing': vollständiges Listing von CDC_STAGING_PREFIX (Abgleich)
+CDC_DISCOVERY_MODE = os.getenv("CDC_DISCOVERY_MODE", "manifest").lower()
+# Jeder Lauf liest die Manifeste ab (jüngstes Manifest - Lookback) erneut und überspringt bereits
+# verarbeitete, damit verspätet sichtbare Manifeste mit älterem Zeitstempel nicht verloren gehen
+CDC_MANIFEST_LOOKBACK_MINUTES = int(os.getenv("CDC_MANIFEST_LOOKBACK_MINUTES", 15))
+# Abstand der Abgleichsläufe über das vollständige Listing (auch im Manifest-Modus)
+CDC_RECONCILE_INTERVAL_MINUTES = int(os.getenv("CDC_RECONCILE_INTERVAL_MINUTES", 60))
+MANIFEST_TIMESTAMP_FORMAT = "%Y%m%dT%H%M%S%fZ"
+
+# Höchstzahl Dateien pro INSERT ... SELECT FROM s3(...), begrenzt die Länge der URL
+CLICKHOUSE_MAX_FILES_PER_INSERT = int(os.getenv("CLICKHOUSE_MAX_FILES_PER_INSERT", 500))
+# Anzahl Tabellen, die parallel geladen werden (je Worker ein eigener ClickHouse Client), 1 = nacheinander
+CLICKHOUSE_LOAD_PARALLELISM = max(1, int(os.getenv("CLICKHOUSE_LOAD_PARALLELISM", 4)))
+# Parallele Einzelanfragen an MinIO (ETags der zu ladenden Dateien, Kopien beim Archivieren)
+MINIO_MAX_WORKERS = int(os.getenv("MINIO_MAX_WORKERS", 16))
+# 'move': geladene Dateien nach CDC_ARCHIVE_PREFIX verschieben, 'ledger': Dateien liegen lassen,
+# als verbraucht gelten sie über das Ladeprotokoll (Kosten wachsen nicht mit der Anzahl Dateien)
+CDC_ARCHIVE_MODE = os.getenv("CDC_ARCHIVE_MODE", "move").lower()
+# Im Modus 'ledger' listet der Abgleich nur die Datumspartitionen (year=/month=/day=) der letzten Tage,
+# ältere (und unpartitioned/) Dateien findet nur noch der Manifest-Pfad
+CDC_LEDGER_LISTING_DAYS = int(os.getenv("CDC_LEDGER_LISTING_DAYS", 2))
+# Aufbewahrung abgeschlossener Einträge im Ladeprotokoll (archiviert/nicht mehr vorhanden, im Modus
+# 'ledger' auch geladen); muss das Listing-Fenster samt morgen und heute überdauern, sonst würden noch
+# gelistete Dateien erneut geladen
+CDC_LEDGER_RETENTION_DAYS = int(os.getenv("CDC_LEDGER_RETENTION_DAYS", 7))
+if CDC_LEDGER_RETENTION_DAYS < CDC_LEDGER_LISTING_DAYS + 2:
+    raise ValueError(f"CDC_LEDGER_RETENTION_DAYS ({CDC_LEDGER_RETENTION_DAYS}) muss mindestens CDC_LEDGER_LISTING_DAYS + 2 ({CDC_LEDGER_LISTING_DAYS + 2}) sein.")
+# Höchstzahl Objekte pro Multi-Object-Delete (S3-Limit)
+MINIO_DELETE_BATCH_SIZE = 1000
+# S3-URL-Basis für die ClickHouse-Funktion (aus Sicht des ClickHouse-Servers)
+S3_URL_BASE = f"http://{MINIO_SERVICE_NAME}:{MINIO_PORT}/{MINIO_BUCKET}/"
+
+# Spalten der Parquet-Dateien des CDC-Consumers pro Tabelle
+PARQUET_SCHEMA_DEFINITIONS = {
+    "aisles": "aisle_id Int64, aisle String, _op String, _ts_ms Int64",
+    "products": "product_id Int64, product_name String, aisle_id Nullable(Int64), department_id Nullable(Int64), _op String, _ts_ms Int64",
+    "departments": "department_id Int64, department String, _op String, _ts_ms Int64",
+    "users": "user_id Int64, _op String, _ts_ms Int64",
+    "orders": "order_id Int64, user_id Int64, order_date Int64, tip_given Nullable(Boolean), _op String, _ts_ms Int64",
+    "order_products": "order_id Int64, product_id Int64, add_to_cart_order Int64, _op String, _ts_ms Int64",
+}
+
+
+def get_kafka_offset_range(object_key: str) -> tuple[int, int, int] | None:
+    """Liest (Partition, erster Offset, letzter Offset) aus dem Dateinamen, None bei älteren Dateien."""
+    match = CDC_FILE_OFFSET_PATTERN.search(object_key)
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(2)), int(match.group(3))
+
+def create_minio_client(minio_endpoint: str) -> Minio:
+    """Erstellt einen MinIO Client mit den Zugangsdaten aus dem Prefect Block."""
+    minio_creds = MinIOCredentials.load(MINIO_BLOCK_NAME)
+    return Minio(
+        minio_endpoint,
+        access_key=minio_creds.minio_root_user,
+        secret_key=minio_creds.minio_root_password.get_secret_value(),
+        secure=MINIO_USE_SSL,
+    )
+
+
+def read_manifest_checkpoint(client: Minio, bucket: str, checkpoint_key: str) -> dict | None:
+    """Gibt den gespeicherten Manifest-Zustand zurück, None ohne Checkpoint."""
+    try:
+        response = client.get_object(bucket, checkpoint_key)
+        try:
+            return json.loads(response.read())
+        finally:
+            response.close()
+            response.release_conn()
+    except S3Error as e:
+        if e.code == "NoSuchKey":
+            return None
+        raise
+
+
+def get_manifest_timestamp(manifest_name: str) -> datetime | None:
+    """Liest den UTC-Erstellungszeitpunkt aus dem Manifestnamen, None bei fremden Objekten."""
+    file_name = manifest_name.rsplit('/', 1)[-1]
+    try:
+        return datetime.strptime(file_name.split('_', 1)[0], MANIFEST_TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+
+def list_manifests(client: Minio, bucket: str, manifest_prefix: str, since: datetime) -> list[str]:
+    """
+    Listet die Manifeste ab dem Zeitpunkt since. Die Namen beginnen mit dem UTC-Erstellungszeitpunkt,
+    MinIO liefert sie also chronologisch und start_after überspringt alle älteren.
+    """
+    start_after = manifest_prefix + since.strftime(MANIFEST_TIMESTAMP_FORMAT)
+    return [
+        obj.object_name
+        for obj in client.list_objects(bucket, prefix=manifest_prefix, recursive=True, start_after=start_after)
+        if get_manifest_timestamp(obj.object_name) is not None
+    ]
+
+
+def build_manifest_state(watermark: datetime, processed: set[str], last_reconciliation: str | None) -> dict:
+    """
+    Baut den Checkpoint: watermark ist der jüngste bekannte Manifest-Zeitpunkt, processed enthält die
+    verarbeiteten Manifeste im Lookback-Fenster davor (ältere liest der nächste Lauf nicht mehr).
+    """
+    window_start = watermark - timedelta(minutes=CDC_MANIFEST_LOOKBACK_MINUTES)
+    return {
+        "watermark": watermark.strftime(MANIFEST_TIMESTAMP_FORMAT),
+        "processed": sorted(name for name in processed if get_manifest_timestamp(name) >= window_start),
+        "last_reconciliation": last_reconciliation,
+    }
+
+
+def is_reconciliation_due(state: dict) -> bool:
+    """Prüft, ob der letzte Abgleich über das vollständige Listing länger als CDC_RECONCILE_INTERVAL_MINUTES zurückliegt."""
+    last_reconciliation = state.get("last_reconciliation")
+    if not last_reconciliation:
+        return True
+    elapsed = datetime.now(timezone.utc) - datetime.fromisoformat(last_reconciliation)
+    return elapsed >= timedelta(minutes=CDC_RECONCILE_INTERVAL_MINUTES)
+
+
+def stat_object_etags(client: Minio, bucket: str, object_keys: list[str]) -> dict[str, str]:
+    """Gibt {object_key: etag} zurück; nicht (mehr) vorhandene Objekte fehlen im Ergebnis."""
+    def stat(object_key: str) -> str | None:
+        try:
+            return client.stat_object(bucket, object_key).etag
+        except S3Error as e:
+            if e.code == "NoSuchKey":
+                return None
+            raise
+
+    with ThreadPoolExecutor(max_workers=MINIO_MAX_WORKERS, thread_name_prefix="minio-stat") as executor:
+        etags = dict(zip(object_keys, executor.map(stat, object_keys)))
+    return {object_key: etag for object_key, etag in etags.items() if etag is not None}
+
+
+def get_listing_prefixes(client: Minio, bucket: str, staging_prefix: str) -> list[str]:
+    """
+    Gibt die Präfixe für das vollständige Listing zurück: im Modus 'move' den ganzen Staging-Bereich
+    (geladene Dateien werden verschoben), im Modus 'ledger' pro Tabelle nur die Datumspartitionen der
+    letzten CDC_LEDGER_LISTING_DAYS Tage (UTC, zzgl. morgen wegen Uhrenabweichungen), damit das Listing
+    nicht mit allen jemals geladenen Dateien wächst.
+    """
+    if CDC_ARCHIVE_MODE != "ledger":
+        return [staging_prefix]
+    table_prefixes = [obj.object_name for obj in client.list_objects(bucket, prefix=staging_prefix) if obj.is_dir]
+    today = datetime.now(timezone.utc).date()
+    days = [today - timedelta(days=day_offset) for day_offset in range(-1, CDC_LEDGER_LISTING_DAYS + 1)]
+    return [
+        f"{table_prefix}year={day.year}/month={day:%m}/day={day:%d}/"
+        for table_prefix in table_prefixes
+        for day in days
+    ]
+
+
+def get_table_name(object_key: str) -> str:
+    return object_key.split('/')[1] # Annahme: cdc_events/orders/...
+
+
+def group_files_by_table(files: list[str]) -> dict[str, list[str]]:
+    """Gruppiert s3://-Pfade nach Tabelle (Segment nach dem Staging-Präfix) und gibt die Objektschlüssel zurück."""
+    files_by_table: dict[str, list[str]] = {}
+    for file_path_s3 in files:
+        object_key = file_path_s3.split(f"s3://{MINIO_BUCKET}/", 1)[-1]
+        files_by_table.setdefault(get_table_name(object_key), []).append(object_key)
+    return files_by_table
+
+
+def _build_dedupe_filter(target_staging_table: str, object_keys: list[str]) -> str:
+    """
+    Filter gegen bereits geladene Events: pro Kafka-Partition wird der Offset-Bereich über alle Dateien
+    zusammengefasst. Der Bereich darf größer als die Dateien sein, da nur exakte (Partition, Offset)-Treffer
+    verworfen werden.
+    """
+    offset_bounds: dict[int, tuple[int, int]] = {}
+    for object_key in object_keys:
+        kafka_partition, first_offset, last_offset = get_kafka_offset_range(object_key)
+        lower, upper = offset_bounds.get(kafka_partition, (first_offset, last_offset))
+        offset_bounds[kafka_partition] = (min(lower, first_offset), max(upper, last_offset))
+
+    offset_conditions = " OR ".join(
+        f"(_kafka_partition = {kafka_partition} AND _kafka_offset BETWEEN {lower} AND {upper})"
+        for kafka_partition, (lower, upper) in sorted(offset_bounds.items())
+    )
+    return f"""
+            WHERE (_kafka_partition, _kafka_offset) NOT IN (
+                SELECT _kafka_partition, _kafka_offset
+                FROM default_raw_seeds.{target_staging_table}
+                WHERE {offset_conditions}
+            )"""
+
+
+def build_staging_insert_statements(
+    table_name: str,
+    target_staging_table: str,
+    object_keys: list[str],
+    access_key: str,
+    secret_key: str,
+    group_by_directory: bool = False,
+) -> list[str]:
+    """
+    Baut die INSERT ... SELECT FROM s3(...) Statements für eine Liste von Dateien derselben Tabelle.
+    Die Dateien werden über eine {a,b,...}-Alternative in der URL adressiert; ClickHouse listet dabei
+    das gemeinsame Verzeichnis. Mit group_by_directory gibt es ein Statement pro Verzeichnis (Modus
+    'ledger', in dem geladene Dateien liegen bleiben und ein tabellenweites Listing mit der Historie
+    wächst). Dateien mit Offset-Bereich im Namen und ältere Dateien ohne Offset-Bereich landen in
+    getrennten Statements, da nur erstere dedupliziert werden können. Ältere Dateien haben keine
+    Kafka-Spalten; sie werden ohne diese gelesen und mit Partition/Offset -1 geladen, damit sie nicht
+    als (0, 0) mit dem echten ersten Event der Partition 0 kollidieren.
+    """
+    table_schema_definition = PARQUET_SCHEMA_DEFINITIONS.get(table_name)
+    if not table_schema_definition:
+        raise ValueError(f"Keine Parquet-Schema-Definition für Tabelle '{table_name}' gefunden. Kann nicht laden.")
+    parquet_schema_definition = f"{table_schema_definition}, {KAFKA_SOURCE_SCHEMA}"
+
+    # Spaltenreihenfolge explizit, da _ts_ms und load_ts am Ende der SELECT-Liste stehen
+    parquet_columns = [column.split(' ', 1)[0] for column in parquet_schema_definition.split(', ')]
+    insert_columns = [column for column in parquet_columns if column != '_ts_ms'] + ['_ts_ms', 'load_ts']
+
+    offset_keys = [key for key in object_keys if get_kafka_offset_range(key)]
+    legacy_keys = [key for key in object_keys if not get_kafka_offset_range(key)]
+
+    key_groups = [(offset_keys, True), (legacy_keys, False)]
+    if group_by_directory:
+        key_groups = [
+            ([key for key in keys if os.path.dirname(key) == directory], deduplicate)
+            for keys, deduplicate in key_groups
+            for directory in dict.fromkeys(os.path.dirname(key) for key in keys)
+        ]
+
+    statements = []
+    for keys, deduplicate in key_groups:
+        if not keys:
+            continue
+        if deduplicate:
+            dedupe_filter = _build_dedupe_filter(target_staging_table, keys)
+            kafka_columns = ""
+            source_schema_definition = parquet_schema_definition
+        else:
+            dedupe_filter = ""
+            kafka_columns = "\n                -1 AS _kafka_partition,\n                -1 AS _kafka_offset,"
+            source_schema_definition = table_schema_definition
+        # Gemeinsames Verzeichnis vor die Alternative ziehen, damit ClickHouse nur dort listet
+        common_prefix = os.path.commonpath(keys) + '/' if len(keys) > 1 else ""
+        if len(keys) > 1:
+            s3_full_url = f"{S3_URL_BASE}{common_prefix}{{{','.join(key[len(common_prefix):] for key in keys)}}}"
+        else:
+            s3_full_url = f"{S3_URL_BASE}{keys[0]}"
+        statements.append(f"""
+            INSERT INTO default_raw_seeds.{target_staging_table} ({', '.join(insert_columns)})
+            SELECT 
+                * EXCEPT (_ts_ms), -- Wähle alle Spalten außer _ts_ms{kafka_columns}
+                fromUnixTimestamp64Milli(_ts_ms) AS _ts_ms,
+                now() as load_ts
+            FROM s3(
+                '{s3_full_url}',
+                '{access_key}',
+                '{secret_key}',
+                'Parquet',
+                '{source_schema_definition}'
+            ){dedupe_filter};
+            """)
+    return statements
+
+def create_clickhouse_client():
+    """
+    Erstellt einen ClickHouse Client. Clients dürfen nicht parallel genutzt werden; wer einen Client
+    erstellt, schließt ihn auch wieder (close()), sonst bleiben die Verbindungen offen.
+    """
+    return clickhouse_connect.get_client(
+        host=CLICKHOUSE_HOST,
+        port=CLICKHOUSE_PORT,
+        user=CLICKHOUSE_USER,
+        password=CLICKHOUSE_PASSWORD,
+        database="default" # Die Zieldatenbank in ClickHouse
+    )
+
+
+def load_staging_table(
+    table_name: str,
+    object_keys: list[str],
+    staging_table_prefix: str,
+    access_key: str,
+    secret_key: str,
+    client_pool: queue.Queue,
+) -> tuple[float, list[str], dict[str, str]]:
+    """
+    Lädt alle Dateien einer Tabelle (DDL, Migrationen, INSERTs) mit einem Client aus client_pool, der
+    danach zurückgegeben wird. Schlägt ein INSERT fehl, werden die übrigen trotzdem versucht.
+    Gibt Dauer in Sekunden, geladene Objekte und {Objekt: Fehler} zurück.
+    """
+    start_time = time.perf_counter()
+    target_staging_table = f"{staging_table_prefix}{table_name}"
+    loaded_keys = []
+    failed_keys = {}
+
+    client = client_pool.get()
+    try:
+        try:
+            client.command(get_staging_table_schema(table_name))
+            for migration_sql in get_staging_table_migrations(table_name):
+                client.command(migration_sql)
+        except Exception as e:
+            return time.perf_counter() - start_time, loaded_keys, dict.fromkeys(object_keys, str(e))
+
+        for chunk_start in range(0, len(object_keys), CLICKHOUSE_MAX_FILES_PER_INSERT):
+            chunk = object_keys[chunk_start:chunk_start + CLICKHOUSE_MAX_FILES_PER_INSERT]
+            try:
+                for insert_sql in build_staging_insert_statements(
+                    table_name, target_staging_table, chunk, access_key, secret_key,
+                    group_by_directory=CDC_ARCHIVE_MODE == "ledger",
+                ):
+                    client.command(insert_sql)
+                loaded_keys.extend(chunk)
+            except Exception as e:
+                # Ein teilweise eingefügter Chunk wird beim nächsten Versuch über den Offset-Filter bereinigt
+                failed_keys.update(dict.fromkeys(chunk, str(e)))
+    finally:
+        client_pool.put(client)
+    return time.perf_counter() - start_time, loaded_keys, failed_keys
+
 # --- Tasks ---
 @task(retries=1, retry_delay_seconds=5)
 def find_new_files_in_minio( 
     bucket: str,
     staging_prefix: str,
     minio_endpoint: str,
-) -> list[str]:
+) -> dict[str, str]:
+    """
+    Listet die Dateien unter staging_prefix (im Modus 'ledger' nur die jüngsten Datumspartitionen, siehe
+    get_listing_prefixes) und gibt sie als {s3://-Pfad: ETag} zurück. Die ETags aus dem Listing ersparen
+    dem Laden ein stat_object pro Datei.
+    """
     logger = get_run_logger()
     logger.info(f"--- Suche neue Dateien ---")
     try:
@@ -59,116 +402,255 @@ def find_new_files_in_minio(
         logger.error(f"Fehler beim Laden des Blocks/Init Client: {e}", exc_info=True)
         raise
 
-    new_files = []
+    new_files = {}
     found_object_count = 0
+    skipped_object_count = 0
     try:
-        logger.info(f"Rufe client.list_objects(bucket='{bucket}', prefix='{staging_prefix}', recursive=True) auf...")
-        objects = client.list_objects(bucket, prefix=staging_prefix, recursive=True) 
-        for obj in objects:
-            found_object_count += 1
-            if not obj.is_dir and (obj.object_name.endswith('.parquet') or obj.object_name.endswith('.jsonl')):
-                full_path = f"s3://{bucket}/{obj.object_name}"
-                new_files.append(full_path)
-            else:
-                logger.info(f"    -> Objekt übersprungen (Verzeichnis oder falsche Endung).")
+        listing_prefixes = get_listing_prefixes(client, bucket, staging_prefix)
+        logger.info(f"Rufe client.list_objects(bucket='{bucket}', recursive=True) für {len(listing_prefixes)} Präfixe unter '{staging_prefix}' auf...")
+        for listing_prefix in listing_prefixes:
+            for obj in client.list_objects(bucket, prefix=listing_prefix, recursive=True):
+                found_object_count += 1
+                if not obj.is_dir and (obj.object_name.endswith('.parquet') or obj.object_name.endswith('.jsonl')):
+                    full_path = f"s3://{bucket}/{obj.object_name}"
+                    new_files[full_path] = obj.etag.strip('"')
+                else:
+                    skipped_object_count += 1
+                    logger.debug(f"Objekt übersprungen (Verzeichnis oder falsche Endung): {obj.object_name}")
     except S3Error as e:
         logger.error(f"S3 Fehler beim Auflisten der Objekte: {e}")
         raise
     except Exception as e_list:
          logger.error(f"Anderer Fehler beim Auflisten der Objekte: {e_list}", exc_info=True)
          raise
+    logger.info(f"{found_object_count} Objekte gelistet, {len(new_files)} Dateien gefunden, {skipped_object_count} übersprungen.")
     return new_files
 
+@task(retries=1, retry_delay_seconds=5)
+def find_new_files_from_manifests(
+    bucket: str,
+    manifest_prefix: str,
+    checkpoint_key: str,
+    minio_endpoint: str,
+) -> tuple[list[str] | None, dict | None]:
+    """
+    Liest nur die Manifeste ab (Watermark - Lookback), die noch nicht verarbeitet wurden, statt den ganzen
+    Staging-Bereich zu listen. Gibt die Dateien als s3://-Pfade und den neuen Checkpoint-Zustand zurück.
+    Ohne Checkpoint (erster Lauf) oder wenn ein Abgleich fällig ist, ist die Dateiliste None; der Flow
+    gleicht dann über das vollständige Listing ab.
+    """
+    logger = get_run_logger()
+    client = create_minio_client(minio_endpoint)
+    state = read_manifest_checkpoint(client, bucket, checkpoint_key)
+    if state is None or "watermark" not in state:
+        logger.info(f"Kein Manifest-Checkpoint unter '{checkpoint_key}' gefunden.")
+        return None, None
+    if is_reconciliation_due(state):
+        logger.info(f"Letzter Abgleich '{state.get('last_reconciliation')}' liegt über {CDC_RECONCILE_INTERVAL_MINUTES} Minuten zurück.")
+        return None, None
+
+    watermark = datetime.strptime(state["watermark"], MANIFEST_TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+    processed = set(state.get("processed", []))
+    window_start = watermark - timedelta(minutes=CDC_MANIFEST_LOOKBACK_MINUTES)
+    manifest_names = [name for name in list_manifests(client, bucket, manifest_prefix, window_start) if name not in processed]
+
+    new_files = {}
+    for manifest_name in manifest_names:
+        response = client.get_object(bucket, manifest_name)
+        try:
+            manifest = json.loads(response.read())
+        finally:
+            response.close()
+            response.release_conn()
+        for entry in manifest.get("files", []):
+            # Dieselbe Datei kann nach einem Consumer-Neustart in mehreren Manifesten stehen
+            new_files.setdefault(entry["object_key"], entry)
+        watermark = max(watermark, get_manifest_timestamp(manifest_name))
+
+    row_count = sum(entry.get("row_count", 0) for entry in new_files.values())
+    logger.info(f"{len(manifest_names)} neue Manifeste seit {window_start.isoformat()}: {len(new_files)} Dateien mit {row_count} Zeilen.")
+    new_state = build_manifest_state(watermark, processed | set(manifest_names), state.get("last_reconciliation"))
+    return [f"s3://{bucket}/{object_key}" for object_key in new_files], new_state
+
+@task(retries=1, retry_delay_seconds=5)
+def start_manifest_reconciliation(
+    bucket: str,
+    manifest_prefix: str,
+    minio_endpoint: str,
+) -> dict:
+    """
+    Erstellt den Checkpoint-Zustand für einen Abgleich. Wird vor dem vollständigen Listing aufgerufen:
+    alle Dateien der jetzt sichtbaren Manifeste liegen dann schon im Listing, sie gelten als verarbeitet.
+    """
+    client = create_minio_client(minio_endpoint)
+    now = datetime.now(timezone.utc)
+    visible_manifests = list_manifests(client, bucket, manifest_prefix, now - timedelta(minutes=CDC_MANIFEST_LOOKBACK_MINUTES))
+    watermark = max([now] + [get_manifest_timestamp(name) for name in visible_manifests])
+    return build_manifest_state(watermark, set(visible_manifests), now.isoformat())
+
+@task(retries=1, retry_delay_seconds=5)
+def save_manifest_checkpoint(
+    manifest_state: dict | None,
+    bucket: str,
+    checkpoint_key: str,
+    minio_endpoint: str,
+):
+    """Speichert den Manifest-Zustand als Checkpoint für den nächsten Lauf."""
+    logger = get_run_logger()
+    if not manifest_state:
+        return
+    client = create_minio_client(minio_endpoint)
+    body = json.dumps({**manifest_state, "updated_at": datetime.now(timezone.utc).isoformat()}).encode("utf-8")
+    client.put_object(bucket, checkpoint_key, data=BytesIO(body), length=len(body), content_type="application/json")
+    logger.info(f"Manifest-Checkpoint auf '{manifest_state['watermark']}' gesetzt ({len(manifest_state['processed'])} Manifeste im Lookback-Fenster).")
+
+@task()
+def compact_load_ledger_entries(archive_mode: str = CDC_ARCHIVE_MODE):
+    """
+    Entfernt abgeschlossene Einträge, die älter als CDC_LEDGER_RETENTION_DAYS sind: archivierte und nicht
+    mehr vorhandene Dateien, im Modus 'ledger' auch geladene (ihre Datumspartition liegt dann außerhalb
+    des Listing-Fensters). Läuft nur mit dem Abgleich, damit nicht jeder Lauf eine Mutation anlegt.
+    Fehler brechen den Flow nicht ab, der nächste Abgleich versucht es erneut.
+    """
+    logger = get_run_logger()
+    terminal_statuses = [STATUS_ARCHIVED, STATUS_MISSING]
+    if archive_mode == "ledger":
+        terminal_statuses.append(STATUS_LOADED)
+    try:
+        client = create_clickhouse_client()
+        try:
+            compact_load_ledger(client, terminal_statuses, CDC_LEDGER_RETENTION_DAYS)
+        finally:
+            client.close()
+        logger.info(f"Ladeprotokoll: Einträge mit Status {terminal_statuses} älter als {CDC_LEDGER_RETENTION_DAYS} Tage werden entfernt.")
+    except Exception as e:
+        logger.error(f"Fehler beim Bereinigen des Ladeprotokolls: {e}", exc_info=True)
+
 @task()
 def load_files_to_clickhouse_staging(
     files_to_process: list[str],
     staging_table_prefix: str,
-):
+    known_etags: dict[str, str] | None = None,
+) -> tuple[list[str], int, int]:
     """
     Lädt Parquet-Dateien aus MinIO direkt in Staging-Tabellen in ClickHouse.
+    Die Dateien werden nach Tabelle gruppiert und pro Tabelle mit einem INSERT über die ganze
+    Dateiliste geladen (höchstens CLICKHOUSE_MAX_FILES_PER_INSERT Dateien pro INSERT); DDL und
+    Migrationen laufen einmal pro Tabelle und Lauf. Bis zu CLICKHOUSE_LOAD_PARALLELISM Tabellen
+    werden parallel geladen, jeweils mit eigenem Client.
+    Zeilen, deren Kafka-Partition/-Offset bereits geladen wurde (z.B. erneut geschriebene Dateien
+    nach einem Consumer-Neustart), werden anhand der Offset-Bereiche in den Dateinamen übersprungen.
+    Jeder Ladeversuch wird pro Objekt und ETag im Ladeprotokoll (cdc_load_ledger) vermerkt: bereits
+    geladene Dateien werden übersprungen, zuletzt fehlgeschlagene zusätzlich erneut versucht.
+    known_etags ({s3://-Pfad: ETag}, z.B. aus dem Listing) erspart für diese Dateien das stat_object.
+    Gibt die s3://-Pfade aller nachweislich geladenen Dateien (nur diese werden archiviert; im Modus
+    'move' inklusive früher geladener, noch nicht archivierter Dateien) sowie die Anzahl der in diesem
+    Lauf geladenen und fehlgeschlagenen Dateien zurück.
     """
     logger = get_run_logger()
-    if not files_to_process:
-        logger.info("Keine neuen Dateien zum Laden in ClickHouse.")
-        return False
-
     try:
-        # Verbindung zum ClickHouse-Server herstellen
-        client = clickhouse_connect.get_client(
-            host=CLICKHOUSE_HOST,
-            port=CLICKHOUSE_PORT,
-            user=CLICKHOUSE_USER,
-            password=CLICKHOUSE_PASSWORD,
-            database="default" # Die Zieldatenbank in ClickHouse
-        )
+        # Verbindung zum ClickHouse-Server prüfen, bevor die Tabellen verteilt werden
+        client = create_clickhouse_client()
         logger.info(f"Erfolgreich mit ClickHouse auf {CLICKHOUSE_HOST}:{CLICKHOUSE_PORT} verbunden.")
     except Exception as e:
         logger.error(f"Fehler bei der Verbindung zu ClickHouse: {e}")
         raise
 
-    # S3-Credentials für die ClickHouse-Funktion holen
-    minio_creds = MinIOCredentials.load(MINIO_BLOCK_NAME)
-    access_key = minio_creds.minio_root_user
-    secret_key = minio_creds.minio_root_password.get_secret_value()
-
-    # S3-URL-Struktur definieren (ohne http://)
-    s3_url_base = f"http://{MINIO_SERVICE_NAME}:{MINIO_PORT}/{MINIO_BUCKET}/"
-
-    for file_path_s3 in files_to_process:
+    try:
+        ensure_load_ledger(client)
+        # S3-Credentials für die ClickHouse-Funktion holen
+        minio_creds = MinIOCredentials.load(MINIO_BLOCK_NAME)
+        access_key = minio_creds.minio_root_user
+        secret_key = minio_creds.minio_root_password.get_secret_value()
+
+        # Kandidaten: neue Dateien und zuletzt fehlgeschlagene Dateien früherer Läufe
+        object_keys = list(dict.fromkeys(file_path_s3.split(f"s3://{MINIO_BUCKET}/", 1)[-1] for file_path_s3 in files_to_process))
+        # Geladen, aber (z.B. nach einem Abbruch) nicht archiviert: nur archivieren, nicht erneut laden
+        unarchived_keys = fetch_unarchived_object_keys(client, CDC_STAGING_PREFIX) if CDC_ARCHIVE_MODE == "move" else []
+        if unarchived_keys:
+            logger.info(f"{len(unarchived_keys)} bereits geladene Dateien liegen noch im Staging-Bereich und werden archiviert.")
+        failed_before = fetch_failed_object_keys(client)
+        known_keys = set(object_keys)
+        retry_keys = [object_key for object_key in failed_before if object_key not in known_keys]
+        if retry_keys:
+            logger.info(f"{len(retry_keys)} zuvor fehlgeschlagene Dateien werden erneut versucht.")
+        object_keys += retry_keys
+
+        known_etags = {file_path_s3.split(f"s3://{MINIO_BUCKET}/", 1)[-1]: etag for file_path_s3, etag in (known_etags or {}).items()}
+        etags = {object_key: known_etags[object_key] for object_key in object_keys if object_key in known_etags}
+        etags.update(stat_object_etags(create_minio_client(MINIO_RAW_ENDPOINT), MINIO_BUCKET, [key for key in object_keys if key not in etags]))
+        missing_keys = [object_key for object_key in object_keys if object_key not in etags]
+        if missing_keys:
+            logger.warning(f"{len(missing_keys)} Dateien existieren nicht mehr in MinIO und werden übersprungen.")
+            record_load_results(client, [
+                (object_key, failed_before[object_key], get_table_name(object_key), STATUS_MISSING, 0, "")
+                for object_key in missing_keys if object_key in failed_before
+            ])
+
+        ledger_entries = fetch_ledger_entries(client, list(etags))
+        already_loaded = {object_key for object_key, etag in etags.items() if ledger_entries.get((object_key, etag), ("", 0))[0] == STATUS_LOADED}
+        if already_loaded:
+            logger.info(f"{len(already_loaded)} Dateien sind laut Ladeprotokoll bereits geladen und werden nur archiviert.")
+        files_by_table = group_files_by_table([
+            f"s3://{MINIO_BUCKET}/{object_key}" for object_key in etags if object_key not in already_loaded
+        ])
+
+        def ledger_row(object_key: str, table_name: str, status: str, error: str = "") -> tuple:
+            attempts = ledger_entries.get((object_key, etags[object_key]), ("", 0))[1] + 1
+            return (object_key, etags[object_key], table_name, status, attempts, error)
+
+        loaded_keys = list(dict.fromkeys([*unarchived_keys, *already_loaded]))
+        if not files_by_table:
+            logger.info("Keine neuen Dateien zum Laden in ClickHouse.")
+            return [f"s3://{MINIO_BUCKET}/{object_key}" for object_key in loaded_keys], 0, 0
+
+        max_workers = min(CLICKHOUSE_LOAD_PARALLELISM, len(files_by_table))
+        file_count = sum(len(keys) for keys in files_by_table.values())
+        logger.info(f"Lade {file_count} Dateien in {len(files_by_table)} Tabellen ({max_workers} parallel)...")
+
+        load_start_time = time.perf_counter()
+        loaded_count = 0
+        failed_count = 0
+        # Ein Client pro Worker, nach dem Ende des Pools geschlossen
+        worker_clients = queue.Queue()
         try:
-            # Extrahiere Tabellenname aus dem Dateipfad, z.B. "orders"
-            object_key = file_path_s3.split(f"s3://{MINIO_BUCKET}/", 1)[-1]
-            table_name_from_path = object_key.split('/')[1] # Annahme: /cdc_events/orders/...
-            target_staging_table = f"{staging_table_prefix}{table_name_from_path}"
-            
-            # S3-URL für die ClickHouse-Funktion
-            s3_full_url = f"{s3_url_base}{object_key}"
-
-            create_table_ddl = get_staging_table_schema(table_name_from_path)
-            client.command(create_table_ddl)
-
-            parquet_schema_definition = ""
-            if table_name_from_path == "aisles":
-                parquet_schema_definition = "aisle_id Int64, aisle String, _op String, _ts_ms Int64"
-            elif table_name_from_path == "products":
-                parquet_schema_definition = "product_id Int64, product_name String, aisle_id Nullable(Int64), department_id Nullable(Int64), _op String, _ts_ms Int64"
-            elif table_name_from_path == "departments":
-                parquet_schema_definition = "department_id Int64, department String, _op String, _ts_ms Int64"
-            elif table_name_from_path == "users":
-                parquet_schema_definition = "user_id Int64, _op String, _ts_ms Int64"
-            elif table_name_from_path == "orders":
-                parquet_schema_definition = "order_id Int64, user_id Int64, order_date Int64, tip_given Nullable(Boolean), _op String, _ts_ms Int64"
-            elif table_name_from_path == "order_products":
-                parquet_schema_definition = "order_id Int64, product_id Int64, add_to_cart_order Int64, _op String, _ts_ms Int64"
-            
-            if not parquet_schema_definition:
-                raise ValueError(f"Keine Parquet-Schema-Definition für Tabelle '{table_name_from_path}' gefunden. Kann nicht laden.")
-
-
-            insert_sql = f"""
-            INSERT INTO default_raw_seeds.{target_staging_table}
-            SELECT 
-                * EXCEPT (_ts_ms), -- Wähle alle Spalten außer _ts_ms
-                fromUnixTimestamp64Milli(_ts_ms) AS _ts_ms,
-                now() as load_ts
-            FROM s3(
-                '{s3_full_url}',
-                '{access_key}',
-                '{secret_key}',
-                'Parquet',
-                '{parquet_schema_definition}'
-            );
-            """
-            client.command(insert_sql)
-            logger.info(f"Erfolgreich Daten in {target_staging_table} eingefügt.")
-
-        except Exception as e:
-            logger.error(f"Fehler beim Laden der Datei {file_path_s3} nach ClickHouse: {e}", exc_info=True)
-            # In einem echten Szenario würde man hier eine bessere Fehlerbehandlung implementieren
-            continue
-
-    logger.info("Ladevorgang nach ClickHouse abgeschlossen.")
-    return True
+            for _ in range(max_workers):
+                worker_clients.put(create_clickhouse_client())
+            # Der Prefect-Logger ist nur im Task-Thread verfügbar, daher wird erst nach Abschluss jeder Tabelle geloggt
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="clickhouse-load") as executor:
+                futures = {
+                    executor.submit(load_staging_table, table_name, table_keys, staging_table_prefix, access_key, secret_key, worker_clients): table_name
+                    for table_name, table_keys in files_by_table.items()
+                }
+                for future in as_completed(futures):
+                    table_name = futures[future]
+                    target_staging_table = f"{staging_table_prefix}{table_name}"
+                    try:
+                        duration, table_loaded_keys, table_failed_keys = future.result()
+                    except Exception as e:
+                        duration, table_loaded_keys, table_failed_keys = 0.0, [], dict.fromkeys(files_by_table[table_name], str(e))
+
+                    record_load_results(client, [
+                        ledger_row(object_key, table_name, STATUS_LOADED) for object_key in table_loaded_keys
+                    ] + [
+                        ledger_row(object_key, table_name, STATUS_FAILED, error) for object_key, error in table_failed_keys.items()
+                    ])
+                    loaded_keys.extend(table_loaded_keys)
+                    loaded_count += len(table_loaded_keys)
+                    failed_count += len(table_failed_keys)
+
+                    if table_failed_keys:
+                        logger.error(f"Fehler beim Laden von {len(table_failed_keys)} Dateien für {target_staging_table} nach ClickHouse: {next(iter(table_failed_keys.values()))}")
+                    if table_loaded_keys:
+                        logger.info(f"Erfolgreich {len(table_loaded_keys)} Dateien in {target_staging_table} eingefügt. Dauer: {duration:.2f}s")
+        finally:
+            while not worker_clients.empty():
+                worker_clients.get_nowait().close()
+
+        logger.info(f"Ladevorgang nach ClickHouse abgeschlossen: {loaded_count} Dateien geladen, {failed_count} fehlgeschlagen (nächster Lauf versucht sie erneut). Dauer: {time.perf_counter() - load_start_time:.2f}s")
+        return [f"s3://{MINIO_BUCKET}/{object_key}" for object_key in loaded_keys], loaded_count, failed_count
+    finally:
+        client.close()
 
 @task()
 def load_files_to_duckdb_staging( 
@@ -280,81 +762,156 @@ def archive_processed_files(
     staging_prefix: str,
     archive_prefix: str,
     minio_endpoint: str,
+    archive_mode: str = CDC_ARCHIVE_MODE,
 ):
+    """
+    Verschiebt die geladenen Dateien nach archive_prefix: serverseitige Kopien parallel
+    (MINIO_MAX_WORKERS), danach Löschen der erfolgreich kopierten Quellen in Batches über
+    remove_objects. Verschobene Dateien werden im Ladeprotokoll als archiviert vermerkt, nicht
+    verschobene findet der nächste Lauf dort wieder. Mit archive_mode 'ledger' bleiben die Dateien
+    liegen; sie sind im Ladeprotokoll als geladen vermerkt und werden von keinem weiteren Lauf erneut geladen.
+    """
     logger = get_run_logger()
     if not processed_files:
         logger.info("Keine Dateien zum Archivieren.")
         return
 
+    if archive_mode == "ledger":
+        logger.info(f"Archivierungsmodus 'ledger': {len(processed_files)} Dateien bleiben liegen und gelten über das Ladeprotokoll als verbraucht.")
+        return
+
     if not archive_prefix.endswith('/'):
         archive_prefix += '/'
 
     try:
-        minio_creds = MinIOCredentials.load(MINIO_BLOCK_NAME)
-        client = Minio(
-            minio_endpoint,
-            access_key=minio_creds.minio_root_user,
-            secret_key=minio_creds.minio_root_password.get_secret_value(),
-            secure=MINIO_USE_SSL,
-        ) 
+        client = create_minio_client(minio_endpoint)
     except Exception as e:
         logger.error(f"Fehler beim Laden des Blocks '{MINIO_BLOCK_NAME}' oder Initialisieren des MinIO Clients für Archivierung: {e}", exc_info=True)
         raise
 
+    def copy_to_archive(object_name: str) -> None:
+        relative_path = object_name
+        if object_name.startswith(staging_prefix):
+            relative_path = object_name[len(staging_prefix):]
+        client.copy_object(
+            bucket_name=bucket,
+            object_name=archive_prefix + relative_path,
+            source=CopySource(bucket, object_name)
+        )
+
     logger.info(f"Archiviere {len(processed_files)} Dateien...")
-    archived_count = 0
+    archive_start_time = time.perf_counter()
+    object_names = [file_path_s3.replace(f"s3://{bucket}/", "") for file_path_s3 in processed_files]
+    copied_objects = []
+    # Quelle existiert nicht mehr (z.B. von einem früheren Lauf bereits verschoben)
+    vanished_objects = []
     error_count = 0
-    for file_path_s3 in processed_files:
+    with ThreadPoolExecutor(max_workers=MINIO_MAX_WORKERS, thread_name_prefix="minio-archive") as executor:
+        futures = {executor.submit(copy_to_archive, object_name): object_name for object_name in object_names}
+        for future in as_completed(futures):
+            object_name = futures[future]
+            try:
+                future.result()
+                copied_objects.append(object_name)
+            except S3Error as e:
+                if e.code == "NoSuchKey":
+                    vanished_objects.append(object_name)
+                    continue
+                logger.error(f"S3 Fehler beim Archivieren von {object_name}: {e}")
+                error_count += 1
+            except Exception as e:
+                 logger.error(f"Unerwarteter Fehler beim Archivieren von {object_name}: {e}", exc_info=False)
+                 error_count += 1
+
+    # Quellen erst nach erfolgreicher Kopie entfernen; remove_objects liefert nur die Fehler (lazy)
+    removed_objects = list(vanished_objects)
+    for batch_start in range(0, len(copied_objects), MINIO_DELETE_BATCH_SIZE):
+        batch = copied_objects[batch_start:batch_start + MINIO_DELETE_BATCH_SIZE]
         try:
-            object_name = file_path_s3.replace(f"s3://{bucket}/", "")
-            relative_path = object_name
-            if object_name.startswith(staging_prefix):
-                 relative_path = object_name[len(staging_prefix):]
-            archive_object_name = archive_prefix + relative_path
-            source_to_copy = CopySource(bucket, object_name)
-            client.copy_object(
-                bucket_name=bucket,
-                object_name=archive_object_name,
-                source=source_to_copy
-            )
-            client.remove_object(bucket, object_name)
-            archived_count += 1
-        except S3Error as e:
-            logger.error(f"S3 Fehler beim Archivieren von {object_name}: {e}")
-            error_count += 1
+            delete_errors = list(client.remove_objects(bucket, [DeleteObject(object_name) for object_name in batch]))
         except Exception as e:
-             logger.error(f"Unerwarteter Fehler beim Archivieren von {object_name}: {e}", exc_info=False)
-             error_count += 1
-    logger.info(f"Archivierung abgeschlossen. {archived_count} Dateien verschoben, {error_count} Fehler.")
+            logger.error(f"Fehler beim Löschen von {len(batch)} archivierten Dateien: {e}", exc_info=True)
+            error_count += len(batch)
+            continue
+        for delete_error in delete_errors:
+            logger.error(f"S3 Fehler beim Löschen von {delete_error.name}: {delete_error.message}")
+        error_count += len(delete_errors)
+        failed_deletes = {delete_error.name for delete_error in delete_errors}
+        removed_objects.extend(object_name for object_name in batch if object_name not in failed_deletes)
+
+    try:
+        client = create_clickhouse_client()
+        try:
+            mark_archived(client, {object_name: get_table_name(object_name) for object_name in removed_objects})
+        finally:
+            client.close()
+    except Exception as e:
+        # Nicht vermerkte Dateien werden vom nächsten Lauf erneut (ohne Quelle) archiviert und dann vermerkt
+        logger.error(f"Fehler beim Vermerken von {len(removed_objects)} archivierten Dateien im Ladeprotokoll: {e}", exc_info=True)
+    logger.info(f"Archivierung abgeschlossen. {len(removed_objects) - len(vanished_objects)} Dateien verschoben, {len(vanished_objects)} bereits entfernt, {error_count} Fehler. Dauer: {time.perf_counter() - archive_start_time:.2f}s")
 
 # --- Der Haupt-Flow ---
 @flow(name="CDC MinIO to DWH (Synchronous)", log_prints=True) 
-def cdc_minio_to_duckdb_flow():
+def cdc_minio_to_duckdb_flow(discovery_mode: str = CDC_DISCOVERY_MODE):
+    """
+    discovery_mode 'manifest' liest nur die seit dem letzten Lauf geschriebenen Manifeste,
+    'listing' listet den ganzen Staging-Bereich (Abgleich, z.B. für Dateien ohne Manifest).
+    """
     logger = get_run_logger()
     logger.info("Starte CDC MinIO zu DuckDB Flow (Synchronous)...")
     final_message = "Flow initialisiert."
 
     try:
-        new_files_list = find_new_files_in_minio(
-            bucket=MINIO_BUCKET,
-            staging_prefix=CDC_STAGING_PREFIX,
-            minio_endpoint=MINIO_RAW_ENDPOINT,
-        )
-
-        if not new_files_list:
-            logger.info("Keine neuen Dateien gefunden, Flow wird regulär beendet.")
-            return "Keine neuen Dateien."
+        new_files_list = None
+        new_file_etags = None
+        manifest_state = None
+        if discovery_mode == "manifest":
+            new_files_list, manifest_state = find_new_files_from_manifests(
+                bucket=MINIO_BUCKET,
+                manifest_prefix=CDC_MANIFEST_PREFIX,
+                checkpoint_key=CDC_MANIFEST_CHECKPOINT_KEY,
+                minio_endpoint=MINIO_RAW_ENDPOINT,
+            )
+        if new_files_list is None:
+            logger.info("Suche neue Dateien über vollständiges Listing (Abgleich).")
+            manifest_state = start_manifest_reconciliation(
+                bucket=MINIO_BUCKET,
+                manifest_prefix=CDC_MANIFEST_PREFIX,
+                minio_endpoint=MINIO_RAW_ENDPOINT,
+            )
+            new_file_etags = find_new_files_in_minio(
+                bucket=MINIO_BUCKET,
+                staging_prefix=CDC_STAGING_PREFIX,
+                minio_endpoint=MINIO_RAW_ENDPOINT,
+            )
+            new_files_list = list(new_file_etags)
 
-        logger.info(f"Verarbeite {len(new_files_list)} neue Dateien.")
+        logger.info(f"{len(new_files_list)} neue Dateien gefunden.")
 
-        load_staging_success = load_files_to_clickhouse_staging(
+        # Auch ohne neue Dateien: zuvor fehlgeschlagene Dateien erneut versuchen, geladene archivieren
+        files_to_archive, loaded_count, failed_count = load_files_to_clickhouse_staging(
             files_to_process=new_files_list,
             staging_table_prefix=STAGING_TABLE_PREFIX,
+            known_etags=new_file_etags,
         )
-        if not load_staging_success: 
+        if new_file_etags is not None:
+            compact_load_ledger_entries()
+        if failed_count and not loaded_count:
             logger.error("Laden der Staging-Daten fehlgeschlagen. Breche Flow ab.")
             return "Laden der Staging-Daten fehlgeschlagen."
-        logger.info("Daten erfolgreich in DuckDB Staging geladen.")
+        if not loaded_count:
+            # Nichts zu laden (keine neuen Dateien, alle schon geladen oder nicht mehr vorhanden): dbt überspringen
+            save_manifest_checkpoint(manifest_state, MINIO_BUCKET, CDC_MANIFEST_CHECKPOINT_KEY, MINIO_RAW_ENDPOINT)
+            archive_processed_files(
+                processed_files=files_to_archive,
+                bucket=MINIO_BUCKET,
+                staging_prefix=CDC_STAGING_PREFIX,
+                archive_prefix=CDC_ARCHIVE_PREFIX,
+                minio_endpoint=MINIO_RAW_ENDPOINT,
+            )
+            logger.info("Keine neuen Daten geladen, Flow wird regulär beendet.")
+            return "Keine neuen Dateien."
+        logger.info(f"{loaded_count} Dateien erfolgreich in ClickHouse Staging geladen.")
 
         logger.info("Running DBT debug...")
         debug_status = run_dbt_command_runner( 
@@ -375,10 +932,14 @@ def cdc_minio_to_duckdb_flow():
         )
         logger.info("DBT Staging Models abgeschlossen (Erfolg wird durch Task bestimmt).")
 
+        # Checkpoint vor dem Archivieren: nicht archivierte Dateien findet der Abgleich, doppelte Zeilen verhindert der Offset-Filter
+        save_manifest_checkpoint(manifest_state, MINIO_BUCKET, CDC_MANIFEST_CHECKPOINT_KEY, MINIO_RAW_ENDPOINT)
+
 
         logger.info("Alle DBT Schritte erfolgreich. Archiviere Dateien...")
+        # Nur nachweislich geladene Dateien archivieren; fehlgeschlagene bleiben für den nächsten Versuch liegen
         archive_processed_files( 
-             processed_files=new_files_list,
+             processed_files=files_to_archive,
              bucket=MINIO_BUCKET,
              staging_prefix=CDC_STAGING_PREFIX,
              archive_prefix=CDC_ARCHIVE_PREFIX,
@@ -223,6 +223,10 @@ async def main():
                     "path": str(APP_BASE_PATH),
                     "tags": DWH_TAGS,
                     "description": DWH_DESCRIPTION,
+                    # Zusätzlich zu den Anforderungen des Consumers: regelmäßige Läufe für den Listing-Abgleich
+                    "schedules": [{"schedule": {"interval": INTERVAL_SECONDS}, "active": True}],
+                    # Geplante und vom Consumer angeforderte Runs dürfen nicht parallel dieselben Dateien laden
+                    "concurrency_limit": 1,
                 },
                 headers={"Content-Type": "application/json"},
                 timeout=30 
@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta, timezone
+
+from utils.schema import LOAD_LEDGER_TABLE, get_load_ledger_schema
+
+# Status eines Objekts im Ladeprotokoll
+STATUS_LOADED = "loaded"
+STATUS_FAILED = "failed"
+# Fehlgeschlagenes Objekt existiert nicht mehr (z.B. manuell entfernt), wird nicht erneut versucht
+STATUS_MISSING = "missing"
+# Geladenes Objekt wurde aus dem Staging-Bereich ins Archiv verschoben
+STATUS_ARCHIVED = "archived"
+
+LEDGER_COLUMNS = ["object_key", "etag", "table_name", "status", "attempts", "error"]
+# Höchstzahl Objektschlüssel pro Abfrage (die Parameter werden in der URL übertragen)
+LEDGER_QUERY_BATCH_SIZE = 1000
+
+
+def ensure_load_ledger(client) -> None:
+    client.command(get_load_ledger_schema())
+
+
+def compact_load_ledger(client, terminal_statuses: list[str], retention_days: int) -> None:
+    """
+    Entfernt alle Einträge der Objekte, deren letzter Status abschließend ist (terminal_statuses) und
+    deren letzte Änderung länger als retention_days zurückliegt. Gelöscht wird immer die ganze Historie
+    eines (object_key, etag), damit kein älterer Status wieder zum letzten wird. Die Mutation läuft
+    asynchron im ClickHouse-Server.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=retention_days)).strftime("%Y-%m-%d %H:%M:%S")
+    statuses = ", ".join(f"'{status}'" for status in terminal_statuses)
+    client.command(
+        f"""
+        ALTER TABLE {LOAD_LEDGER_TABLE} DELETE
+        WHERE (object_key, etag) IN (
+            SELECT object_key, etag
+            FROM {LOAD_LEDGER_TABLE}
+            GROUP BY object_key, etag
+            HAVING argMax(status, updated_at) IN ({statuses})
+                AND max(updated_at) < toDateTime64('{cutoff}', 3, 'UTC')
+        )
+        """
+    )
+
+
+def fetch_ledger_entries(client, object_keys: list[str]) -> dict[tuple[str, str], tuple[str, int]]:
+    """Gibt für die Objekte {(object_key, etag): (status, attempts)} des jeweils letzten Eintrags zurück."""
+    entries = {}
+    for batch_start in range(0, len(object_keys), LEDGER_QUERY_BATCH_SIZE):
+        result = client.query(
+            f"""
+            SELECT object_key, etag, argMax(status, updated_at), argMax(attempts, updated_at)
+            FROM {LOAD_LEDGER_TABLE}
+            WHERE object_key IN {{object_keys:Array(String)}}
+            GROUP BY object_key, etag
+            """,
+            parameters={"object_keys": object_keys[batch_start:batch_start + LEDGER_QUERY_BATCH_SIZE]},
+        )
+        entries.update({(object_key, etag): (status, attempts) for object_key, etag, status, attempts in result.result_rows})
+    return entries
+
+
+def fetch_failed_object_keys(client) -> dict[str, str]:
+    """Objekte, deren letzter Ladeversuch fehlgeschlagen ist, als {object_key: etag} (für den erneuten Versuch)."""
+    result = client.query(
+        f"""
+        SELECT object_key, etag
+        FROM {LOAD_LEDGER_TABLE}
+        GROUP BY object_key, etag
+        HAVING argMax(status, updated_at) = '{STATUS_FAILED}'
+        """
+    )
+    return {object_key: etag for object_key, etag in result.result_rows}
+
+
+def fetch_unarchived_object_keys(client, prefix: str) -> list[str]:
+    """
+    Objekte unter prefix, deren letzter Eintrag 'loaded' ist, die also geladen, aber noch nicht
+    archiviert wurden (z.B. nach einem Abbruch zwischen Laden und Archivieren).
+    """
+    result = client.query(
+        f"""
+        SELECT object_key
+        FROM {LOAD_LEDGER_TABLE}
+        WHERE startsWith(object_key, {{prefix:String}})
+        GROUP BY object_key, etag
+        HAVING argMax(status, updated_at) = '{STATUS_LOADED}'
+        """,
+        parameters={"prefix": prefix},
+    )
+    return list(dict.fromkeys(object_key for (object_key,) in result.result_rows))
+
+
+def mark_archived(client, table_names: dict[str, str]) -> None:
+    """Vermerkt die geladenen Versionen der Objekte ({object_key: table_name}) als archiviert."""
+    entries = fetch_ledger_entries(client, list(table_names))
+    record_load_results(client, [
+        (object_key, etag, table_names[object_key], STATUS_ARCHIVED, attempts, "")
+        for (object_key, etag), (status, attempts) in entries.items() if status == STATUS_LOADED
+    ])
+
+
+def record_load_results(client, rows: list[tuple[str, str, str, str, int, str]]) -> None:
+    """Schreibt Einträge (object_key, etag, table_name, status, attempts, error) in das Ladeprotokoll."""
+    if rows:
+        client.insert(LOAD_LEDGER_TABLE, rows, column_names=LEDGER_COLUMNS)
@@ -1,10 +1,17 @@
+# Herkunft jedes CDC-Events (Kafka-Partition und -Offset), -1 für Seed-Daten
+KAFKA_SOURCE_COLUMNS = [
+    "_kafka_partition Int64 DEFAULT -1",
+    "_kafka_offset Int64 DEFAULT -1",
+]
+
+
 def get_staging_table_schema(table_name: str) -> str:
     """Gibt das CREATE TABLE DDL für eine spezifische Staging-Tabelle zurück."""
     base_columns = [
         "_op String",
         "_ts_ms DateTime64(3)",  
         "load_ts DateTime",
-    ]
+    ] + KAFKA_SOURCE_COLUMNS
     
     specific_columns = []
     order_by_clause = "ORDER BY tuple()" # Standard-Fallback
@@ -62,4 +69,36 @@ def get_staging_table_schema(table_name: str) -> str:
     )
     ENGINE = MergeTree()
     {order_by_clause};
-    """
\ No newline at end of file
+    """
+
+
+def get_staging_table_migrations(table_name: str) -> list[str]:
+    """Gibt die ALTER-Statements zurück, mit denen bestehende Staging-Tabellen auf das aktuelle Schema gebracht werden."""
+    return [
+        f"ALTER TABLE default_raw_seeds.stg_raw_{table_name} ADD COLUMN IF NOT EXISTS {column_ddl}"
+        for column_ddl in KAFKA_SOURCE_COLUMNS
+    ]
+
+
+# Ladeprotokoll der Lake-Dateien: eine Zeile pro Objekt und ETag, die jüngste Version (updated_at) gilt
+LOAD_LEDGER_TABLE = "default_raw_seeds.cdc_load_ledger"
+
+
+def get_load_ledger_schema() -> str:
+    """
+    Gibt das CREATE TABLE DDL des Ladeprotokolls zurück. Ohne TTL: Einträge werden nur über
+    compact_load_ledger entfernt, und zwar erst, wenn kein Lauf die Datei mehr findet.
+    """
+    return f"""
+    CREATE TABLE IF NOT EXISTS {LOAD_LEDGER_TABLE} (
+        object_key String,
+        etag String,
+        table_name LowCardinality(String),
+        status LowCardinality(String),
+        attempts UInt32,
+        error String,
+        updated_at DateTime64(3) DEFAULT now64(3)
+    )
+    ENGINE = ReplacingMergeTree(updated_at)
+    ORDER BY (object_key, etag);
+    """